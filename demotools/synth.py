@@ -9,9 +9,10 @@ import cgi
 #import cgitb; cgitb.enable()
 
 # import needed libraries:
-import os, sys,random,time
+import os, sys
 
 import ttslab_demo_client
+import ttslab_synthcache
 
 HTMLTEMPLATE = \
 """
@@ -54,35 +55,45 @@ Please try the latest Firefox! :-(
 </html>
 """
 
+def fail(message):
+    print "Content-Type: text/plain"
+    print
+    print "Synthesis failed: %s" % message
+    sys.exit(0)
+
+def outputnames(voicename, text, voiceversion):
+    basename = ttslab_synthcache.cache_key(unicode(voicename), text, voiceversion)
+    return [os.path.join("../output/", basename + ext) for ext in [".wav", "_syl.html", "_pitch.html", "_wave.html"]]
+
 form = cgi.FieldStorage(keep_blank_values=True)
-#DEMITASSE: change this later to use md5 and don't redo if exists...
-basename = "_".join([str(int(time.mktime(time.localtime()))),
-                     str(random.randint(0, 100)).zfill(3)])
 voicename = str(form.getvalue("voice"))
 text = unicode(form.getvalue("textinput"), encoding="utf-8")
-
 client = ttslab_demo_client.TTSClient(ttslab_demo_client.DEF_HOST, ttslab_demo_client.DEF_PORT)
-synthd = client.request("synth", voicename, text)
-
-wavfname = os.path.join("../output/", basename + ".wav")
-outfh = open(wavfname, "wb")
-outfh.write(synthd["wav"])
-outfh.close()
-
-sylfname = os.path.join("../output/", basename + "_syl.html")
-outfh = open(sylfname, "wb")
-outfh.write(synthd["syl_html"])
-outfh.close()
+#outputs are named by voice (name and version on the server) and
+#(normalised) text, so identical requests are served from existing
+#files until the voice is reloaded:
+try:
+    voiceversions = client.voiceversions()
+except Exception, e:
+    fail(e)
+if voicename not in voiceversions:
+    fail("Unknown voice: %s" % voicename)
+wavfname, sylfname, pitchfname, wavefname = outputnames(voicename, text, voiceversions[voicename])
 
-pitchfname = os.path.join("../output/", basename + "_pitch.html")
-outfh = open(pitchfname, "wb")
-outfh.write(synthd["pitch_html"])
-outfh.close()
+if not all(os.path.isfile(fname) for fname in [wavfname, sylfname, pitchfname, wavefname]):
+    synthd = client.request("synth", voicename, text)
+    if not isinstance(synthd, dict):
+        fail(synthd)
+    #the voice may have been reloaded since it was listed:
+    wavfname, sylfname, pitchfname, wavefname = outputnames(voicename, text, synthd["voiceversion"])
 
-wavefname = os.path.join("../output/", basename + "_wave.html")
-outfh = open(wavefname, "wb")
-outfh.write(synthd["wave_html"])
-outfh.close()
+    #write and rename so that concurrent requests never see partial files:
+    for fname, key in [(wavfname, "wav"), (sylfname, "syl_html"), (pitchfname, "pitch_html"), (wavefname, "wave_html")]:
+        tempfname = "%s.%s.tmp" % (fname, os.getpid())
+        outfh = open(tempfname, "wb")
+        outfh.write(synthd[key])
+        outfh.close()
+        os.rename(tempfname, fname)
 
 # This needs to be here first.
 print "Content-Type: text/html"     # Just set the standard html content type.
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Load generator for the demo TTS server: replays a text corpus (one
+    utterance per line) with a fixed number of concurrent clients
+    (closed loop) or at a fixed request rate (open loop) and reports
+    latency percentiles, throughput, time to first chunk (streaming)
+    and error rate. Results (including server metrics before and after
+    the run) are saved as JSON for comparison between server
+    configurations...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import sys
+import math
+import time
+import json
+import codecs
+import threading
+import itertools
+
+from ttslab_demo_client import TTSClient, DEF_HOST, DEF_PORT
+
+DEF_CONCURRENCY = 4
+PERCENTILES = [50, 95, 99]
+
+
+def load_corpus(filename):
+    with codecs.open(filename, encoding="utf-8") as infh:
+        return [line.strip() for line in infh if line.strip()]
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of 'values' (None if empty)...
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+class Benchmark(object):
+    """ Sends requests for texts from the corpus (cycled as needed) and
+        collects one record per request: {"start", "latency", "ttfb",
+        "ok", "error"} with times in seconds relative to the start of
+        the run...
+    """
+
+    def __init__(self, client, voicename, texts, stream=False, artefacts=None):
+        self.client = client
+        self.voicename = voicename
+        self.texts = texts
+        self.stream = stream
+        self.artefacts = artefacts
+        self.records = []
+        self.lock = threading.Lock()
+        self.starttime = None
+
+    def request(self, text, scheduled=None):
+        """ Latency is measured from the 'scheduled' time if given (in
+            open loop runs a late request counts as slow)...
+        """
+        starttime = time.time()
+        if scheduled is None:
+            scheduled = starttime
+        record = {"start": scheduled - self.starttime, "ttfb": None, "ok": False, "error": None}
+        try:
+            if self.stream:
+                for reply in self.client.synthstream(self.voicename, text):
+                    if record["ttfb"] is None:
+                        record["ttfb"] = time.time() - scheduled
+                record["ok"] = True
+            else:
+                reply = self.client.request("synth", self.voicename, text, self.artefacts)
+                if isinstance(reply, dict):
+                    record["ok"] = True
+                else:
+                    record["error"] = reply
+        except Exception, e:
+            record["error"] = unicode(e)
+        record["latency"] = time.time() - scheduled
+        with self.lock:
+            self.records.append(record)
+
+    def run_closed(self, numrequests, concurrency):
+        """ 'concurrency' clients each send their next request as soon
+            as the previous one is answered...
+        """
+        texts = itertools.islice(itertools.cycle(self.texts), numrequests)
+        textlock = threading.Lock()
+        def client():
+            while True:
+                with textlock:
+                    text = next(texts, None)
+                if text is None:
+                    break
+                self.request(text)
+        self.starttime = time.time()
+        threads = [threading.Thread(target=client) for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.time() - self.starttime
+
+    def run_open(self, numrequests, rate):
+        """ Requests are started at 'rate' per second regardless of how
+            long previous requests take...
+        """
+        self.starttime = time.time()
+        threads = []
+        for i, text in enumerate(itertools.islice(itertools.cycle(self.texts), numrequests)):
+            scheduled = self.starttime + i / rate
+            delay = scheduled - time.time()
+            if delay > 0.0:
+                time.sleep(delay)
+            t = threading.Thread(target=self.request, args=(text, scheduled))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        return time.time() - self.starttime
+
+    def summary(self, walltime):
+        ok = [r for r in self.records if r["ok"]]
+        latencies = [r["latency"] for r in ok]
+        ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+        errors = {}
+        for r in self.records:
+            if not r["ok"]:
+                errors[r["error"]] = errors.get(r["error"], 0) + 1
+        summary = {"requests": len(self.records),
+                   "ok": len(ok),
+                   "errorrate": (len(self.records) - len(ok)) / len(self.records) if self.records else 0.0,
+                   "errors": errors,
+                   "walltime": walltime,
+                   "throughput": len(ok) / walltime if walltime > 0.0 else 0.0,
+                   "latency_mean": sum(latencies) / len(latencies) if latencies else None}
+        for p in PERCENTILES:
+            summary["latency_p%s" % p] = percentile(latencies, p)
+            if self.stream:
+                summary["ttfb_p%s" % p] = percentile(ttfbs, p)
+        return summary
+
+
+def server_stats(client):
+    try:
+        return client.stats()
+    except Exception, e:   #e.g. older server
+        print("WARNING: could not get server stats: %s" % e, file=sys.stderr)
+        return None
+
+
+def print_summary(summary):
+    print("%(requests)s requests, %(ok)s ok (error rate %(errorrate).3f) in %(walltime).2fs: %(throughput).2f requests/s" % summary)
+    fmt = lambda v: "-" if v is None else "%.3fs" % v
+    print("latency: " + ", ".join("p%s %s" % (p, fmt(summary["latency_p%s" % p])) for p in PERCENTILES))
+    if "ttfb_p50" in summary:
+        print("first chunk: " + ", ".join("p%s %s" % (p, fmt(summary["ttfb_p%s" % p])) for p in PERCENTILES))
+    for error, count in sorted(summary["errors"].items()):
+        print("error (%s): %s" % (count, error))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('voicename', metavar='VOICENAME', type=str)
+    parser.add_argument('corpusfile', metavar='CORPUSFILE', type=str, help="texts (one per line, UTF-8)")
+    parser.add_argument('--host', type=str, default=DEF_HOST)
+    parser.add_argument('--port', type=int, default=DEF_PORT)
+    parser.add_argument('--requests', type=int, help="number of requests (default: one per text)")
+    parser.add_argument('--concurrency', type=int, default=DEF_CONCURRENCY, help="concurrent clients (closed loop)")
+    parser.add_argument('--rate', type=float, help="requests per second (open loop, overrides --concurrency)")
+    parser.add_argument('--stream', action="store_true", help="use streaming synthesis (reports time to first chunk)")
+    parser.add_argument('--artefacts', type=str, nargs="+", help="artefacts to request (e.g. wav)")
+    parser.add_argument('--warmup', type=int, default=0, help="requests sent (and not counted) before the run")
+    parser.add_argument('--output', type=str, help="save results to this JSON file")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpusfile)
+    numrequests = args.requests or len(texts)
+    client = TTSClient(args.host, args.port, maxidle=max(args.concurrency, 1))
+
+    if args.warmup:
+        warmup = Benchmark(client, args.voicename, texts, args.stream, args.artefacts)
+        warmup.run_closed(args.warmup, args.concurrency)
+    bench = Benchmark(client, args.voicename, texts, args.stream, args.artefacts)
+    statsbefore = server_stats(client)
+    if args.rate:
+        walltime = bench.run_open(numrequests, args.rate)
+    else:
+        walltime = bench.run_closed(numrequests, args.concurrency)
+    statsafter = server_stats(client)
+    summary = bench.summary(walltime)
+    print_summary(summary)
+
+    if args.output:
+        results = {"config": {"host": args.host,
+                              "port": args.port,
+                              "voicename": args.voicename,
+                              "corpusfile": args.corpusfile,
+                              "requests": numrequests,
+                              "mode": "open" if args.rate else "closed",
+                              "concurrency": None if args.rate else args.concurrency,
+                              "rate": args.rate,
+                              "stream": args.stream,
+                              "artefacts": args.artefacts,
+                              "warmup": args.warmup},
+                   "summary": summary,
+                   "records": sorted(bench.records, key=lambda r: r["start"]),
+                   "serverstats_before": statsbefore,
+                   "serverstats_after": statsafter}
+        with open(args.output, "w") as outfh:
+            json.dump(results, outfh, indent=2, sort_keys=True)
+    client.close()
@@ -11,53 +11,169 @@ import os
 import sys
 import socket
 import time
-import cPickle as pickle
+import threading
 import codecs
+import wave
+import json
 from optparse import OptionParser
 
+from ttslab_demo_protocol import read_message, write_message
+
 
 NAME = "client.py"
 DEF_HOST = "localhost"
 DEF_PORT = 22223
+DEF_MAXIDLE = 8
 
 class TTSClient(object):
-    END_OF_MESSAGE_STRING = b"<EoM>"
+    """ Keeps a pool of open connections to the server, so that
+        consecutive (and concurrent) requests do not need to connect
+        again...
+    """
 
-    def __init__(self, host=DEF_HOST, port=DEF_PORT, recv_size=1024):
+    def __init__(self, host=DEF_HOST, port=DEF_PORT, maxidle=DEF_MAXIDLE, timeout=None):
         self.host = host
         self.port = port
-        self.recv_size = recv_size
+        self.maxidle = maxidle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
 
-    def request(self, requesttype, voicename=None, text=None):
+    def _getconnection(self):
+        """ Returns (connection, whether it was used before)...
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return socket.create_connection((self.host, self.port), self.timeout), False
+
+    def _putconnection(self, s):
+        with self._lock:
+            if len(self._idle) < self.maxidle:
+                self._idle.append(s)
+                return
+        s.close()
+
+    def close(self):
+        with self._lock:
+            for s in self._idle:
+                s.close()
+            self._idle = []
+
+    def _send(self, message):
+        """ Send 'message' and read the (first) reply, returns
+            (connection, reply)...
+        """
+        while True:
+            s, reused = self._getconnection()
+            try:
+                write_message(s, message)
+                reply = read_message(s)
+            except Exception:
+                s.close()
+                if reused:    #server may have closed an idle connection
+                    continue
+                raise
+            if reply is None:
+                s.close()
+                if reused:
+                    continue
+                raise Exception("Connection closed by server...")
+            return s, reply
+
+    def request(self, requesttype, voicename=None, text=None, artefacts=None):
+        """ Returns the reply fields, or the message string if the
+            request failed. For synthesis 'artefacts' selects the
+            results needed (e.g. ["wav"] to skip rendering graphs, by
+            default the server returns "wav" and "graphs")...
+        """
         #create message
         message = {"type": requesttype,
                    "voicename": voicename,
                    "text": text}
-        fulls = pickle.dumps(message)
-        #create a socket
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        #connect to server
-        s.connect((self.host, self.port))
-        #send..
-        s.sendall(fulls)
-        s.sendall(TTSClient.END_OF_MESSAGE_STRING)
-        #read confirmation..
-        msgfull = b""
-        while True:
-            msgpart = s.recv(self.recv_size)
-            if msgpart:
-                msgfull += msgpart
-            else:
-                break
-        #close connection..
-        s.close()
+        if artefacts is not None:
+            message["artefacts"] = list(artefacts)
+        s, reply = self._send(message)
+        self._putconnection(s)
         #recover reply..
-        reply = pickle.loads(msgfull)
+        if reply.pop("status") != "ok":
+            return reply["message"]
         return reply
 
+    def synthstream(self, voicename, text, split="phrase", pipeline=True):
+        """ Generates the reply messages of a streaming synthesis
+            request as they arrive: chunks ("pcm", "samplerate", ...)
+            followed by a message with "end" set. Each message gets
+            the time since the request was sent as "elapsed"...
+        """
+        message = {"type": "synthstream",
+                   "voicename": voicename,
+                   "text": text,
+                   "split": split,
+                   "pipeline": pipeline}
+        starttime = time.time()
+        s, reply = self._send(message)
+        complete = False
+        try:
+            while True:
+                reply["elapsed"] = time.time() - starttime
+                if reply.pop("status") != "ok":
+                    complete = True
+                    raise Exception(reply["message"])
+                if reply.get("end"):
+                    complete = True
+                    yield reply
+                    break
+                yield reply
+                reply = read_message(s)
+                if reply is None:
+                    raise Exception("Connection closed by server...")
+        finally:
+            #connection can only be reused if the stream was consumed
+            if complete:
+                self._putconnection(s)
+            else:
+                s.close()
+
 
     def listvoices(self):
-        return self.request("listvoices")
+        reply = self.request("listvoices")
+        if not isinstance(reply, dict):
+            raise Exception(reply)
+        return reply["voices"]
+
+    def voiceversions(self):
+        """ Version of each loaded voice (changes when a voice is
+            reloaded from an updated file)...
+        """
+        reply = self.request("listvoices")
+        if not isinstance(reply, dict):
+            raise Exception(reply)
+        return reply["voiceversions"]
+
+    def reloadvoice(self, voicename):
+        """ Have the server load 'voicename' again from its file...
+        """
+        reply = self.request("reloadvoice", voicename)
+        if not isinstance(reply, dict):
+            raise Exception(reply)
+
+    def stats(self):
+        """ Server metrics: latency histograms per stage, counters,
+            throughput, requests in progress, queue and cache...
+        """
+        reply = self.request("stats")
+        if not isinstance(reply, dict):
+            raise Exception(reply)
+        return reply
+
+    def memoryreport(self):
+        """ Memory use (kB) of the server and its worker processes...
+        """
+        reply = self.request("memory")
+        if not isinstance(reply, dict):
+            raise Exception(reply)
+        return reply
 
 
 def setopts():
@@ -83,10 +199,51 @@ def setopts():
                       action="store_true",
                       dest="listvoices",
                       help="Request a list of loaded voices from the server.")
+    parser.add_option("-r",
+                      "--reload",
+                      dest="reloadvoice",
+                      help="Reload a voice on the server (e.g. after updating the voice file).",
+                      metavar="VOICENAME")
+    parser.add_option("-m",
+                      "--memory",
+                      action="store_true",
+                      dest="memory",
+                      help="Report memory use of the server and its worker processes.")
+    parser.add_option("-t",
+                      "--stats",
+                      action="store_true",
+                      dest="stats",
+                      help="Print server metrics (JSON).")
+    parser.add_option("-s",
+                      "--stream",
+                      dest="streamfile",
+                      help="Synthesize (streaming) and save the audio to a wave file, reporting time to first chunk.",
+                      metavar="WAVFILE")
     return parser
 
 
-#only lists voices:
+def save_stream(client, voicename, text, wavfilename):
+    """ Write streamed PCM chunks to a wave file as they arrive,
+        returns the final ("end") message...
+    """
+    outwav = None
+    try:
+        for reply in client.synthstream(voicename, text):
+            if reply.get("end"):
+                return reply
+            if outwav is None:
+                outwav = wave.open(wavfilename, "wb")
+                outwav.setnchannels(1)
+                outwav.setsampwidth(2)
+                outwav.setframerate(reply["samplerate"])
+                print("First chunk after %.3fs" % reply["elapsed"])
+            outwav.writeframes(reply["pcm"])
+            print("Chunk %s after %.3fs: %s" % (reply["chunk"], reply["elapsed"], reply["text"]))
+    finally:
+        if outwav is not None:
+            outwav.close()
+
+
 if __name__ == "__main__":
     #set CLI options..
     parser = setopts()
@@ -100,5 +257,22 @@ if __name__ == "__main__":
     if opts.listvoices:
         voicelist = client.listvoices()
         print("\n".join(voicelist))
+    elif opts.reloadvoice:
+        client.reloadvoice(opts.reloadvoice)
+        print("Voice '%s' reloaded." % opts.reloadvoice)
+    elif opts.stats:
+        print(json.dumps(client.stats(), indent=2, sort_keys=True))
+    elif opts.memory:
+        report = client.memoryreport()
+        print("server: RSS %(rss)s kB (PSS %(pss)s kB)" % report["server"])
+        for poolname in ["workers", "vizworkers"]:
+            for mem in report[poolname]:
+                print("%s %s: RSS %s kB (%s kB shared, %s kB private, PSS %s kB)" %
+                      (poolname, mem["pid"], mem["rss"], mem["shared"], mem["private"], mem["pss"]))
+    elif opts.streamfile and len(args) == 2:
+        voicename, text = args[0], args[1].decode("utf-8")
+        end = save_stream(client, voicename, text, opts.streamfile)
+        print("%s chunk(s): first chunk after %.3fs on server, total %.3fs on server, %.3fs on client" %
+              (end["numchunks"], end["ttfb"] or 0.0, end["totaltime"], end["elapsed"]))
     else:
-        pass
+        parser.print_help()
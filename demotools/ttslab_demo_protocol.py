@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+""" Wire protocol for the demo TTS server and client.
+
+    Every message is a frame:
+
+      MAGIC (4 bytes) | body length (uint32) | body
+
+    and the body is a sequence of typed, named fields:
+
+      number of fields (uint16)
+      per field: name length (uint8) | name (utf-8) |
+                 type (1 byte) | value length (uint32) | value
+
+    with types: b (raw bytes), u (utf-8 text), i (int64), f (float64),
+    t (boolean), n (None) and j (JSON, for lists and dicts). Integers
+    are big-endian. Binary data (e.g. wav) is sent as is, nothing is
+    pickled. Connections are persistent: a client may send any number
+    of requests on a connection, each answered by one or more reply
+    messages...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import json
+import struct
+
+MAGIC = b"TTS1"
+FRAME_HEADER = struct.Struct(">4sI")
+NUMFIELDS = struct.Struct(">H")
+NAMELEN = struct.Struct(">B")
+FIELD_HEADER = struct.Struct(">cI")
+INT = struct.Struct(">q")
+FLOAT = struct.Struct(">d")
+MAX_MESSAGE_SIZE = 2**30
+
+TYPE_BYTES = b"b"
+TYPE_TEXT = b"u"
+TYPE_INT = b"i"
+TYPE_FLOAT = b"f"
+TYPE_BOOL = b"t"
+TYPE_NONE = b"n"
+TYPE_JSON = b"j"
+
+
+def _encode_value(value):
+    """ Returns (type, encoded value)...
+    """
+    if value is None:
+        return TYPE_NONE, b""
+    elif isinstance(value, bool):
+        return TYPE_BOOL, b"\x01" if value else b"\x00"
+    elif isinstance(value, bytes):
+        return TYPE_BYTES, value
+    elif isinstance(value, unicode):
+        return TYPE_TEXT, value.encode("utf-8")
+    elif isinstance(value, (int, long)):
+        return TYPE_INT, INT.pack(value)
+    elif isinstance(value, float):
+        return TYPE_FLOAT, FLOAT.pack(value)
+    else:
+        return TYPE_JSON, json.dumps(value).encode("utf-8")
+
+
+def _decode_value(fieldtype, data):
+    if fieldtype == TYPE_NONE:
+        return None
+    elif fieldtype == TYPE_BOOL:
+        return data != b"\x00"
+    elif fieldtype == TYPE_BYTES:
+        return data
+    elif fieldtype == TYPE_TEXT:
+        return data.decode("utf-8")
+    elif fieldtype == TYPE_INT:
+        return INT.unpack(data)[0]
+    elif fieldtype == TYPE_FLOAT:
+        return FLOAT.unpack(data)[0]
+    elif fieldtype == TYPE_JSON:
+        return json.loads(data.decode("utf-8"))
+    raise Exception("Unknown field type: %r" % fieldtype)
+
+
+def encode_message(message):
+    """ Frame for 'message' (a dict with text keys)...
+    """
+    parts = [NUMFIELDS.pack(len(message))]
+    for name, value in message.iteritems():
+        name = name.encode("utf-8")
+        fieldtype, data = _encode_value(value)
+        parts.extend([NAMELEN.pack(len(name)), name, FIELD_HEADER.pack(fieldtype, len(data)), data])
+    body = b"".join(parts)
+    if len(body) > MAX_MESSAGE_SIZE:
+        raise Exception("Message too large (%s bytes)..." % len(body))
+    return FRAME_HEADER.pack(MAGIC, len(body)) + body
+
+
+def decode_body(body):
+    message = {}
+    pos = NUMFIELDS.size
+    for i in range(NUMFIELDS.unpack_from(body, 0)[0]):
+        namelen = NAMELEN.unpack_from(body, pos)[0]
+        pos += NAMELEN.size
+        name = body[pos:pos + namelen].decode("utf-8")
+        pos += namelen
+        fieldtype, datalen = FIELD_HEADER.unpack_from(body, pos)
+        pos += FIELD_HEADER.size
+        if pos + datalen > len(body):
+            raise Exception("Truncated field '%s'..." % name)
+        message[name] = _decode_value(fieldtype, body[pos:pos + datalen])
+        pos += datalen
+    if pos != len(body):
+        raise Exception("Unexpected data after last field...")
+    return message
+
+
+def recv_exactly(sock, size):
+    """ Reads exactly 'size' bytes into a preallocated buffer. Returns
+        None if the connection is closed before the first byte...
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:], size - pos)
+        if n == 0:
+            if pos == 0:
+                return None
+            raise Exception("Connection closed in the middle of a message...")
+        pos += n
+    return bytes(buf)
+
+
+def read_message(sock):
+    """ Returns the next message on 'sock' or None if the connection
+        was closed cleanly (between messages)...
+    """
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    magic, bodylen = FRAME_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise Exception("Invalid message header (unsupported protocol?)...")
+    if bodylen > MAX_MESSAGE_SIZE:
+        raise Exception("Message too large (%s bytes)..." % bodylen)
+    body = recv_exactly(sock, bodylen)
+    if body is None:
+        raise Exception("Connection closed in the middle of a message...")
+    return decode_body(body)
+
+
+def write_message(sock, message):
+    sock.sendall(encode_message(message))
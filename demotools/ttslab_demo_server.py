@@ -8,135 +8,917 @@ __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
 import os, sys
+import re
+import time
+import signal
 import ConfigParser as configparser
 import socket
-import cPickle as pickle
+import select
 import threading
-import tempfile
+import Queue
+import multiprocessing
 import logging
+from functools import partial
+
+import numpy as np
 
 import ttslab
+from ttslab.hrg import Utterance
 import uttviz_d3 as uttviz
+from wav2psmfcc import wave_bytes
+from ttslab_synthcache import SynthCache, DEF_MAXENTRIES, DEF_MAXBYTES
+from ttslab_demo_protocol import read_message, write_message
+from ttslab_metrics import Metrics, dump_stats
 
 NAME = "ttslab_demo_server.py"
 DEF_LOG = os.path.join(os.environ.get("HOME"), ".ttslab/demo_server.log")
 DEF_LOGLEVEL = 20
 
-END_OF_MESSAGE_STRING = b"<EoM>"
 DEFAULT_PORT = 22223
+DEF_NUMWORKERS = multiprocessing.cpu_count()
+DEF_NUMVIZWORKERS = max(1, DEF_NUMWORKERS // 2)
+DEF_NUMHANDLERS = 2 * DEF_NUMWORKERS   #requests in progress
+DEF_QUEUESIZE = 32                     #requests waiting for a handler
+DEF_MAXCONNECTIONS = 256               #open (idle) client connections
+DEF_IDLETIMEOUT = 60.0                 #seconds before idle connections are closed
+DEF_TIMEOUT = 30.0                     #seconds from accept to reply
+DEF_RXTIMEOUT = 10.0                   #seconds to wait for request data
+DEF_BATCHWINDOW = 0.0                  #seconds to collect a batch (0: no batching)
+DEF_BATCHSIZE = 8                      #maximum requests per batch
+LISTEN_BACKLOG = 64
+REJECT_TIMEOUT = 0.5                   #seconds to read a rejected request
+REJECT_QUEUESIZE = 64                  #rejected connections waiting for a reply
+POLL_INTERVAL = 1.0
+STATS_DUMP_INTERVAL = 60.0
+
+#streaming: split after sentence (or phrase) punctuation
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+", re.UNICODE)
+PHRASE_BREAK = re.compile(r"(?<=[.!?,;:])\s+", re.UNICODE)
+PCM_FORMAT = "s16le"
+ARTEFACTS = ["wav", "graphs"]
+DEF_ARTEFACTS = ARTEFACTS
+
+BUSY_MESSAGE = "Server busy, please try again later..."
+TIMEOUT_MESSAGE = "Synthesis timed out..."
+
+log = logging.getLogger(NAME)
+
+
+########## SYNTHESIS WORKERS
+#voices are loaded once in the server process, worker processes are
+#forked afterwards and share the voice data (copy-on-write)...
+VOICES = {}
+
+def load_voice(name, voice_location):
+    log.info("Loading voice from file '%s'" % (voice_location))
+    starttime = time.time()
+    voice = ttslab.fromfile(voice_location)
+    log.info("Voice '%s' loaded in %.2fs." % (name, time.time() - starttime))
+    return voice
+
+def init_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  #parent handles shutdown
+
+def timed_synthesize(voice, text, processname="text-to-wave"):
+    """ Does what voice.synthesize() does, running the voice's
+        utterance processors for the process in turn, but also returns
+        the duration of each ("synthesis:<uttprocessor>", e.g.
+        "synthesis:tokenizer" or "synthesis:synthesizer") and the total
+        ("synthesis")...
+    """
+    starttime = time.time()
+    utt = Utterance(voice, text)
+    utt["history"] = [processname]
+    timings = {}
+    for uttprocname, uttprocprocess in voice.processes[processname].iteritems():
+        procstart = time.time()
+        utt = getattr(voice, uttprocname)(utt, uttprocprocess)
+        timings["synthesis:%s" % uttprocname] = time.time() - procstart
+    timings["synthesis"] = time.time() - starttime
+    return utt, timings
+
+def synthesize(voice, text, keeputt=False):
+    """ Returns {"wav": wav file contents, "utt": utterance or None,
+        "timings": stage durations}, the utterance is kept (segment
+        names mapped for display) if graphs are to be rendered...
+    """
+    utt, timings = timed_synthesize(voice, text)
+    starttime = time.time()
+    #encode wav blob in memory (don't want dependencies on webserver)
+    wavblob = wave_bytes(utt["waveform"].samples, utt["waveform"].samplerate)
+    timings["wavencoding"] = time.time() - starttime
+    if not keeputt:
+        return {"wav": wavblob, "utt": None, "timings": timings}
+    for seg in utt.gr("Segment"):
+        seg["name"] = voice.phonemap[seg["name"]]
+    return {"wav": wavblob, "utt": utt, "timings": timings}
+
+def worker_synth(args):
+    voicename, text, keeputt = args
+    return synthesize(VOICES[voicename], text, keeputt)
+
+def worker_synth_batch(args):
+    """ Synthesises a batch of (text, keeputt) for one voice, returns a
+        list of ("ok", result) or ("error", message) so that one failure
+        does not fail the whole batch. The task itself does not fail
+        (its callback always runs)...
+    """
+    voicename, items = args
+    try:
+        voice = VOICES[voicename]
+    except KeyError:
+        return [("error", "Unknown voice: %s" % (voicename))] * len(items)
+    results = []
+    for text, keeputt in items:
+        try:
+            results.append(("ok", synthesize(voice, text, keeputt)))
+        except Exception, e:
+            results.append(("error", str(e)))
+    return results
+
+def worker_render(utt):
+    """ Graphs are rendered in a separate pool, so that audio requests
+        do not wait for visualisation...
+    """
+    starttime = time.time()
+    syl_html, pitch_html, wave_html = uttviz.draw_sylstruct_graph_pitch_waveform_html(utt)
+    return {"syl_html": syl_html, "pitch_html": pitch_html, "wave_html": wave_html}, time.time() - starttime
+
+def synthesize_pcm(voice, text):
+    """ Returns (samplerate, raw 16-bit little-endian samples, stage
+        durations)...
+    """
+    utt, timings = timed_synthesize(voice, text)
+    starttime = time.time()
+    waveform = utt["waveform"]
+    pcm = np.asarray(waveform.samples).astype("<i2").tostring()
+    timings["wavencoding"] = time.time() - starttime
+    return waveform.samplerate, pcm, timings
+
+def worker_synth_pcm(args):
+    voicename, text = args
+    return synthesize_pcm(VOICES[voicename], text)
+
+def worker_task(args):
+    """ Runs func(funcargs) and returns ("ok", result) or ("error",
+        message), so that the task does not fail and its callback
+        always runs...
+    """
+    func, funcargs = args
+    try:
+        return ("ok", func(funcargs))
+    except Exception, e:
+        return ("error", str(e))
+########## SYNTHESIS WORKERS
+
+
+class PendingResult(object):
+    """ Result of a task sent to the workers, get() returns it like
+        AsyncResult.get()...
+    """
+
+    def __init__(self):
+        self.status = None
+        self.result = None
+        self.done = threading.Event()
+
+    def set(self, status, result):
+        self.status = status
+        self.result = result
+        self.done.set()
+
+    def get(self, timeout):
+        self.done.wait(timeout)
+        if not self.done.is_set() or self.status == "timeout":
+            raise multiprocessing.TimeoutError()
+        if self.status != "ok":
+            raise Exception(self.result)
+        return self.result
+
+
+class BatchedRequest(PendingResult):
+    """ A request waiting in (or sent with) a batch...
+    """
+
+    def __init__(self, text, keeputt, deadline):
+        PendingResult.__init__(self)
+        self.text = text
+        self.keeputt = keeputt
+        self.deadline = deadline
+        self.arrival = time.time()
+
+
+def deliver(requests, results):
+    for request, (status, result) in zip(requests, results):
+        request.set(status, result)
+
+
+class BoundedPool(object):
+    """ Submits tasks to a worker pool, at most 'maxtasks' at a time:
+        the pool's own task queue is unbounded and a task keeps running
+        after its request timed out, so without a bound the handlers
+        could keep adding work to an overloaded pool. submit() waits
+        (up to 'timeout') for one of the slots, which is freed when the
+        task's callback runs. Tasks must not fail (see worker_task),
+        Pool.apply_async() has no error callback...
+    """
+
+    def __init__(self, getpool, maxtasks):
+        self.getpool = getpool     #pool may be replaced (voice reload)
+        self.free = maxtasks
+        self.cond = threading.Condition()
+
+    def submit(self, func, args, callback, timeout, pool=None):
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.free <= 0:
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    raise multiprocessing.TimeoutError()
+                self.cond.wait(remaining)
+            self.free -= 1
+        try:
+            #callback runs in the pool's result thread (and wakes
+            #every waiting handler, unlike AsyncResult.get()):
+            (pool or self.getpool()).apply_async(func, (args,), callback=partial(self._done, callback))
+        except Exception:
+            self._release()
+            raise
+
+    def _done(self, callback, result):
+        self._release()
+        callback(result)
+
+    def _release(self):
+        with self.cond:
+            self.free += 1
+            self.cond.notify()
+
+    def call(self, func, args, timeout, pool=None):
+        """ Submits func(args) (see worker_task), returns a
+            PendingResult...
+        """
+        pending = PendingResult()
+        self.submit(worker_task, (func, args), lambda result: pending.set(*result), timeout, pool)
+        return pending
+
+
+class SynthBatcher(object):
+    """ Groups synthesis requests for the same voice into batches that
+        are synthesised by one worker each (one task instead of one per
+        request, saving the per-task dispatch and transfer overhead
+        when many short requests arrive together). A batch is sent when
+        it is full ('maxsize' requests), 'window' seconds after its
+        first request or when no further request arrived for 'gap'
+        seconds (default: window / maxsize), so that a lone request
+        does not wait for the whole window...
+    """
+
+    def __init__(self, workers, window, maxsize=DEF_BATCHSIZE, gap=None, metrics=None):
+        self.workers = workers     #BoundedPool
+        self.window = window
+        self.maxsize = maxsize
+        self.gap = window / maxsize if gap is None else gap
+        self.metrics = metrics
+        self.pending = {}          #voicename -> [BatchedRequest, ...]
+        self.lock = threading.Lock()
+
+    def submit(self, voicename, text, keeputt, deadline):
+        request = BatchedRequest(text, keeputt, deadline)
+        with self.lock:
+            batch = self.pending.get(voicename)
+            if batch is None:
+                batch = []
+                self.pending[voicename] = batch
+                timer = threading.Thread(target=self._wait, args=(voicename, batch))
+                timer.daemon = True
+                timer.start()
+            batch.append(request)
+            full = len(batch) >= self.maxsize
+        if full:
+            self._flush(voicename, batch)
+        return request
+
+    def _wait(self, voicename, batch):
+        """ Sends the batch when the window has passed or no request
+            was added during the last 'gap' seconds...
+        """
+        while True:
+            with self.lock:
+                if self.pending.get(voicename) is not batch:   #already sent (full)
+                    return
+                due = min(batch[0].arrival + self.window, batch[-1].arrival + self.gap)
+            remaining = due - time.time()
+            if remaining <= 0.0:
+                break
+            time.sleep(remaining)
+        self._flush(voicename, batch)
+
+    def _flush(self, voicename, batch):
+        with self.lock:
+            if self.pending.get(voicename) is not batch:   #already sent
+                return
+            del self.pending[voicename]
+        try:
+            self.workers.submit(worker_synth_batch, (voicename, [(r.text, r.keeputt) for r in batch]),
+                                partial(deliver, batch), max(r.deadline for r in batch) - time.time())
+        except multiprocessing.TimeoutError:   #no worker became free
+            for request in batch:
+                request.set("timeout", None)
+            return
+        except Exception, e:   #e.g. pool closed by a voice reload
+            message = "Sending batch failed: %r" % (e)
+            log.error(message)
+            for request in batch:
+                request.set("error", message)
+            return
+        if self.metrics is not None:
+            self.metrics.count("batches")
+            self.metrics.count("batcheditems", increment=len(batch))
+
 
 class TTSServer(object):
+    """ Connections are persistent and watched (select) in the main
+        thread, each incoming request is queued for a fixed number of
+        handler threads (bounded queue, requests are rejected when it
+        is full). Handlers do only I/O, synthesis runs in a pool of
+        worker processes forked after the voices are loaded (sharing
+        voice data), with at most one task per worker submitted at a
+        time (see BoundedPool). The pool is replaced when a voice is
+        reloaded...
+    """
     
-    def __init__(self, voicename=None, lport=DEFAULT_PORT):
+    def __init__(self, lport=DEFAULT_PORT, numworkers=DEF_NUMWORKERS, numhandlers=DEF_NUMHANDLERS,
+                 queuesize=DEF_QUEUESIZE, timeout=DEF_TIMEOUT, rxtimeout=DEF_RXTIMEOUT, cache=None,
+                 maxconnections=DEF_MAXCONNECTIONS, idletimeout=DEF_IDLETIMEOUT, numvizworkers=DEF_NUMVIZWORKERS,
+                 statsfile=None, batchwindow=DEF_BATCHWINDOW, batchsize=DEF_BATCHSIZE):
 
-        self.voices = {}
-        if voicename is not None:
-            self.loadvoice(voicename)
+        self.voicelocations = {}
+        self.voiceversions = {}
+        self.cache = cache
+        self.numworkers = numworkers
+        self.numvizworkers = numvizworkers
+        self.numhandlers = numhandlers
+        self.timeout = timeout
+        self.rxtimeout = rxtimeout
+        self.pool = None
+        self.vizpool = None
+        self.reloadlock = threading.Lock()
+        self.metrics = Metrics()
+        self.workers = BoundedPool(lambda: self.pool, numworkers)
+        self.vizworkers = BoundedPool(lambda: self.vizpool, numvizworkers)
+        if batchwindow > 0.0:
+            self.batcher = SynthBatcher(self.workers, batchwindow, batchsize, metrics=self.metrics)
+        else:
+            self.batcher = None
+        self.statsfile = statsfile
+        self.laststatsdump = time.time()
+        self.requests = Queue.Queue(maxsize=queuesize)
+        self.rejects = Queue.Queue(maxsize=REJECT_QUEUESIZE)
+        self.maxconnections = maxconnections
+        self.idletimeout = idletimeout
+        self.idle = {}        #connection -> (address, idle since)
+        self.idlelock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
         self._socksetup(lport)
         self.threads = []
         log.info("Server initialised.")
 
     def loadvoice(self, name, voice_location):
-        log.info("Loading voice from file '%s'" % (voice_location))
-        self.voices[name] = ttslab.fromfile(voice_location)
-        log.info("Voice '%s' loaded." % (name))
+        """ Voices are loaded in this process before the workers are
+            started (forked)...
+        """
+        self._setversion(name, self._loadvoice(name, voice_location))
+
+    def _loadvoice(self, name, voice_location):
+        """ Returns the version of the loaded voice...
+        """
+        if not os.path.isfile(voice_location):
+            raise Exception("Voice file '%s' not found..." % (voice_location))
+        st = os.stat(voice_location)
+        VOICES[name] = load_voice(name, voice_location)
+        self.voicelocations[name] = voice_location
+        return "%s:%s:%s" % (voice_location, st.st_size, st.st_mtime)
+
+    def _setversion(self, name, voiceversion):
+        self.voiceversions[name] = voiceversion
+        if self.cache is not None:
+            self.cache.setvoice(name, voiceversion)
+
+    def reloadvoice(self, name):
+        """ Loads voice 'name' again from its file and replaces the
+            synthesis workers (without restarting the server). Requests
+            in progress are completed by the old workers and keep the
+            previous voice version (their results are not cached). The
+            version changes only once the new workers are in place...
+        """
+        if name not in self.voicelocations:
+            return "Unknown voice: %s" % (name)
+        with self.reloadlock:
+            try:
+                voiceversion = self._loadvoice(name, self.voicelocations[name])
+            except Exception, e:
+                log.error("Reloading voice '%s' failed: %s" % (name, e))
+                return str(e)
+            oldpool = self.pool
+            self.pool = self._newpool(self.numworkers)
+            self._setversion(name, voiceversion)
+        oldpool.close()
+        reaper = threading.Thread(target=oldpool.join)
+        reaper.daemon = True
+        reaper.start()
+        log.info("Voice '%s' reloaded, %s new synthesis worker(s) started." % (name, self.numworkers))
+        return {"voicename": name}
+
+    def memoryreport(self):
+        """ Memory use (kB) of the server and each worker process:
+            voice data shared with the server shows up as "shared"
+            rather than "private" in the synthesis workers...
+        """
+        report = {"server": process_memory(os.getpid())}
+        for poolname, pool in [("workers", self.pool), ("vizworkers", self.vizpool)]:
+            report[poolname] = []
+            for process in pool._pool:
+                try:
+                    mem = process_memory(process.pid)
+                except (IOError, OSError):   #worker exited
+                    continue
+                mem["pid"] = process.pid
+                report[poolname].append(mem)
+        for mem in report["workers"]:
+            log.info("Synthesis worker %(pid)s: RSS %(rss)s kB (%(shared)s kB shared, %(private)s kB private, PSS %(pss)s kB)" % mem)
+        return report
+
+    def stats(self):
+        """ Metrics (latency per stage, counters, throughput), with
+            the current state of the request queue, connections and
+            cache...
+        """
+        stats = self.metrics.stats()
+        stats["queue"] = {"depth": self.requests.qsize(), "size": self.requests.maxsize}
+        with self.idlelock:
+            stats["idleconnections"] = len(self.idle)
+        stats["cache"] = self.cache.stats() if self.cache is not None else None
+        return stats
+
+    def dumpstats(self):
+        if self.statsfile is not None:
+            dump_stats(self.stats(), self.statsfile)
+        self.laststatsdump = time.time()
 
     def getvoicelist(self):
-        return self.voices.keys()
+        return self.voicelocations.keys()
+
+    def getvoiceversions(self):
+        """ Version of each voice (changes when the voice file is
+            updated and reloaded), clients storing synthesis results
+            should include this in their keys...
+        """
+        return dict(self.voiceversions)
 
     def _socksetup(self, lport):
         self.lsocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.lsocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.lport = lport
         self.lsocket.bind(("", self.lport))
 
+    def start(self):
+        log.info("Starting %s synthesis worker(s), %s visualisation worker(s) and %s handler(s)..." %
+                 (self.numworkers, self.numvizworkers, self.numhandlers))
+        self.pool = self._newpool(self.numworkers)
+        self.vizpool = self._newpool(self.numvizworkers)
+        for i in range(self.numhandlers):
+            c = TTSHandler(self)
+            c.start()
+            self.threads.append(c)
+        self.rejecter = TTSRejecter(self)
+        self.rejecter.start()
+
+    def _newpool(self, numprocesses):
+        return multiprocessing.Pool(processes=numprocesses, initializer=init_worker)
+
+    def stop(self):
+        for c in self.threads:
+            self.requests.put(None)
+        for c in self.threads: 
+            c.join()
+        self.threads = []
+        self.rejects.put(None)
+        self.rejecter.join()
+        for pool in [self.pool, self.vizpool]:
+            pool.terminate()
+            pool.join()
+        self.pool = None
+        self.vizpool = None
+        with self.idlelock:
+            for csocket in self.idle:
+                csocket.close()
+            self.idle = {}
+
+    def release(self, csocket, address):
+        """ Handlers return connections here after each request, the
+            connection is watched for the next request...
+        """
+        with self.idlelock:
+            self.idle[csocket] = (address, time.time())
+        os.write(self.wakeup_w, b"x")
+
+    def reject(self, csocket, address, keep=True):
+        """ Connections are rejected in a separate thread (reading the
+            request may block), or closed if too many are waiting to be
+            rejected...
+        """
+        self.metrics.count("rejected")
+        try:
+            self.rejects.put_nowait((csocket, address, keep))
+        except Queue.Full:
+            csocket.close()
+
     def run(self):
+        """ Watches the listening socket and all idle connections,
+            connections with a request waiting are queued for the
+            handlers (or rejected if the queue is full)...
+        """
+        self.start()
+        self.lsocket.listen(LISTEN_BACKLOG)
+        log.info("Waiting for connections...")
         while True:
             try:
-                log.info("Waiting for connections...")
-                self.lsocket.listen(5)
-                c = TTSHandler(self.lsocket.accept(), self) 
-                c.start() 
-                self.threads.append(c)
-                # print(self.threads)
+                self._poll()
             except KeyboardInterrupt:
                 log.info("received SIGINT, shutting down...")
                 break
         self.lsocket.close()
-        for c in self.threads: 
-            c.join()
+        self.stop()
+        self.dumpstats()
+
+    def _poll(self):
+        with self.idlelock:
+            watched = self.idle.keys()
+        readable = select.select([self.lsocket, self.wakeup_r] + watched, [], [], POLL_INTERVAL)[0]
+        now = time.time()
+        for sock in readable:
+            if sock is self.lsocket:
+                csocket, address = self.lsocket.accept()
+                log.info("Connection made %s" % (address,))
+                with self.idlelock:
+                    numconnections = len(self.idle)
+                if numconnections >= self.maxconnections:
+                    log.warning("Too many connections, rejecting connection from %s" % (address,))
+                    self.reject(csocket, address, keep=False)
+                else:
+                    self.release(csocket, address)
+            elif sock is self.wakeup_r:
+                os.read(self.wakeup_r, 4096)
+            else:
+                with self.idlelock:
+                    address, since = self.idle.pop(sock)
+                try:
+                    self.requests.put_nowait((sock, address, now))
+                except Queue.Full:
+                    log.warning("Request queue full, rejecting request from %s" % (address,))
+                    self.reject(sock, address)
+        #close connections that have been idle for too long:
+        with self.idlelock:
+            for csocket, (address, since) in self.idle.items():
+                if now - since > self.idletimeout:
+                    log.info("Closing idle connection %s" % (address,))
+                    del self.idle[csocket]
+                    csocket.close()
+        if self.statsfile is not None and now - self.laststatsdump > STATS_DUMP_INTERVAL:
+            self.dumpstats()
         
-    def synth(self, requestmsg):
+    def _cacheget(self, voicename, voiceversion, text, kind):
+        if self.cache is None:
+            return None
+        return self.cache.get(voicename, text, kind, voiceversion)
+
+    def _cacheput(self, voicename, voiceversion, text, kind, reply):
+        if self.cache is not None:
+            self.cache.put(voicename, text, reply, kind, voiceversion)
+
+    def synth(self, requestmsg, deadline=None):
+        starttime = time.time()
+        voicename = requestmsg.get("voicename")
+        self.metrics.begin("synth", voicename)
+        reply = self._synth(requestmsg, deadline)
+        if isinstance(reply, dict):
+            status = "ok"
+        elif reply == TIMEOUT_MESSAGE:
+            status = "timeout"
+        else:
+            status = "error"
+        self.metrics.end("synth", status, time.time() - starttime, voicename)
+        return reply
+
+    def _synth(self, requestmsg, deadline=None):
+        """ Runs synthesis in the worker pool, returns the reply
+            (message string on failure). The request lists the
+            "artefacts" needed ("wav" and/or "graphs", default both),
+            graphs are only rendered (in the visualisation pool) if
+            requested and not cached...
+        """
         log.info("Synthesis request: %s" % requestmsg)
+        voicename = requestmsg.get("voicename")
+        text = requestmsg.get("text")
+        if voicename not in self.voicelocations:
+            log.error("Synthesis failed: unknown voice '%s'" % (voicename))
+            return "Unknown voice: %s" % (voicename)
+        artefacts = requestmsg.get("artefacts") or DEF_ARTEFACTS
+        if isinstance(artefacts, basestring):
+            artefacts = [artefacts]
+        unknown = set(artefacts).difference(ARTEFACTS)
+        if unknown:
+            return "Unknown artefact(s): %s" % (", ".join(unknown))
+        #version when the request started (the voice may be reloaded
+        #while it is synthesised):
+        voiceversion = self.voiceversions[voicename]
+        reply = {"voiceversion": voiceversion}
+        if "wav" in artefacts:
+            reply.update(self._cacheget(voicename, voiceversion, text, "wav") or {})
+        if "graphs" in artefacts:
+            reply.update(self._cacheget(voicename, voiceversion, text, "graphs") or {})
+        needwav = "wav" in artefacts and "wav" not in reply
+        needgraphs = "graphs" in artefacts and "syl_html" not in reply
+        if not (needwav or needgraphs):
+            log.info("Synthesis successful (cached).")
+            self.metrics.count("synth_cached", voicename)
+            return reply
+        if deadline is None:
+            deadline = time.time() + self.timeout
         try:
-            utt = self.voices[requestmsg["voicename"]].synthesize(requestmsg["text"], "text-to-wave")
-            #dump to files and read blobs (don't want dependencies on webserver)
-            #wav:
-            wavfd, wavfn = tempfile.mkstemp(suffix=".wav")
-            utt["waveform"].write(wavfn)
-            os.close(wavfd)
-            wavf = open(wavfn, "rb")
-            wavblob = wavf.read()
-            wavf.close()
-            os.remove(wavfn)
-            #graphs:
-            for seg in utt.gr("Segment"):
-                seg["name"] = self.voices[requestmsg["voicename"]].phonemap[seg["name"]]
-            syl_html, pitch_html, wave_html = uttviz.draw_sylstruct_graph_pitch_waveform_html(utt)
+            remaining = deadline - time.time()
+            if remaining <= 0.0:
+                raise multiprocessing.TimeoutError()
+            #the worker keeps going if we time out (cannot be
+            #interrupted), but the handler is freed (submitting
+            #waits for a free worker, see BoundedPool)...
+            workerstart = time.time()
+            if self.batcher is not None:
+                pending = self.batcher.submit(voicename, text, needgraphs, deadline)
+            else:
+                pending = self.workers.call(worker_synth, (voicename, text, needgraphs), remaining)
+            result = pending.get(deadline - time.time())
+            self.metrics.record("synthworker", time.time() - workerstart)
+            self.metrics.recordall(result["timings"])
+            self._cacheput(voicename, voiceversion, text, "wav", {"wav": result["wav"]})
+            if "wav" in artefacts:
+                reply["wav"] = result["wav"]
+            if needgraphs:
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    raise multiprocessing.TimeoutError()
+                workerstart = time.time()
+                graphs, vistime = self.vizworkers.call(worker_render, result["utt"], remaining).get(deadline - time.time())
+                self.metrics.record("vizworker", time.time() - workerstart)
+                self.metrics.record("visualisation", vistime)
+                self._cacheput(voicename, voiceversion, text, "graphs", graphs)
+                reply.update(graphs)
+        except multiprocessing.TimeoutError:
+            log.error("Synthesis failed: timed out")
+            return TIMEOUT_MESSAGE
         except Exception, e:
             print(e)
             log.error("Synthesis failed: %s" % (e))
             return str(e)
         log.info("Synthesis successful.")
-        return {"wav": wavblob, "syl_html": syl_html, "pitch_html": pitch_html, "wave_html": wave_html}
+        if self.cache is not None:
+            log.info("Cache: %(hits)s hits, %(diskhits)s disk hits, %(misses)s misses, %(entries)s entries (%(bytes)s bytes)" % self.cache.stats())
+        return reply
+
+    def synthstream(self, requestmsg, starttime=None):
+        """ Generates reply messages: the text is split into phrases
+            (or sentences) that are synthesised in order, each is sent
+            as a chunk of PCM samples as soon as it is done. Phrases
+            are synthesised concurrently by the workers unless
+            "pipeline" is false in the request. The last message
+            reports the time to the first chunk...
+        """
+        log.info("Streaming synthesis request: %s" % requestmsg)
+        if starttime is None:
+            starttime = time.time()
+        voicename = requestmsg.get("voicename")
+        self.metrics.begin("synthstream", voicename)
+        status = "error"
+        try:
+            for replymsg in self._synthstream(requestmsg, voicename, starttime):
+                if replymsg.get("end"):
+                    status = "ok"
+                    self.metrics.record("ttfb", replymsg["ttfb"] or 0.0)
+                elif replymsg.get("message") == TIMEOUT_MESSAGE:
+                    status = "timeout"
+                yield replymsg
+        finally:   #also if the client goes away
+            self.metrics.end("synthstream", status, time.time() - starttime, voicename)
+
+    def _synthstream(self, requestmsg, voicename, starttime):
+        if voicename not in self.voicelocations:
+            log.error("Synthesis failed: unknown voice '%s'" % (voicename))
+            yield make_reply("Unknown voice: %s" % (voicename))
+            return
+        deadline = starttime + self.timeout
+        phrases = split_phrases(requestmsg.get("text") or "", requestmsg.get("split") or "phrase")
+        pool = self.pool    #may be replaced during a reload
+        pipeline = requestmsg.get("pipeline", True) is not False
+        submitted = []      #pending results of phrases[:len(submitted)]
+        ttfb = None
+        try:
+            for i, phrase in enumerate(phrases):
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    raise multiprocessing.TimeoutError()
+                if len(submitted) == i:    #wait for a free worker
+                    submitted.append(self.workers.call(worker_synth_pcm, (voicename, phrase), remaining, pool))
+                try:    #and give phrases ahead to idle workers
+                    while pipeline and len(submitted) < len(phrases):
+                        submitted.append(self.workers.call(worker_synth_pcm, (voicename, phrases[len(submitted)]), 0.0, pool))
+                except multiprocessing.TimeoutError:
+                    pass
+                samplerate, pcm, timings = submitted[i].get(deadline - time.time())
+                self.metrics.recordall(timings)
+                if ttfb is None:
+                    ttfb = time.time() - starttime
+                yield {"status": "ok", "chunk": i, "text": phrase, "samplerate": samplerate,
+                       "sampleformat": PCM_FORMAT, "pcm": pcm}
+        except multiprocessing.TimeoutError:
+            log.error("Synthesis failed: timed out")
+            yield make_reply(TIMEOUT_MESSAGE)
+            return
+        except Exception, e:
+            log.error("Synthesis failed: %s" % (e))
+            yield make_reply(str(e))
+            return
+        totaltime = time.time() - starttime
+        log.info("Streaming synthesis successful: %s chunk(s), first chunk after %.3fs, total %.3fs" %
+                 (len(phrases), ttfb or 0.0, totaltime))
+        yield {"status": "ok", "end": True, "numchunks": len(phrases), "ttfb": ttfb, "totaltime": totaltime}
+
+
+def process_memory(pid):
+    """ Memory use (kB) of process 'pid' from /proc (Linux): "rss",
+        "pss" (shared pages divided among sharing processes), "shared"
+        and "private"...
+    """
+    try:
+        infh = open("/proc/%s/smaps_rollup" % pid)
+    except IOError:    #older kernels
+        infh = open("/proc/%s/smaps" % pid)
+    fields = {}
+    with infh:
+        for line in infh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0]] = fields.get(parts[0], 0) + int(parts[1])
+    return {"rss": fields.get("Rss:", 0),
+            "pss": fields.get("Pss:", 0),
+            "shared": fields.get("Shared_Clean:", 0) + fields.get("Shared_Dirty:", 0),
+            "private": fields.get("Private_Clean:", 0) + fields.get("Private_Dirty:", 0)}
+
+
+def split_phrases(text, level="phrase"):
+    """ Split text into chunks that are synthesised separately when
+        streaming, after sentence punctuation (level "sentence") or
+        also at phrase breaks (level "phrase")...
+    """
+    pattern = PHRASE_BREAK if level == "phrase" else SENTENCE_BREAK
+    return [chunk for chunk in (chunk.strip() for chunk in pattern.split(text)) if chunk]
+
+
+def make_reply(reply):
+    """ Reply message from the result of a request: a dict of fields,
+        a list of voices or a message string on failure...
+    """
+    if isinstance(reply, dict):
+        replymsg = dict(reply)
+        replymsg["status"] = "ok"
+    elif isinstance(reply, list):
+        replymsg = {"status": "ok", "voices": reply}
+    else:
+        replymsg = {"status": "error", "message": unicode(reply)}
+    return replymsg
+
+
+def reject(csocket):
+    """ Reply immediately that the server is busy (the request is read
+        first, closing with unread data would reset the connection).
+        Returns whether the connection can be used further...
+    """
+    try:
+        csocket.settimeout(REJECT_TIMEOUT)
+        if read_message(csocket) is None:
+            return False
+        write_message(csocket, make_reply(BUSY_MESSAGE))
+        csocket.settimeout(None)
+        return True
+    except Exception:
+        return False
+
+
+class TTSRejecter(threading.Thread):
+    """ Replies to rejected requests (see TTSServer.reject)...
+    """
+    def __init__(self, tts_server):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.tts_server = tts_server
+
+    def run(self):
+        while True:
+            item = self.tts_server.rejects.get()
+            if item is None:
+                break
+            csocket, address, keep = item
+            if reject(csocket) and keep:
+                self.tts_server.release(csocket, address)
+            else:
+                csocket.close()
 
 
 class TTSHandler(threading.Thread): 
-    def __init__(self, sock_addr, tts_server): 
+    def __init__(self, tts_server): 
         threading.Thread.__init__(self) 
-        self.csocket, self.address = sock_addr
-        self.rx_size = 1024
+        self.daemon = True
         self.tts_server = tts_server
 
     def run(self):
-        log.info("Connection made %s running %s to handle request" % (self.address, self))
-        request = self.rx_req()
-        if request["type"] == "synth":
+        while True:
+            item = self.tts_server.requests.get()
+            if item is None:
+                break
+            csocket, address, starttime = item
+            try:
+                keep = self.handle(csocket, address, starttime)
+            except Exception, e:
+                log.error("Handling request from %s failed: %s" % (address, e))
+                keep = False
+            if keep:
+                self.tts_server.release(csocket, address)
+            else:
+                csocket.close()
+
+    def handle(self, csocket, address, starttime):
+        """ Serve one request, returns False if the connection was
+            closed by the client...
+        """
+        csocket.settimeout(self.tts_server.rxtimeout)
+        request = read_message(csocket)
+        if request is None:
+            log.info("Connection closed %s" % (address,))
+            return False
+        log.info("Request on %s handled by %s" % (address, self))
+        self.tts_server.metrics.record("queue", time.time() - starttime)
+        if request.get("type") == "synth":
             log.info("Synthesis request received successfully.")
-            reply = self.tts_server.synth(request)
-        elif request["type"] == "listvoices":
+            reply = self.tts_server.synth(request, starttime + self.tts_server.timeout)
+        elif request.get("type") == "synthstream":
+            log.info("Streaming synthesis request received successfully.")
+            csocket.settimeout(None)
+            for replymsg in self.tts_server.synthstream(request, starttime):
+                write_message(csocket, replymsg)
+            log.info("Reply sent successfully.")
+            return True
+        elif request.get("type") == "listvoices":
             log.info("Listvoices request received successfully.")
-            reply = self.tts_server.getvoicelist()
-        self.tx_reply(reply)
+            reply = {"voices": self.tts_server.getvoicelist(),
+                     "voiceversions": self.tts_server.getvoiceversions()}
+        elif request.get("type") == "reloadvoice":
+            log.info("Reloadvoice request received successfully.")
+            reply = self.tts_server.reloadvoice(request.get("voicename"))
+        elif request.get("type") == "stats":
+            log.info("Stats request received successfully.")
+            reply = self.tts_server.stats()
+        elif request.get("type") == "memory":
+            log.info("Memory report request received successfully.")
+            reply = self.tts_server.memoryreport()
+        else:
+            reply = "Unknown request type: %s" % (request.get("type"))
+        csocket.settimeout(None)
+        sendstart = time.time()
+        write_message(csocket, make_reply(reply))
+        self.tts_server.metrics.record("serialisation", time.time() - sendstart)
         log.info("Reply sent successfully.")
-        #remove self from tts_server thread list...                 
-        for i, t in enumerate(self.tts_server.threads):
-            if t is self:
-                self.tts_server.threads.pop(i)
-
-    def tx_reply(self, reply):
-        replymsg = pickle.dumps(reply)
-        self.csocket.sendall(replymsg)
-        self.csocket.close()
-
-    def rx_req(self):
-        fulls = bytes()
-        while True:
-            s = self.csocket.recv(self.rx_size)
-            if s:
-                fulls += s
-                if fulls.endswith(END_OF_MESSAGE_STRING):
-                    fulls = fulls.rstrip(END_OF_MESSAGE_STRING)
-                    break
-            else:
-                break
-        return pickle.loads(fulls) #string in utf-8
+        return True
 
 
 if __name__ == "__main__":
-    try:
-        configfilename = sys.argv[1]
-    except IndexError:
-        configfilename = "ttslab_demo_server.conf"
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('configfilename', metavar='CONFIGFILE', type=str, nargs='?', default="ttslab_demo_server.conf", help="voices to load (one section per voice)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument('--workers', type=int, default=DEF_NUMWORKERS, help="number of synthesis processes")
+    parser.add_argument('--vizworkers', type=int, default=DEF_NUMVIZWORKERS, help="number of graph rendering processes")
+    parser.add_argument('--handlers', type=int, default=DEF_NUMHANDLERS, help="number of requests handled concurrently")
+    parser.add_argument('--queuesize', type=int, default=DEF_QUEUESIZE, help="number of waiting requests before rejecting")
+    parser.add_argument('--maxconnections', type=int, default=DEF_MAXCONNECTIONS, help="maximum number of open client connections")
+    parser.add_argument('--timeout', type=float, default=DEF_TIMEOUT, help="per-request timeout (seconds)")
+    parser.add_argument('--cacheentries', type=int, default=DEF_MAXENTRIES, help="maximum number of cached results (0 disables the cache)")
+    parser.add_argument('--cachebytes', type=int, default=DEF_MAXBYTES, help="maximum size of cached results in memory")
+    parser.add_argument('--cachedir', type=str, help="directory for the on-disk cache")
+    parser.add_argument('--batchwindow', type=float, default=DEF_BATCHWINDOW * 1000.0, help="milliseconds to group synthesis requests for the same voice (0 disables batching)")
+    parser.add_argument('--batchsize', type=int, default=DEF_BATCHSIZE, help="maximum number of requests in a batch")
+    parser.add_argument('--statsfile', type=str, help="dump metrics to this JSON file (periodically and on shutdown)")
+    args = parser.parse_args()
+    configfilename = args.configfilename
 
     #loadconf
     config = configparser.RawConfigParser()
@@ -146,7 +928,6 @@ if __name__ == "__main__":
     #setup logging...
     try:
         fmt = "%(asctime)s [%(levelname)s] %(message)s"
-        log = logging.getLogger(NAME)
         formatter = logging.Formatter(fmt)
         ofstream = logging.FileHandler(DEF_LOG, "a")
         ofstream.setFormatter(formatter)
@@ -161,7 +942,14 @@ if __name__ == "__main__":
         sys.exit(1)
 
     #start server
-    tts_server = TTSServer()
+    if args.cacheentries > 0:
+        cache = SynthCache(args.cacheentries, args.cachebytes, args.cachedir)
+    else:
+        cache = None
+    tts_server = TTSServer(args.port, args.workers, args.handlers, args.queuesize, args.timeout, cache=cache,
+                           maxconnections=args.maxconnections, numvizworkers=args.vizworkers,
+                           statsfile=args.statsfile, batchwindow=args.batchwindow / 1000.0,
+                           batchsize=args.batchsize)
     for voicename in config.sections():
         # print("Loading: " + voicename, end='')
         voice_location = config.get(voicename, "voice_location")
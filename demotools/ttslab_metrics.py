@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+""" Operational metrics for the demo TTS server: latency histograms
+    per stage, request counters (also per voice), throughput and
+    requests in progress. Everything is kept in memory and reported
+    as a dict (JSON serialisable)...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import time
+import json
+import threading
+from collections import deque
+
+#upper bounds of histogram buckets in seconds (last bucket is open):
+BUCKET_BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                 1.0, 2.0, 5.0, 10.0, 20.0, 50.0]
+PERCENTILES = [50, 90, 95, 99]
+THROUGHPUT_WINDOW = 60.0     #seconds
+
+
+class Histogram(object):
+    """ Latency histogram with fixed buckets, percentiles are
+        estimated as the upper bound of the bucket they fall in. Only
+        non-empty buckets are reported ([upper bound, count], None for
+        the open last bucket)...
+    """
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        cumcount = 0
+        for bound, count in zip(self.bounds + [self.max], self.counts):
+            cumcount += count
+            if cumcount >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def todict(self):
+        d = {"count": self.count,
+             "mean": self.total / self.count if self.count else None,
+             "min": self.min,
+             "max": self.max,
+             "buckets": [[bound, count] for bound, count in zip(self.bounds + [None], self.counts) if count]}
+        for p in PERCENTILES:
+            d["p%s" % p] = self.percentile(p)
+        return d
+
+
+class Metrics(object):
+    """ Thread-safe collection of server metrics. Requests are
+        bracketed by begin() and end(), stage durations are added with
+        record()...
+    """
+
+    def __init__(self):
+        self.starttime = time.time()
+        self.lock = threading.Lock()
+        self.histograms = {}        #stage -> Histogram
+        self.counters = {}          #name -> count
+        self.voices = {}            #voicename -> {name -> count}
+        self.inflight = 0
+        self.maxinflight = 0
+        self.completed = deque()    #completion times (throughput window)
+
+    def _count(self, name, voicename=None, increment=1):
+        self.counters[name] = self.counters.get(name, 0) + increment
+        if voicename is not None:
+            voicecounters = self.voices.setdefault(voicename, {})
+            voicecounters[name] = voicecounters.get(name, 0) + increment
+
+    def begin(self, requesttype, voicename=None):
+        with self.lock:
+            self.inflight += 1
+            self.maxinflight = max(self.maxinflight, self.inflight)
+            self._count("requests")
+            self._count("requests_%s" % requesttype, voicename)
+
+    def end(self, requesttype, status, duration, voicename=None):
+        """ 'status' is one of "ok", "error", "timeout" (counted
+            per request type and voice)...
+        """
+        now = time.time()
+        with self.lock:
+            self.inflight -= 1
+            self._count("%s_%s" % (requesttype, status), voicename)
+            self.histograms.setdefault(requesttype, Histogram()).add(duration)
+            self.completed.append(now)
+            while self.completed and now - self.completed[0] > THROUGHPUT_WINDOW:
+                self.completed.popleft()
+
+    def count(self, name, voicename=None, increment=1):
+        with self.lock:
+            self._count(name, voicename, increment)
+
+    def record(self, stage, duration):
+        with self.lock:
+            self.histograms.setdefault(stage, Histogram()).add(duration)
+
+    def recordall(self, timings):
+        """ Add a dict of stage durations (e.g. as returned by a
+            worker)...
+        """
+        with self.lock:
+            for stage, duration in timings.iteritems():
+                self.histograms.setdefault(stage, Histogram()).add(duration)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            uptime = now - self.starttime
+            recent = [t for t in self.completed if now - t <= THROUGHPUT_WINDOW]
+            return {"uptime": uptime,
+                    "inflight": self.inflight,
+                    "maxinflight": self.maxinflight,
+                    "throughput": len(recent) / min(uptime, THROUGHPUT_WINDOW) if uptime > 0.0 else 0.0,
+                    "throughput_window": THROUGHPUT_WINDOW,
+                    "counters": dict(self.counters),
+                    "voices": dict((k, dict(v)) for k, v in self.voices.iteritems()),
+                    "latency": dict((k, v.todict()) for k, v in self.histograms.iteritems())}
+
+
+def dump_stats(stats, filename):
+    with open(filename, "w") as outfh:
+        json.dump(stats, outfh, indent=2, sort_keys=True)
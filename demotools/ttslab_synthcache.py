@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+""" Cache for synthesis results (wav bytes and rendered HTML) keyed on
+    voice and normalised text: an in-memory LRU tier bounded in number
+    of entries and bytes and an optional on-disk, content-addressed
+    tier...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+import cPickle as pickle
+from collections import OrderedDict
+
+DEF_MAXENTRIES = 1000
+DEF_MAXBYTES = 256 * 2**20
+DISK_EXT = "pickle"
+
+
+def normalise_text(text):
+    """ Texts that are synthesised identically should map to the same
+        key: unicode normalisation and whitespace collapsing...
+    """
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(voicename, text, voiceversion="", kind=""):
+    """ MD5 hex digest of the voice (name and version), normalised
+        text and (optionally) the kind of artefact cached...
+    """
+    fields = [voicename, voiceversion, normalise_text(text)]
+    if kind:
+        fields.append(kind)
+    h = hashlib.md5()
+    h.update("\n".join(fields).encode("utf-8"))
+    return h.hexdigest()
+
+
+def reply_size(reply):
+    return sum(len(v) for v in reply.itervalues() if isinstance(v, (bytes, unicode)))
+
+
+class SynthCache(object):
+    """ Thread-safe LRU cache of synthesis replies (dicts of wav bytes
+        and HTML strings). Voice versions are part of the key, so the
+        disk tier never returns results from a previous voice file.
+        Requests pass the version current when they started to get()
+        and put(): results for another than the current version are
+        not returned or stored (the voice was reloaded meanwhile)...
+    """
+
+    def __init__(self, maxentries=DEF_MAXENTRIES, maxbytes=DEF_MAXBYTES, diskdir=None):
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.diskdir = diskdir
+        if diskdir is not None and not os.path.isdir(diskdir):
+            os.makedirs(diskdir)
+        self.entries = OrderedDict()    #key -> (voicename, reply, size)
+        self.voiceversions = {}
+        self.numbytes = 0
+        self.hits = 0
+        self.diskhits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def setvoice(self, voicename, voiceversion=""):
+        """ Called when a voice is (re)loaded: drops all entries for the
+            voice and sets the version used in its keys...
+        """
+        with self.lock:
+            for key in [k for k, v in self.entries.iteritems() if v[0] == voicename]:
+                self.numbytes -= self.entries.pop(key)[2]
+            self.voiceversions[voicename] = voiceversion
+
+    def _key(self, voicename, text, kind="", voiceversion=None):
+        """ Returns None if 'voiceversion' is not the current version...
+        """
+        current = self.voiceversions.get(voicename, "")
+        if voiceversion is not None and voiceversion != current:
+            return None
+        return cache_key(voicename, text, current, kind)
+
+    def _diskpath(self, key):
+        return os.path.join(self.diskdir, key[:2], ".".join([key, DISK_EXT]))
+
+    def _insert(self, key, voicename, reply):
+        size = reply_size(reply)
+        if size > self.maxbytes:
+            return
+        if key in self.entries:
+            self.numbytes -= self.entries.pop(key)[2]
+        self.entries[key] = (voicename, reply, size)
+        self.numbytes += size
+        while len(self.entries) > self.maxentries or self.numbytes > self.maxbytes:
+            self.numbytes -= self.entries.popitem(last=False)[1][2]
+
+    def get(self, voicename, text, kind="", voiceversion=None):
+        """ Returns the cached reply or None, 'kind' distinguishes
+            artefacts cached separately (e.g. "wav" and "graphs")...
+        """
+        with self.lock:
+            key = self._key(voicename, text, kind, voiceversion)
+            if key is None:
+                self.misses += 1
+                return None
+            if key in self.entries:
+                entry = self.entries.pop(key)
+                self.entries[key] = entry   #most recently used
+                self.hits += 1
+                return entry[1]
+        if self.diskdir is not None:
+            try:
+                with open(self._diskpath(key), "rb") as infh:
+                    reply = pickle.load(infh)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                reply = None
+            if reply is not None:
+                with self.lock:
+                    self._insert(key, voicename, reply)
+                    self.diskhits += 1
+                return reply
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, voicename, text, reply, kind="", voiceversion=None):
+        with self.lock:
+            key = self._key(voicename, text, kind, voiceversion)
+            if key is None:    #stale result
+                return
+            self._insert(key, voicename, reply)
+        if self.diskdir is not None:
+            diskpath = self._diskpath(key)
+            if not os.path.isdir(os.path.dirname(diskpath)):
+                try:
+                    os.makedirs(os.path.dirname(diskpath))
+                except OSError:    #created concurrently
+                    pass
+            #write and rename so that readers never see partial files:
+            temppath = "%s.%s.%s.tmp" % (diskpath, os.getpid(), threading.current_thread().ident)
+            with open(temppath, "wb") as outfh:
+                pickle.dump(reply, outfh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(temppath, diskpath)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.diskhits + self.misses
+            return {"entries": len(self.entries),
+                    "bytes": self.numbytes,
+                    "hits": self.hits,
+                    "diskhits": self.diskhits,
+                    "misses": self.misses,
+                    "hitrate": (self.hits + self.diskhits) / lookups if lookups else 0.0}
@@ -13,11 +13,13 @@ import codecs
 import os
 import sys
 import logging
-import subprocess
+import shutil
+import hashlib
 from tempfile import NamedTemporaryFile
 from ConfigParser import ConfigParser
 
 from speechlabels import parse_path, type_files
+from HALIGN_Parallel import DEF_NUMWORKERS, partition, numShards, dumpShards, runCommands
 
 #EXTs
 WAVE_EXT = "wav"
@@ -28,14 +30,35 @@ TIMES_EXT = "times"
 #BINs
 HCOPY_BIN = "HCopy"
 
+#VALs
+HASH_BLOCKSIZE = 2**20
+
 log = logging.getLogger("HAlign.Features")
 
+
+def fileHash(location):
+    """ SHA1 hex digest of file contents...
+    """
+    h = hashlib.sha1()
+    with open(location, "rb") as infh:
+        while True:
+            block = infh.read(HASH_BLOCKSIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
 class AudioFeatures(object):
     """ Manages audio and feature files...
     """
 
-    def __init__(self, wavlocation, featsconflocation):
-        """ Initialise...
+    def __init__(self, wavlocation, featsconflocation, numworkers=DEF_NUMWORKERS, cachelocation=None):
+        """ Initialise... 'numworkers' is the number of concurrent
+            HCopy processes (None or 0: one per CPU). If 'cachelocation'
+            is given, features are kept there keyed on the contents of
+            the audio file and the feature configuration and reused
+            instead of running HCopy again...
         """
         if not os.path.isdir(wavlocation):
             raise Exception("'%s' is not an existing directory..." % wavlocation)
@@ -45,6 +68,8 @@ class AudioFeatures(object):
         self.wavfilelist = type_files(os.listdir(self.wavlocation), WAVE_EXT)
         self.wavfilelist.sort()
         self.hcopy_parms = self._loadFeatConf(featsconflocation)
+        self.numworkers = numworkers
+        self.cachelocation = cachelocation
         
 
     def _loadFeatConf(self, location):
@@ -91,8 +116,19 @@ class AudioFeatures(object):
                                 os.path.join(targetdir, ".".join([parse_path(filename)[2], MFCC_EXT])) + "\n")
 
 
+    def getConfHash(self):
+        """ SHA1 hex digest of the feature configuration...
+        """
+        h = hashlib.sha1()
+        for k, v in sorted(self.hcopy_parms):
+            h.update((k.upper() + " = " + v + "\n").encode("utf-8"))
+        return h.hexdigest()
+
+
     def makeFeats(self, targetdir):
-        """ Run HCopy to make features...
+        """ Run HCopy to make features (split over 'self.numworkers'
+            processes), using and updating the feature cache if
+            defined...
         """
         if not os.path.isdir(targetdir):
             raise Exception("'%s' is not an existing directory..." % targetdir)
@@ -102,30 +138,52 @@ class AudioFeatures(object):
         elif self.hcopy_parms is None:
             raise Exception("HCopy configuration not loaded...")
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpSCP(tempscpfh, targetdir)
+        #get cached feats...
+        scplines = []
+        tocache = []
+        if self.cachelocation is not None:
+            cachedir = os.path.join(self.cachelocation, self.getConfHash())
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+        for filename in self.wavfilelist:
+            wavlocation = os.path.join(self.wavlocation, filename)
+            featlocation = os.path.join(targetdir, ".".join([parse_path(filename)[2], MFCC_EXT]))
+            if self.cachelocation is not None:
+                cachedlocation = os.path.join(cachedir, ".".join([fileHash(wavlocation), MFCC_EXT]))
+                if os.path.isfile(cachedlocation):
+                    shutil.copyfile(cachedlocation, featlocation)
+                    continue
+                tocache.append((featlocation, cachedlocation))
+            scplines.append(wavlocation + " " + featlocation)
+        if self.cachelocation is not None:
+            log.info("makeFeats: %s of %s files found in cache at '%s'." % (len(self.wavfilelist) - len(scplines),
+                                                                           len(self.wavfilelist),
+                                                                           cachedir))
+        if not scplines:
+            return 0
 
         #write hcopy.conf
         tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpFeatConf(tempconffh)
 
+        #write SCPs...
+        numshards = numShards(len(scplines), self.numworkers)
+        tempscpfhs = dumpShards(scplines, numshards)
+
         #execute HCopy...
-        p = subprocess.Popen(" ".join([HCOPY_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-C",
-                                       tempconffh.name,
-                                       "-S",
-                                       tempscpfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
+        results = runCommands([" ".join([HCOPY_BIN,
+                                         "-A",
+                                         "-D",
+                                         "-V",
+                                         "-T",
+                                         "1",
+                                         "-C",
+                                         tempconffh.name,
+                                         "-S",
+                                         tempscpfh.name]) for tempscpfh in tempscpfhs],
+                              numshards)
+        so = b"".join(result[1] for result in results)
+        se = b"".join(result[2] for result in results)
         log.info("makeFeats:\n" +
                  "================================================================================\n" +
                  unicode(so, encoding="utf-8") + 
@@ -135,15 +193,30 @@ class AudioFeatures(object):
                         "================================================================================\n" +
                         unicode(se, encoding="utf-8") +
                         "================================================================================\n")
-        returnval = p.returncode
 
-        tempscpfh.close()
+        for tempscpfh in tempscpfhs:
+            tempscpfh.close()
         tempconffh.close()
 
-        if returnval != 0:
-            raise Exception(HCOPY_BIN + " failed with code: " + unicode(returnval))
-
-        return returnval
+        failed = []
+        for i, (shard, (returnval, so, se)) in enumerate(zip(partition(scplines, numshards), results)):
+            if returnval != 0:
+                log.error("makeFeats: part %s (%s files, '%s' to '%s') failed with code: %s" % (i + 1,
+                                                                                               len(shard),
+                                                                                               shard[0].split()[0],
+                                                                                               shard[-1].split()[0],
+                                                                                               returnval))
+                failed.append("%s (code %s)" % (i + 1, returnval))
+        if failed:
+            raise Exception(HCOPY_BIN + " failed on part(s): " + ", ".join(failed))
+
+        #update cache (copy and rename to not expose partial files)...
+        for featlocation, cachedlocation in tocache:
+            tempcachedlocation = ".".join([cachedlocation, unicode(os.getpid())])
+            shutil.copyfile(featlocation, tempcachedlocation)
+            os.rename(tempcachedlocation, cachedlocation)
+
+        return 0
         
 
 # try:
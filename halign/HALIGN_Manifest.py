@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" This module keeps track of finished stages and model iterations
+    of an HAlign process in the working directory so that an
+    interrupted or failed process can be resumed...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import re
+import json
+import codecs
+import shutil
+import hashlib
+import logging
+from time import strftime
+from functools import partial
+
+from HALIGN_Features import fileHash
+from HALIGN_Models import HMM_DIR, HMMDEFS_FN
+
+#FILENAMES
+MANIFEST_FN = "manifest.json"
+
+#in order of execution:
+STAGES = ["organiseTranscriptions",
+          "makeFeats",
+          "initModels",
+          "trainModels",
+          "doAlignment",
+          "doTextgridOutput"]
+
+#HMMSet methods that make a new model iteration (hmmN):
+MODEL_STEPS = ["copyBootmodels",
+               "mappedBootstrapAll",
+               "doBootstrapAll",
+               "doFlatStart",
+               "doEmbeddedRest",
+               "addStandardSilTransitions",
+               "fixSilModels",
+               "cloneTriphones",
+               "tieStates",
+               "doIncrementMixtures",
+               "doHHEd"]
+
+#HMMSet (and ASRHMMSet) attributes changed by steps (e.g. the list of
+#models after cloneTriphones), restored when a step is skipped:
+MODEL_STATE = ["phonelist",
+               "phonelist0",
+               "phonelist1"]
+
+
+log = logging.getLogger("HAlign.Manifest")
+
+
+def fingerprint(items):
+    """ SHA1 hex digest of a list of strings...
+    """
+    h = hashlib.sha1()
+    for item in items:
+        h.update(item.encode("utf-8") + b"\n")
+    return h.hexdigest()
+
+
+def filesFingerprint(locations):
+    """ Fingerprint of the contents of existing files in 'locations'...
+    """
+    return fingerprint([location + " " + fileHash(location) for location in locations
+                        if location and os.path.isfile(location)])
+
+
+def dirFingerprint(location):
+    """ Fingerprint of the names, sizes and modification times of
+        files in directory at 'location'...
+    """
+    items = []
+    for filename in sorted(os.listdir(location)):
+        st = os.stat(os.path.join(location, filename))
+        items.append("%s %s %s" % (filename, st.st_size, int(st.st_mtime)))
+    return fingerprint(items)
+
+
+def _argKey(arg):
+    """ Arguments that are not simple values (e.g. a TranscriptionSet)
+        are compared by type only...
+    """
+    if arg is None or isinstance(arg, (basestring, int, long, float, bool)):
+        return unicode(arg)
+    return type(arg).__name__
+
+
+class StageManifest(object):
+    """ Records which stages finished and with which inputs, and each
+        step that made a model iteration, in a JSON file...
+    """
+
+    def __init__(self, location, force=None):
+        """ Load existing manifest at 'location' if any, 'force' names
+            a stage that should be done again (with all following
+            stages)...
+        """
+        self.location = location
+        self.stage = None
+        self.position = 0     #model steps done or resumed in this run
+        if os.path.isfile(location):
+            with codecs.open(location, encoding="utf-8") as infh:
+                d = json.load(infh)
+            self.inputs = d["inputs"]
+            self.stages = d["stages"]
+            self.steps = d["steps"]
+            log.info("Loaded manifest at '%s' (finished stages: %s; %s model step(s))." % (location,
+                                                                                        ", ".join(s for s in STAGES if s in self.stages),
+                                                                                        len(self.steps)))
+        else:
+            self.inputs = {}
+            self.stages = {}
+            self.steps = []
+        if force:
+            log.info("Forcing stage '%s'." % (force))
+            self.invalidate(force)
+
+
+    def save(self):
+        """ Write to temporary file and rename (the manifest is never
+            left incomplete)...
+        """
+        templocation = self.location + ".tmp"
+        with codecs.open(templocation, "w", encoding="utf-8") as outfh:
+            json.dump({"inputs": self.inputs,
+                       "stages": self.stages,
+                       "steps": self.steps}, outfh, indent=1, sort_keys=True)
+        os.rename(templocation, self.location)
+
+
+    def invalidate(self, stage):
+        """ Forget 'stage' and all following stages with their model
+            steps...
+        """
+        if stage not in STAGES:
+            raise Exception("Unknown stage '%s' (stages: %s)" % (stage, ", ".join(STAGES)))
+        later = STAGES[STAGES.index(stage):]
+        for s in later:
+            self.inputs.pop(s, None)
+            self.stages.pop(s, None)
+        self.steps = [step for step in self.steps if step["stage"] not in later]
+        self.save()
+
+
+    def begin(self, stage):
+        self.stage = stage
+
+
+    def checkInputs(self, stage, inputs):
+        """ Invalidate 'stage' if 'inputs' (fingerprint) differs from
+            the previous run, returns whether the stage is already
+            done...
+        """
+        if stage in self.inputs and self.inputs[stage] != inputs:
+            log.info("Inputs of stage '%s' changed." % (stage))
+            self.invalidate(stage)
+        self.inputs[stage] = inputs
+        self.save()
+        return stage in self.stages
+
+
+    def isDone(self, stage):
+        return stage in self.stages
+
+
+    def finish(self, stage):
+        """ Model steps of 'stage' recorded beyond those done or resumed
+            in this run (a previous run made more) are forgotten, with
+            the following stages...
+        """
+        if any(step["stage"] == stage for step in self.steps[self.position:]):
+            log.info("Stage '%s' made fewer model steps than before." % (stage))
+            self.truncateSteps(self.position)
+        self.stages[stage] = {"finished": strftime("%Y-%m-%d %H:%M:%S"),
+                              "numsteps": self.position}
+        self.save()
+
+
+    def nextStep(self):
+        """ The step recorded at the current position (None if there
+            is none)...
+        """
+        try:
+            return self.steps[self.position]
+        except IndexError:
+            return None
+
+
+    def resumeStep(self):
+        self.position += 1
+
+
+    def _unfinish(self):
+        """ The current stage and following stages are no longer
+            finished...
+        """
+        for s in STAGES[STAGES.index(self.stage):]:
+            self.stages.pop(s, None)
+
+
+    def truncateSteps(self, index):
+        """ Forget model steps from 'index', the current stage and
+            following stages are no longer finished...
+        """
+        self.steps = self.steps[:index]
+        self._unfinish()
+        self.save()
+
+
+    def addStep(self, step):
+        """ Add a step done (not resumed) at the current position, the
+            current stage and following stages are no longer finished
+            (also when the step is added beyond the recorded steps)...
+        """
+        step["stage"] = self.stage
+        self.steps = self.steps[:self.position] + [step]
+        self.position += 1
+        self._unfinish()
+        self.save()
+
+
+class CheckpointedModels(object):
+    """ Wraps an HMMSet (or ASRHMMSet) so that steps making a new model
+        iteration are noted in the manifest. When resuming, steps
+        already done with the same arguments (and whose models still
+        exist) are skipped and the model set attributes they changed
+        (MODEL_STATE) are restored...
+    """
+
+    def __init__(self, models, manifest):
+        self.__dict__["models"] = models
+        self.__dict__["manifest"] = manifest
+
+
+    def __getattr__(self, name):
+        attr = getattr(self.models, name)
+        if name in MODEL_STEPS:
+            return partial(self._doStep, name, attr)
+        return attr
+
+
+    def __setattr__(self, name, value):
+        setattr(self.models, name, value)
+
+
+    def _hmmDir(self, iteration):
+        return os.path.join(self.models.targetlocation, HMM_DIR + unicode(iteration))
+
+
+    def _removeStaleModels(self):
+        """ Remove model dirs from previous runs that would be
+            overwritten...
+        """
+        for dirname in os.listdir(self.models.targetlocation):
+            m = re.match(HMM_DIR + r"(\d+)$", dirname)
+            if m and (int(m.group(1)) > self.models.iteration or self.manifest.position == 0):
+                log.debug("Removing '%s'." % (dirname))
+                shutil.rmtree(os.path.join(self.models.targetlocation, dirname))
+
+
+    def _getState(self):
+        return dict((k, getattr(self.models, k)) for k in MODEL_STATE if hasattr(self.models, k))
+
+
+    def _setState(self, state):
+        for k, v in state.iteritems():
+            setattr(self.models, k, v)
+
+
+    def _doStep(self, name, method, *args, **kwargs):
+        step = {"step": name,
+                "args": [_argKey(arg) for arg in args],
+                "kwargs": dict((k, _argKey(v)) for k, v in kwargs.iteritems())}
+        done = self.manifest.nextStep()
+        if (done is not None and
+            all(done[k] == step[k] for k in ["step", "args", "kwargs"]) and
+            "state" in done and
+            os.path.isfile(os.path.join(self._hmmDir(done["iteration"]), HMMDEFS_FN))):
+            log.info("Resuming: '%s' already done (%s%s)." % (name, HMM_DIR, done["iteration"]))
+            self.models.iteration = done["iteration"]
+            self._setState(done["state"])
+            self.manifest.resumeStep()
+            return done["returnval"]
+        self.manifest.truncateSteps(self.manifest.position)
+        self._removeStaleModels()
+        returnval = method(*args, **kwargs)
+        step["iteration"] = self.models.iteration
+        step["returnval"] = returnval
+        step["state"] = self._getState()
+        self.manifest.addStep(step)
+        return returnval
@@ -20,6 +20,7 @@ import tarfile
 from ConfigParser import ConfigParser
 
 from speechlabels import parse_path, type_files, triphone_2_monophone
+from HALIGN_Parallel import DEF_NUMWORKERS, partition, numShards, dumpShards, runCommand, runCommands
 
 #EXTs
 WAVE_EXT = "wav"
@@ -48,11 +49,126 @@ HEREST_PRUNING_PARM3 = "1000.0"
 VFLOORS_FN = "vFloors"
 MACROS_FN = "macros"
 HMMDEFS_FN = "hmmdefs"
+HEREST_ACC_FN = "HER%s.acc"
+
+#MISC
+MLF_HEADER = "#!MLF!#"
 
 
 log = logging.getLogger("HAlign.Models")
 
 
+def runHERest(arglist, mlflocation, featlist, phonelistlocation, output_dir, statslocation=None, numworkers=DEF_NUMWORKERS):
+    """ Run HERest with common options 'arglist' on 'featlist'. If
+        more than one worker is allowed the list is split and each
+        part is processed by a separate HERest ("-p i") that dumps its
+        accumulators, these are then combined and the models updated
+        in a final pass ("-p 0") as in the HTS-template
+        (scripts/hts_herest.py). Returns (returncode, stdout, stderr)
+        of the updating pass...
+    """
+    if statslocation is None:
+        statsargs = []
+    else:
+        statsargs = ["-s", statslocation]
+    numshards = numShards(len(featlist), numworkers)
+    shardfhs = dumpShards(featlist, numshards)
+    try:
+        if numshards == 1:
+            return runCommand(" ".join([HEREST_BIN] + arglist +
+                                       ["-I", mlflocation] + statsargs +
+                                       ["-S", shardfhs[0].name,
+                                        "-M", output_dir,
+                                        phonelistlocation]))
+        log.info("Running %s on %s files in %s parts." % (HEREST_BIN, len(featlist), numshards))
+        cmds = [" ".join([HEREST_BIN] + arglist +
+                         ["-I", mlflocation,
+                          "-p", unicode(i + 1),
+                          "-S", shardfh.name,
+                          "-M", output_dir,
+                          phonelistlocation]) for i, shardfh in enumerate(shardfhs)]
+        for i, (returnval, so, se) in enumerate(runCommands(cmds, numshards)):
+            log.debug("runHERest (part %s):\n" % (i + 1) + unicode(so, encoding="utf-8"))
+            if bool(se):
+                log.warning("runHERest (part %s):\n" % (i + 1) + unicode(se, encoding="utf-8"))
+            if returnval != 0:
+                raise Exception(HEREST_BIN + " failed on part " + unicode(i + 1) + " with code: " + unicode(returnval))
+        accfilelist = [os.path.join(output_dir, HEREST_ACC_FN % (i + 1)) for i in range(numshards)]
+        result = runCommand(" ".join([HEREST_BIN] + arglist + statsargs +
+                                     ["-p", "0",
+                                      "-M", output_dir,
+                                      phonelistlocation] + accfilelist))
+        if result[0] == 0:
+            for accfn in accfilelist:
+                os.remove(accfn)
+        return result
+    finally:
+        for shardfh in shardfhs:
+            shardfh.close()
+
+
+def mergeMLFs(mlflocations, outmlflocation):
+    """ Concatenate MLFs into a single MLF...
+    """
+    with codecs.open(outmlflocation, "w", encoding="utf-8") as outfh:
+        outfh.write(MLF_HEADER + "\n")
+        for mlflocation in mlflocations:
+            with codecs.open(mlflocation, encoding="utf-8") as infh:
+                for line in infh:
+                    if line.strip() != MLF_HEADER:
+                        outfh.write(line)
+
+
+def runHVite(arglist, featlist, dictlocation, phonelistlocation, outmlflocation=None, numworkers=DEF_NUMWORKERS):
+    """ Run HVite with options 'arglist' on 'featlist', split over up
+        to 'numworkers' processes sharing the same models and
+        dictionary. Label files are written as specified in 'arglist'
+        ("-l"), if 'outmlflocation' is given each process writes its
+        own MLF ("-i") and these are merged. Failed parts are logged
+        with the files they contain and reported together. Returns
+        (returncode, stdout, stderr)...
+    """
+    numshards = numShards(len(featlist), numworkers)
+    shards = partition(featlist, numshards)
+    shardfhs = dumpShards(featlist, numshards)
+    if outmlflocation is None:
+        outmlflocations = [None] * numshards
+    elif numshards == 1:
+        outmlflocations = [outmlflocation]
+    else:
+        outmlflocations = [".".join([outmlflocation, unicode(i + 1)]) for i in range(numshards)]
+    try:
+        cmds = []
+        for shardfh, shardmlflocation in zip(shardfhs, outmlflocations):
+            outargs = [] if shardmlflocation is None else ["-i", shardmlflocation]
+            cmds.append(" ".join([HVITE_BIN] + arglist + outargs +
+                                 ["-S", shardfh.name,
+                                  dictlocation,
+                                  phonelistlocation]))
+        if numshards == 1:
+            return runCommand(cmds[0])
+        log.info("Running %s on %s files in %s parts." % (HVITE_BIN, len(featlist), numshards))
+        results = runCommands(cmds, numshards)
+    finally:
+        for shardfh in shardfhs:
+            shardfh.close()
+    failed = []
+    for i, (shard, (returnval, so, se)) in enumerate(zip(shards, results)):
+        if returnval != 0:
+            log.error("runHVite: part %s (%s files, '%s' to '%s') failed with code: %s\n" % (i + 1, len(shard), shard[0], shard[-1], returnval) +
+                      unicode(so, encoding="utf-8") + unicode(se, encoding="utf-8"))
+            failed.append("%s (code %s)" % (i + 1, returnval))
+    if failed:
+        raise Exception(HVITE_BIN + " failed on part(s): " + ", ".join(failed))
+    if outmlflocation is not None:
+        mergeMLFs(outmlflocations, outmlflocation)
+        for shardmlflocation in outmlflocations:
+            os.remove(shardmlflocation)
+    return (0,
+            b"".join(result[1] for result in results),
+            b"".join(result[2] for result in results))
+
+
 class HMMSet(object):
     """ Manages HMM models...
     """
@@ -63,8 +179,11 @@ class HMMSet(object):
                  silphone,
                  protofilelocation,
                  featsconflocation,
-                 featslocation):
-        """ Initialise...
+                 featslocation,
+                 numworkers=DEF_NUMWORKERS):
+        """ Initialise... 'numworkers' is the number of concurrent HTK
+            processes used for re-estimation and alignment (None or 0: one
+            per CPU)...
         """
 
         if not os.path.isdir(targetlocation):
@@ -82,6 +201,7 @@ class HMMSet(object):
         self.numstates = self._getNumStatesFromProtofile()
         self.iteration = 0
         self.hvite_hcompv_parms = self._loadFeatConf(featsconflocation)
+        self.numworkers = numworkers
 
 
     def _getNumStatesFromProtofile(self):
@@ -439,10 +559,6 @@ class HMMSet(object):
         tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpFeatConf(tempconffh)
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpFeatList(tempscpfh)
-
         #write phonelist...
         tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpPhoneList(tempphonesfh)
@@ -455,65 +571,27 @@ class HMMSet(object):
         os.makedirs(os.path.join(output_dir))
 
         #execute HERest...
-        if statslocation is None:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-        else:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-s",
-                                           statslocation,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-        so, se = p.communicate()
+        returnval, so, se = runHERest(["-A",
+                                       "-D",
+                                       "-V",
+                                       "-T",
+                                       "1",
+                                       "-C",
+                                       tempconffh.name,
+                                       "-t",
+                                       HEREST_PRUNING_PARM1,
+                                       HEREST_PRUNING_PARM2,
+                                       HEREST_PRUNING_PARM3,
+                                       "-H",
+                                       os.path.join(prev_dir, MACROS_FN),
+                                       "-H",
+                                       os.path.join(prev_dir, HMMDEFS_FN)],
+                                      mlflocation,
+                                      [os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                                      tempphonesfh.name,
+                                      output_dir,
+                                      statslocation,
+                                      self.numworkers)
         log.info("doEmbeddedRest:\n" +
                  "================================================================================\n" +
                  unicode(so, encoding="utf-8") + 
@@ -523,8 +601,6 @@ class HMMSet(object):
                         "================================================================================\n" +
                         unicode(se, encoding="utf-8") +
                         "================================================================================\n")
-        returnval = p.returncode
-        tempscpfh.close()
         tempconffh.close()
         tempphonesfh.close()
 
@@ -714,10 +790,6 @@ class HMMSet(object):
         #tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         #self.dumpFeatConf(tempconffh)
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpFeatList(tempscpfh)
-
         #write phonelist...
         tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpPhoneList(tempphonesfh)
@@ -727,38 +799,31 @@ class HMMSet(object):
                                         HMM_DIR + unicode(self.iteration))
 
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-y lab",
-                                       "-o",
-                                       "SWT",
-#                                       "-b",
-#                                       silword,
-                                       "-m",
-                                       "-l",
-                                       '"*"',
-                                       "-I",
-                                       mlflocation,
-                                       "-i",
-                                       outmlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, MACROS_FN),
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
+        returnval, so, se = runHVite(["-A",
+                                      "-D",
+                                      "-V",
+                                      "-T",
+                                      "1",
+                                      "-a",
+                                      "-y lab",
+                                      "-o",
+                                      "SWT",
+#                                     "-b",
+#                                     silword,
+                                      "-m",
+                                      "-l",
+                                      '"*"',
+                                      "-I",
+                                      mlflocation,
+                                      "-H",
+                                      os.path.join(latestmodels_dir, MACROS_FN),
+                                      "-H",
+                                      os.path.join(latestmodels_dir, HMMDEFS_FN)],
+                                     [os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                                     dictlocation,
+                                     tempphonesfh.name,
+                                     outmlflocation,
+                                     self.numworkers)
         log.info("reAlignment:\n" +
                  "================================================================================\n" +
                  unicode(so, encoding="utf-8") + 
@@ -768,8 +833,6 @@ class HMMSet(object):
                         "================================================================================\n" +
                         unicode(se, encoding="utf-8") +
                         "================================================================================\n")
-        returnval = p.returncode
-        tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
 
@@ -787,10 +850,6 @@ class HMMSet(object):
         #tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         #self.dumpFeatConf(tempconffh)
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpFeatList(tempscpfh)
-
         #write phonelist...
         tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpPhoneList(tempphonesfh)
@@ -800,32 +859,27 @@ class HMMSet(object):
                                         HMM_DIR + unicode(self.iteration))
 
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-o",
-                                       "N",
-                                       "-f",
-                                       "-m",
-                                       "-l",
-                                       outputlocation,
-                                       "-I",
-                                       mlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
+        returnval, so, se = runHVite(["-A",
+                                      "-D",
+                                      "-V",
+                                      "-T",
+                                      "1",
+                                      "-a",
+                                      "-o",
+                                      "N",
+                                      "-f",
+                                      "-m",
+                                      "-l",
+                                      outputlocation,
+                                      "-I",
+                                      mlflocation,
+                                      "-H",
+                                      os.path.join(latestmodels_dir, HMMDEFS_FN)],
+                                     [os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                                     dictlocation,
+                                     tempphonesfh.name,
+                                     None,
+                                     self.numworkers)
         log.info("forcedAlignment:\n" +
                  "================================================================================\n" +
                  unicode(so, encoding="utf-8") + 
@@ -835,8 +889,6 @@ class HMMSet(object):
                         "================================================================================\n" +
                         unicode(se, encoding="utf-8") +
                         "================================================================================\n")
-        returnval = p.returncode
-        tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
 
@@ -861,8 +913,11 @@ class ASRHMMSet(object):
                  spphone,
                  protofilelocation,
                  featsconflocation,
-                 featslocation):
-        """ Initialise...
+                 featslocation,
+                 numworkers=DEF_NUMWORKERS):
+        """ Initialise... 'numworkers' is the number of concurrent HTK
+            processes used for re-estimation and alignment (None or 0: one
+            per CPU)...
         """
 
         if not os.path.isdir(targetlocation):
@@ -882,6 +937,7 @@ class ASRHMMSet(object):
         self.numstates = self._getNumStatesFromProtofile()
         self.iteration = 0
         self.hvite_hcompv_parms = self._loadFeatConf(featsconflocation)
+        self.numworkers = numworkers
 
 
     def _getNumStatesFromProtofile(self):
@@ -1208,10 +1264,6 @@ class ASRHMMSet(object):
         tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpFeatConf(tempconffh)
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpFeatList(tempscpfh)
-
         #write phonelist...
         tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpPhoneList(tempphonesfh, withsp)
@@ -1224,65 +1276,27 @@ class ASRHMMSet(object):
         os.makedirs(os.path.join(output_dir))
 
         #execute HERest...
-        if statslocation is None:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-        else:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-s",
-                                           statslocation,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-        so, se = p.communicate()
+        returnval, so, se = runHERest(["-A",
+                                       "-D",
+                                       "-V",
+                                       "-T",
+                                       "1",
+                                       "-C",
+                                       tempconffh.name,
+                                       "-t",
+                                       HEREST_PRUNING_PARM1,
+                                       HEREST_PRUNING_PARM2,
+                                       HEREST_PRUNING_PARM3,
+                                       "-H",
+                                       os.path.join(prev_dir, MACROS_FN),
+                                       "-H",
+                                       os.path.join(prev_dir, HMMDEFS_FN)],
+                                      mlflocation,
+                                      [os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                                      tempphonesfh.name,
+                                      output_dir,
+                                      statslocation,
+                                      self.numworkers)
         log.info("doEmbeddedRest:\n" +
                  "================================================================================\n" +
                  unicode(so, encoding="utf-8") + 
@@ -1292,8 +1306,6 @@ class ASRHMMSet(object):
                         "================================================================================\n" +
                         unicode(se, encoding="utf-8") +
                         "================================================================================\n")
-        returnval = p.returncode
-        tempscpfh.close()
         tempconffh.close()
         tempphonesfh.close()
 
@@ -1516,10 +1528,6 @@ class ASRHMMSet(object):
         #tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         #self.dumpFeatConf(tempconffh)
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpFeatList(tempscpfh)
-
         #write phonelist...
         tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpPhoneList(tempphonesfh, withsp)
@@ -1529,32 +1537,27 @@ class ASRHMMSet(object):
                                         HMM_DIR + unicode(self.iteration))
 
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-o",
-                                       "N",
-                                       "-f",
-                                       "-m",
-                                       "-l",
-                                       outputlocation,
-                                       "-I",
-                                       mlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
+        returnval, so, se = runHVite(["-A",
+                                      "-D",
+                                      "-V",
+                                      "-T",
+                                      "1",
+                                      "-a",
+                                      "-o",
+                                      "N",
+                                      "-f",
+                                      "-m",
+                                      "-l",
+                                      outputlocation,
+                                      "-I",
+                                      mlflocation,
+                                      "-H",
+                                      os.path.join(latestmodels_dir, HMMDEFS_FN)],
+                                     [os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                                     dictlocation,
+                                     tempphonesfh.name,
+                                     None,
+                                     self.numworkers)
         log.info("forcedAlignment:\n" +
                  "================================================================================\n" +
                  unicode(so, encoding="utf-8") + 
@@ -1564,8 +1567,6 @@ class ASRHMMSet(object):
                         "================================================================================\n" +
                         unicode(se, encoding="utf-8") +
                         "================================================================================\n")
-        returnval = p.returncode
-        tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
 
@@ -1583,10 +1584,6 @@ class ASRHMMSet(object):
         #tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         #self.dumpFeatConf(tempconffh)
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpFeatList(tempscpfh)
-
         #write phonelist...
         tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpPhoneList(tempphonesfh, withsp)
@@ -1596,38 +1593,31 @@ class ASRHMMSet(object):
                                         HMM_DIR + unicode(self.iteration))
 
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-y lab",
-                                       "-o",
-                                       "SWT",
-                                       "-b",
-                                       silword,
-                                       "-m",
-                                       "-l",
-                                       '"*"',
-                                       "-I",
-                                       mlflocation,
-                                       "-i",
-                                       outmlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, MACROS_FN),
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
+        returnval, so, se = runHVite(["-A",
+                                      "-D",
+                                      "-V",
+                                      "-T",
+                                      "1",
+                                      "-a",
+                                      "-y lab",
+                                      "-o",
+                                      "SWT",
+                                      "-b",
+                                      silword,
+                                      "-m",
+                                      "-l",
+                                      '"*"',
+                                      "-I",
+                                      mlflocation,
+                                      "-H",
+                                      os.path.join(latestmodels_dir, MACROS_FN),
+                                      "-H",
+                                      os.path.join(latestmodels_dir, HMMDEFS_FN)],
+                                     [os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                                     dictlocation,
+                                     tempphonesfh.name,
+                                     outmlflocation,
+                                     self.numworkers)
         log.info("reAlignment:\n" +
                  "================================================================================\n" +
                  unicode(so, encoding="utf-8") + 
@@ -1637,8 +1627,6 @@ class ASRHMMSet(object):
                         "================================================================================\n" +
                         unicode(se, encoding="utf-8") +
                         "================================================================================\n")
-        returnval = p.returncode
-        tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" This module contains helpers to split work on a list of files
+    (SCP) over a number of concurrent HTK processes...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import logging
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from tempfile import NamedTemporaryFile
+
+#VALs
+DEF_NUMWORKERS = 1
+MIN_SHARDSIZE = 1         #minimum number of files per shard
+
+
+log = logging.getLogger("HAlign.Parallel")
+
+
+def partition(lst, n):
+    """ Partitions 'lst' into 'n' sublists approximately equal
+        length...
+    """
+    division = len(lst) / float(n)
+    return [ lst[int(round(division * i)): int(round(division * (i + 1)))] for i in xrange(n) ]
+
+
+def numShards(numitems, numworkers):
+    """ Number of shards to split 'numitems' into given 'numworkers'
+        (None or <= 0 means use all CPUs)...
+    """
+    if not numworkers or numworkers <= 0:
+        numworkers = multiprocessing.cpu_count()
+    return max(1, min(numworkers, numitems // MIN_SHARDSIZE))
+
+
+def dumpShards(filelist, numshards):
+    """ Write 'filelist' split into 'numshards' temporary SCP files
+        (caller closes these)...
+    """
+    shardfhs = []
+    for shard in partition(filelist, numshards):
+        fh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+        for filename in shard:
+            fh.write(filename + "\n")
+        fh.flush()
+        shardfhs.append(fh)
+    return shardfhs
+
+
+def runCommand(cmd):
+    """ Run shell command and return (returncode, stdout, stderr)...
+    """
+    p = subprocess.Popen(cmd,
+                         stdout = subprocess.PIPE,
+                         stderr = subprocess.PIPE,
+                         close_fds = True,
+                         shell = True)
+    so, se = p.communicate()
+    return p.returncode, so, se
+
+
+def runCommands(cmds, numworkers=DEF_NUMWORKERS):
+    """ Run shell commands with at most 'numworkers' at a time and
+        return list of (returncode, stdout, stderr) in the order of
+        'cmds'...
+    """
+    numworkers = min(numShards(len(cmds), numworkers), len(cmds))
+    if numworkers <= 1:
+        return [runCommand(cmd) for cmd in cmds]
+    log.debug("Running %s commands with %s workers." % (len(cmds), numworkers))
+    pool = ThreadPool(numworkers)
+    try:
+        return pool.map(runCommand, cmds, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
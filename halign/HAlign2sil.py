@@ -24,11 +24,12 @@ from time import time, strftime
 import shutil
 import pprint
 from optparse import OptionParser
-from ConfigParser import ConfigParser
+from ConfigParser import ConfigParser, NoOptionError
 
 from HALIGN_Text import *
 from HALIGN_Features import *
 from HALIGN_Models import *
+from HALIGN_Manifest import StageManifest, CheckpointedModels, MANIFEST_FN, filesFingerprint, dirFingerprint, fingerprint
 
 import speechlabels as sl
 
@@ -85,9 +86,24 @@ class GenHAlign(object):
     MONOPHONESET_FN = "phoneset"
     HERESTSTATS_FN = "hereststats"
 
+    #RE-ESTIMATION SCHEDULE
+    DEF_REEST_THRESHOLD = 0.001     #minimum relative improvement in avg log prob per frame
+    DEF_REEST_MINITERS = 2
+    DEF_REEST_MAXITERS = 5
+    FLATSTART_REEST_MAXITERS = 3
 
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    #[PARMS] and [SWITCHES] options that do not change the models:
+    NONMODEL_OPTIONS = ["PARMS:WORKING_DIR",
+                        "PARMS:NUM_WORKERS",
+                        "PARMS:FEATS_CACHE",
+                        "SWITCHES:TEXTGRID_OUTPUT",
+                        "SWITCHES:POSTCLEANUP"]
+
+
+    def __init__(self, configfile_location, overrides={}, setup_only=False, force=None):
         """Initialises process (reads from config and sets switches/variables...)...
+           Stages already done in the working dir (see 'manifest.json')
+           are skipped, 'force' names a stage to do again...
         """
         
         self.overrides = overrides
@@ -111,6 +127,9 @@ class GenHAlign(object):
         logfilehandler = logging.FileHandler('%s.log' % (os.path.join(self.working_dir, NAME + "_" + strftime("%Y%m%d%H%M%S"))))
         logfilehandler.setFormatter(formatter)
         log.addHandler(logfilehandler)
+
+        #load manifest of stages already done...
+        self.manifest = StageManifest(os.path.join(self.working_dir, MANIFEST_FN), force)
         
         #copy configuration file for the record (if possible)...and log configuration...
         log.info("Configuration file used: '%s'" % configfile_location)
@@ -161,6 +180,10 @@ class GenHAlign(object):
         self.mappedbootstrap = self.getParm("SWITCHES", "MAPPEDBOOTSTRAP", boolean=True)
         self.textgrid_output = self.getParm("SWITCHES", "TEXTGRID_OUTPUT", boolean=True)
         self.postcleanup = self.getParm("SWITCHES", "POSTCLEANUP", boolean=True)
+        self.numworkers = self.getOptionalParm("PARMS", "NUM_WORKERS", DEF_NUMWORKERS, int)
+        self.reest_threshold = self.getOptionalParm("PARMS", "REEST_THRESHOLD", GenHAlign.DEF_REEST_THRESHOLD, float)
+        self.reest_miniters = self.getOptionalParm("PARMS", "REEST_MIN_ITERATIONS", GenHAlign.DEF_REEST_MINITERS, int)
+        self.reest_maxiters = self.getOptionalParm("PARMS", "REEST_MAX_ITERATIONS", GenHAlign.DEF_REEST_MAXITERS, int)
 
         if bool(self.orthographic_location) and bool(self.pronundict_location):
             self.have_ortho_and_pronundict = True
@@ -198,12 +221,12 @@ class GenHAlign(object):
 
         log.info("Starting Process.") 
         starttime = time()
-        self.organiseTranscriptions()
-        self.makeFeats()
-        self.initModels()
-        self.trainModels()
-        self.doAlignment()
-        if self.textgrid_output: self.doTextgridOutput()
+        self.runStage("organiseTranscriptions")
+        self.runStage("makeFeats")
+        self.runStage("initModels")
+        self.runStage("trainModels")
+        self.runStage("doAlignment")
+        if self.textgrid_output: self.runStage("doTextgridOutput")
         if self.postcleanup: self.doCleanup()
         endtime = time()
         log.info("Process Done (in %.0f seconds)." % (endtime - starttime))
@@ -243,10 +266,71 @@ class GenHAlign(object):
                 return self.overrides[overridekey]
 
 
+    def getOptionalParm(self, sectionkey, key, default, convert=unicode):
+        """Get parameter using 'getParm' and 'convert' it, returns
+           'default' if not defined or empty...
+        """
+        try:
+            value = self.getParm(sectionkey, key)
+        except NoOptionError:
+            return default
+        if not value:
+            return default
+        return convert(value)
+
+
+    def modelOptions(self):
+        """Values of the [PARMS] and [SWITCHES] options (with
+           overrides) that affect model training, as "SECTION:KEY
+           value" strings for the models' input fingerprint...
+        """
+        options = {}
+        for sectionkey in ["PARMS", "SWITCHES"]:
+            for key, value in self.config.items(sectionkey):
+                options[":".join([sectionkey, key.upper()])] = value
+        for overridekey, value in self.overrides.iteritems():
+            if overridekey.split(":")[0] in ["PARMS", "SWITCHES"]:
+                options[overridekey] = value
+        return ["%s %s" % (k, v) for k, v in sorted(options.iteritems()) if k not in GenHAlign.NONMODEL_OPTIONS]
+
+
+    def reestimate(self, mlflocation, maxiters, **kwargs):
+        """Repeat embedded re-estimation until the relative improvement
+           in average log probability per frame is less than
+           'self.reest_threshold' (at least 'self.reest_miniters' and
+           at most 'maxiters' iterations). Returns the log
+           probabilities...
+        """
+        miniters = min(self.reest_miniters, maxiters)
+        curve = []
+        for i in range(maxiters):
+            curve.append(self.models.doEmbeddedRest(mlflocation, **kwargs))
+            if len(curve) == 1:
+                log.info("Re-estimation iteration %s (%s%s): avg log prob per frame %.4f" % (i + 1, HMM_DIR, self.models.iteration, curve[-1]))
+                continue
+            improvement = (curve[-1] - curve[-2]) / abs(curve[-2])
+            log.info("Re-estimation iteration %s (%s%s): avg log prob per frame %.4f (relative improvement %.5f)" % (i + 1, HMM_DIR, self.models.iteration, curve[-1], improvement))
+            if len(curve) >= miniters and improvement < self.reest_threshold:
+                log.info("Re-estimation converged after %s iterations." % (len(curve)))
+                break
+        log.info("Re-estimation curve: %s" % (" ".join("%.4f" % (logprob) for logprob in curve)))
+        return curve
+
+
+    def runStage(self, stage):
+        """Do 'stage' (method name) and note this in the manifest...
+        """
+        log.info("Stage '%s'." % (stage))
+        self.manifest.begin(stage)
+        getattr(self, stage)()
+        self.manifest.finish(stage)
+
+
     def doCleanup(self):
         """Remove 'feats', 'bootfeats' and 'models' trees...
         """
         log.info("Removing 'models' and 'feats' dirs.")
+        self.manifest.invalidate("makeFeats")
 
         shutil.rmtree(self.feats_dir)
         try:
@@ -257,7 +341,8 @@ class GenHAlign(object):
         
 
     def makeDirs(self):
-        """Make 'working' directory structure...
+        """Make 'working' directory structure (existing dirs are
+           reused)...
         """
         
         self.working_dir = self.getParm("PARMS", "WORKING_DIR", path=True)
@@ -267,16 +352,17 @@ class GenHAlign(object):
         self.output_dir = os.path.join(self.working_dir, GenHAlign.OUTPUT_DIR)
         self.bootfeats_dir = os.path.join(self.working_dir, GenHAlign.BOOTFEAT_DIR)
         self.textgrid_dir = os.path.join(self.working_dir, GenHAlign.TEXTGRID_DIR)
-        try:
-            os.makedirs(self.working_dir)
-        except OSError:
-            print("WARNING: Working dir '%s' already existed..." % self.working_dir)
-        os.makedirs(self.etc_dir)
-        os.makedirs(self.feats_dir)
-        os.makedirs(self.models_dir)
-        os.makedirs(self.output_dir)
-        os.makedirs(self.bootfeats_dir)
-        os.makedirs(self.textgrid_dir)
+        if os.path.isdir(self.working_dir):
+            print("WARNING: Working dir '%s' already existed (resuming)..." % self.working_dir)
+        for location in [self.working_dir,
+                         self.etc_dir,
+                         self.feats_dir,
+                         self.models_dir,
+                         self.output_dir,
+                         self.bootfeats_dir,
+                         self.textgrid_dir]:
+            if not os.path.isdir(location):
+                os.makedirs(location)
 
     
     def doTextgridOutput(self):
@@ -421,20 +507,45 @@ class GenHAlign(object):
 
         self.source_audio_location = self.getParm("SOURCE", "AUDIO", path=True)
         self.featconf_location = self.getParm("SOURCE", "FEATS_CONFIG", path=True)
+        try:
+            self.featscache_location = self.getParm("PARMS", "FEATS_CACHE")
+        except NoOptionError:
+            self.featscache_location = None
+        if self.featscache_location:
+            self.featscache_location = self.getParm("PARMS", "FEATS_CACHE", path=True)
+        else:
+            self.featscache_location = None
         
-        self.audiofeats = AudioFeatures(self.source_audio_location, self.featconf_location)
+        self.audiofeats = AudioFeatures(self.source_audio_location,
+                                        self.featconf_location,
+                                        numworkers=self.numworkers,
+                                        cachelocation=self.featscache_location)
         
         #check all labels in transcriptionset...
         if not self.transcr.allLabelsInTranscr(self.audiofeats):
             log.error("Transcription set does not cover all audio files.")
             raise Exception("Transcription set does not cover all audio files....")
 
+        #skip if done with the same audio and configuration...
+        featsinputs = [dirFingerprint(self.source_audio_location),
+                       filesFingerprint([self.featconf_location])]
+        if not self.have_bootmodels and self.have_bootdata:
+            featsinputs.append(dirFingerprint(self.bootaudio_location))
+        self.featsinputs = fingerprint(featsinputs)
+        if (self.manifest.checkInputs("makeFeats", self.featsinputs) and
+            len(type_files(os.listdir(self.feats_dir), MFCC_EXT)) == len(self.audiofeats.getWavFilelist())):
+            log.info("Resuming: feats already made.")
+            return
+
         #make features...
         self.audiofeats.makeFeats(self.feats_dir)
 
         if not self.have_bootmodels and self.have_bootdata:
             log.info("Making boot feats.")
-            self.bootfeats = AudioFeatures(self.bootaudio_location, self.featconf_location)
+            self.bootfeats = AudioFeatures(self.bootaudio_location,
+                                           self.featconf_location,
+                                           numworkers=self.numworkers,
+                                           cachelocation=self.featscache_location)
             if not self.boottranscr.allLabelsInTranscr(self.bootfeats):
                 log.error("Boot transcription set does not cover all boot audio files.")
                 raise Exception("Some labels not found in boottranscriptionset....")
@@ -455,7 +566,19 @@ class GenHAlign(object):
                              self.silphone,
                              self.protofile_location,
                              self.featconf_location,
-                             self.feats_dir)
+                             self.feats_dir,
+                             numworkers=self.numworkers)
+
+        #models already made in a previous run are reused...
+        self.manifest.checkInputs("initModels", fingerprint(self.modelOptions() +
+                                                            [getattr(self, "featsinputs", ""),
+                                                             filesFingerprint([self.protofile_location,
+                                                                               self.bootmodels_location,
+                                                                               getattr(self, "dict_location", None),
+                                                                               getattr(self, "wordmlf_location", None),
+                                                                               getattr(self, "phonemlf_location", None),
+                                                                               getattr(self, "bootmlf_location", None)])]))
+        self.models = CheckpointedModels(self.models, self.manifest)
     
         if self.have_bootmodels:
             print("COPYING BOOTSTRAP MODELS...(NO VARIANCE FLOOR SET...)")
@@ -479,8 +602,7 @@ class GenHAlign(object):
             print("FLATSTART....")
             log.info("Performing 'flatstart' initialisation.")
             self.models.doFlatStart()
-            for i in range(3):
-                self.models.doEmbeddedRest(self.phonemlf_location)
+            self.reestimate(self.phonemlf_location, GenHAlign.FLATSTART_REEST_MAXITERS)
     
         #fix silence model
         self.models.addStandardSilTransitions()
@@ -491,8 +613,7 @@ class GenHAlign(object):
         """
 
         print("RE-ESTIMATING....")
-        for i in range(5):
-            self.models.doEmbeddedRest(self.phonemlf_location)
+        self.reestimate(self.phonemlf_location, self.reest_maxiters)
 
         if self.cdhmms:
             self.makeTriphones()
@@ -567,6 +688,10 @@ class GenHAlign(object):
         
         print("LABELING....")
 
+        if self.manifest.isDone("doAlignment"):
+            log.info("Resuming: alignment already done.")
+            return
+
         if self.have_ortho_and_pronundict:
             log.info("Performing alignment (from orthography).")
             self.models.forcedAlignment(self.wordmlf_location, self.dict_location, self.output_dir)
@@ -584,11 +709,11 @@ class GenHAlignRealign(GenHAlign):
     alternate pronunciations in the source_dictinoary and tries to
     catch unforeseen SILs between words...
     """
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    def __init__(self, configfile_location, overrides={}, setup_only=False, force=None):
         """ Inherit...
         """
         
-        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True)
+        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True, force=force)
 
         log.info("Process: 'GenHAlignRealign'")
 
@@ -597,12 +722,12 @@ class GenHAlignRealign(GenHAlign):
 
         log.info("Starting Process.") 
         starttime = time()
-        self.organiseTranscriptions()
-        self.makeFeats()
-        self.initModels()
-        self.trainModels()
-        self.doAlignment()
-        if self.textgrid_output: self.doTextgridOutput()
+        self.runStage("organiseTranscriptions")
+        self.runStage("makeFeats")
+        self.runStage("initModels")
+        self.runStage("trainModels")
+        self.runStage("doAlignment")
+        if self.textgrid_output: self.runStage("doTextgridOutput")
         if self.postcleanup: self.doCleanup()
         endtime = time()
         log.info("Process Done (in %.0f seconds)." % (endtime - starttime))
@@ -666,8 +791,10 @@ class GenTrainASR(GenHAlign):
     """ Defines a process to train HMMs for general ASR usage...
     """
 
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    def __init__(self, configfile_location, overrides={}, setup_only=False, force=None):
         """Initialises process (reads from config and sets switches/variables...)...
+           Stages already done in the working dir (see 'manifest.json')
+           are skipped, 'force' names a stage to do again...
         """
         
         self.overrides = overrides
@@ -691,6 +818,9 @@ class GenTrainASR(GenHAlign):
         logfilehandler = logging.FileHandler('%s.log' % (os.path.join(self.working_dir, NAME + "_" + strftime("%Y%m%d%H%M%S"))))
         logfilehandler.setFormatter(formatter)
         log.addHandler(logfilehandler)
+
+        #load manifest of stages already done...
+        self.manifest = StageManifest(os.path.join(self.working_dir, MANIFEST_FN), force)
         
         #copy configuration file for the record (if possible)...and log configuration...
         log.info("Configuration file used: '%s'" % configfile_location)
@@ -716,6 +846,10 @@ class GenTrainASR(GenHAlign):
         self.nummixs = self.getParm("SWITCHES", "MIXTURES_PER_STATE")
         self.mappedbootstrap = self.getParm("SWITCHES", "MAPPEDBOOTSTRAP", boolean=True)
         self.postcleanup = self.getParm("SWITCHES", "POSTCLEANUP", boolean=True)
+        self.numworkers = self.getOptionalParm("PARMS", "NUM_WORKERS", DEF_NUMWORKERS, int)
+        self.reest_threshold = self.getOptionalParm("PARMS", "REEST_THRESHOLD", GenHAlign.DEF_REEST_THRESHOLD, float)
+        self.reest_miniters = self.getOptionalParm("PARMS", "REEST_MIN_ITERATIONS", GenHAlign.DEF_REEST_MINITERS, int)
+        self.reest_maxiters = self.getOptionalParm("PARMS", "REEST_MAX_ITERATIONS", GenHAlign.DEF_REEST_MAXITERS, int)
 
         if bool(self.orthographic_location) and bool(self.pronundict_location):
             self.have_ortho_and_pronundict = True
@@ -748,10 +882,10 @@ class GenTrainASR(GenHAlign):
 
         log.info("Starting Process.") 
         starttime = time()
-        self.organiseTranscriptions()
-        self.makeFeats()
-        self.initModels()
-        self.trainModels()
+        self.runStage("organiseTranscriptions")
+        self.runStage("makeFeats")
+        self.runStage("initModels")
+        self.runStage("trainModels")
         self.testModels()
         if self.postcleanup: self.doCleanup()
         endtime = time()
@@ -759,7 +893,8 @@ class GenTrainASR(GenHAlign):
 
 
     def makeDirs(self):
-        """Make 'working' directory structure...
+        """Make 'working' directory structure (existing dirs are
+           reused)...
         """
         
         self.working_dir = self.getParm("PARMS", "WORKING_DIR", path=True)
@@ -767,14 +902,15 @@ class GenTrainASR(GenHAlign):
         self.feats_dir = os.path.join(self.working_dir, GenHAlign.FEAT_DIR)
         self.models_dir = os.path.join(self.working_dir, GenHAlign.MODELS_DIR)
         self.bootfeats_dir = os.path.join(self.working_dir, GenHAlign.BOOTFEAT_DIR)
-        try:
-            os.makedirs(self.working_dir)
-        except OSError:
-            print("WARNING: Working dir '%s' already existed..." % self.working_dir)
-        os.makedirs(self.etc_dir)
-        os.makedirs(self.feats_dir)
-        os.makedirs(self.models_dir)
-        os.makedirs(self.bootfeats_dir)
+        if os.path.isdir(self.working_dir):
+            print("WARNING: Working dir '%s' already existed (resuming)..." % self.working_dir)
+        for location in [self.working_dir,
+                         self.etc_dir,
+                         self.feats_dir,
+                         self.models_dir,
+                         self.bootfeats_dir]:
+            if not os.path.isdir(location):
+                os.makedirs(location)
 
 
 
@@ -856,7 +992,19 @@ class GenTrainASR(GenHAlign):
                                 self.spphone,
                                 self.protofile_location,
                                 self.featconf_location,
-                                self.feats_dir)
+                                self.feats_dir,
+                                numworkers=self.numworkers)
+
+        #models already made in a previous run are reused...
+        self.manifest.checkInputs("initModels", fingerprint(self.modelOptions() +
+                                                            [getattr(self, "featsinputs", ""),
+                                                             filesFingerprint([self.protofile_location,
+                                                                               self.bootmodels_location,
+                                                                               getattr(self, "dict_location", None),
+                                                                               getattr(self, "wordmlf_location", None),
+                                                                               getattr(self, "phonemlf_location", None),
+                                                                               getattr(self, "bootmlf_location", None)])]))
+        self.models = CheckpointedModels(self.models, self.manifest)
     
         if self.have_bootdata:
             print("BOOTSTRAP...(NO VARIANCE FLOOR SET...)")
@@ -872,8 +1020,7 @@ class GenTrainASR(GenHAlign):
             print("FLATSTART....")
             log.info("Performing 'flatstart' initialisation.")
             self.models.doFlatStart()
-            for i in range(3):
-                self.models.doEmbeddedRest(self.phonemlf_location)
+            self.reestimate(self.phonemlf_location, GenHAlign.FLATSTART_REEST_MAXITERS)
     
         #fix silence model
         self.models.fixSilModels()
@@ -971,11 +1118,11 @@ class PS_GenHAlign(GenHAlign):
         forced alignment using pitch synchronous features...
     """
 
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    def __init__(self, configfile_location, overrides={}, setup_only=False, force=None):
         """ Inherit...
         """
 
-        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True)
+        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True, force=force)
 
         log.info("Process: 'PS_GenHAlign'")
 
@@ -984,12 +1131,12 @@ class PS_GenHAlign(GenHAlign):
 
         log.info("Starting Process.") 
         starttime = time()
-        self.makeFeats()
-        self.organiseTranscriptions()
+        self.runStage("makeFeats")
+        self.runStage("organiseTranscriptions")
         self.crossCheckAudioTranscriptions()
-        self.initModels()
-        self.trainModels()
-        self.doAlignment()
+        self.runStage("initModels")
+        self.runStage("trainModels")
+        self.runStage("doAlignment")
         self.translateAlignments()
         if self.postcleanup: self.doCleanup()
         endtime = time()
@@ -1082,6 +1229,11 @@ def setopts():
                       default=DEF_LOGLEVEL,
                       help="specify log level (Supported levels: 0, 10, 20, 30, 40 or 50) [%default]",
                       metavar="LOGLEVEL")
+    parser.add_option("-f",
+                      "--force",
+                      dest="force",
+                      help="do STAGE (and following stages) again even if already done in working dir",
+                      metavar="STAGE")
     parser.add_option("-m",
                       "--method",
                       dest="method",
@@ -1112,11 +1264,11 @@ def main():
         raise Exception("Error parsing overrides...")
 
     if opts.method == "GenHAlign":
-        process = GenHAlign(configfile, overrides)
+        process = GenHAlign(configfile, overrides, force=opts.force)
     elif opts.method == "PS_GenHAlign":
-        process = PS_GenHAlign(configfile, overrides)
+        process = PS_GenHAlign(configfile, overrides, force=opts.force)
     elif opts.method == "GenTrainASR":
-        process = GenTrainASR(configfile, overrides)    
+        process = GenTrainASR(configfile, overrides, force=opts.force)    
     else:
         #shouldn't get here...
         pass
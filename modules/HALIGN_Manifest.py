@@ -0,0 +1 @@
+../halign/HALIGN_Manifest.py
\ No newline at end of file
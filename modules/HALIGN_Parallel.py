@@ -0,0 +1 @@
+../halign/HALIGN_Parallel.py
\ No newline at end of file
@@ -0,0 +1 @@
+../voicetools/ttslab_esttrack.py
\ No newline at end of file
@@ -0,0 +1 @@
+../voicetools/ttslab_f0fill.py
\ No newline at end of file
@@ -0,0 +1 @@
+../voicetools/ttslab_manifest.py
\ No newline at end of file
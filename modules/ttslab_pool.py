@@ -0,0 +1 @@
+../voicetools/ttslab_pool.py
\ No newline at end of file
@@ -0,0 +1 @@
+../voicetools/ttslab_unitcatalogue.py
\ No newline at end of file
@@ -1,44 +1,107 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+""" Create mono and full-context labels for all utterances in
+    "utts/". Each worker process loads the voice once (in the pool
+    initializer) and then processes many utterances, a timing report
+    of voice loading vs. per-utterance cost is printed at the end...
+"""
 from __future__ import unicode_literals, division, print_function #Py2
 
 __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
 import sys, os
+import time
+import codecs
+import traceback
 import multiprocessing
 from glob import glob
-import subprocess
+
+import ttslab
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utt2lab import utt2lab_mono, utt2lab_full
+
+CHUNKSIZE = 4
+
+WORKER_VOICE = None
+WORKER_LOADTIME = None
+
+
+def init_worker(voicefile):
+    global WORKER_VOICE, WORKER_LOADTIME
+    starttime = time.time()
+    WORKER_VOICE = ttslab.fromfile(voicefile)
+    WORKER_LOADTIME = time.time() - starttime
+
+
+def write_lab(lab, outfn):
+    with codecs.open(outfn, "w", encoding="utf-8") as outfh:
+        outfh.write("\n".join(lab) + "\n")
 
 
 def extract_labels(parms):
-    cmds = "python scripts/utt2lab.py mono %(voice)s %(infn)s > %(mono_outfn)s"
-    subprocess.call(cmds % parms, shell=True)
-    cmds = "python scripts/utt2lab.py full %(voice)s %(infn)s > %(full_outfn)s"
-    subprocess.call(cmds % parms, shell=True)
+    """ Returns (pid, voice loadtime, utt loadtime, label time, error)...
+    """
+    starttime = time.time()
+    try:
+        utt = ttslab.fromfile(parms["infn"])
+        utttime = time.time()
+        write_lab(utt2lab_mono(WORKER_VOICE, utt), parms["mono_outfn"])
+        write_lab(utt2lab_full(WORKER_VOICE, utt), parms["full_outfn"])
+        error = None
+    except Exception:
+        utttime = time.time()
+        error = traceback.format_exc()
+    return os.getpid(), WORKER_LOADTIME, utttime - starttime, time.time() - utttime, error
 
 
-if __name__ == "__main__":
+def report(results, walltime):
+    voiceloads = dict((pid, loadtime) for pid, loadtime, utttime, labtime, error in results)
+    done = [r for r in results if r[-1] is None]
+    numutts = len(results)
+    meanload = sum(voiceloads.values()) / len(voiceloads) if voiceloads else 0.0
+    meanutt = sum(r[2] for r in done) / len(done) if done else 0.0
+    meanlab = sum(r[3] for r in done) / len(done) if done else 0.0
+    print("VOICE LOADING: %d worker(s), %.2fs per load (%.2fs total)" %
+          (len(voiceloads), meanload, sum(voiceloads.values())))
+    print("PER UTT: %.3fs loading utt + %.3fs making labels = %.3fs" %
+          (meanutt, meanlab, meanutt + meanlab))
+    print("LABELS: %d done, %d failed in %.2fs (one process per label would spend ~%.2fs loading voices)" %
+          (len(done), numutts - len(done), walltime, 2 * numutts * meanload))
 
+
+if __name__ == "__main__":
     try:
-        import multiprocessing
-        POOL = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        def map(f, i):
-            return POOL.map(f, i, chunksize=1)
-    except ImportError:
-        pass
-
-    argnames = ["voice"]
-    assert len(argnames) == len(sys.argv[1:])
-    args = dict(zip(argnames, sys.argv[1:]))
+        voicefile = sys.argv[1]
+    except IndexError:
+        print("usage: extract_labels.py VOICEFILE [NUMWORKERS]")
+        sys.exit(1)
+    try:
+        numworkers = int(sys.argv[2])
+    except IndexError:
+        numworkers = multiprocessing.cpu_count()
+
     #make parms:
     parms = []
-    for fn in glob(os.path.join("utts", "*.utt.pickle")):
-        tempd = dict(args)
+    for fn in sorted(glob(os.path.join("utts", "*.utt.pickle"))):
+        tempd = {}
         tempd["infn"] = fn
         base = os.path.basename(fn).rstrip(".utt.pickle")
         tempd["mono_outfn"] = os.path.join("labels/mono", base + ".lab")
         tempd["full_outfn"] = os.path.join("labels/full", base + ".lab")
         parms.append(tempd)
+
     #run:
-    map(extract_labels, parms)
+    starttime = time.time()
+    pool = multiprocessing.Pool(processes=numworkers, initializer=init_worker, initargs=(voicefile,))
+    results = []
+    for tempd, result in zip(parms, pool.imap(extract_labels, parms, chunksize=CHUNKSIZE)):
+        if result[-1] is not None:
+            print("%s: FAILED\n%s" % (tempd["infn"], result[-1]), file=sys.stderr)
+        results.append(result)
+    pool.close()
+    pool.join()
+    report(results, time.time() - starttime)
+    if any(result[-1] is not None for result in results):
+        sys.exit(1)
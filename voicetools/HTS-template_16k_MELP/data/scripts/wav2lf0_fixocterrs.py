@@ -10,8 +10,6 @@ __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
 import sys
-import array
-import math
 
 import numpy as np
 
@@ -20,10 +18,15 @@ from ttslab.trackfile import Track
 ttslab.extend(Track, "ttslab.trackfile.funcs.tfuncs_praat")
 
 def friendly_log(f):
-    try:
-        return math.log(f)
-    except ValueError:
-        return float('-1e+10')
+    """ Natural log of all values, with -1e+10 where undefined
+        (unvoiced)...
+    """
+    f = np.asarray(f, dtype=np.float64).ravel()
+    lf0 = np.empty(len(f), dtype=np.float32)
+    lf0.fill(-1e+10)
+    voiced = f > 0.0
+    lf0[voiced] = np.log(f[voiced])
+    return lf0
 
 if __name__ == "__main__":
     fn = sys.argv[1]
@@ -36,6 +39,6 @@ if __name__ == "__main__":
     #hack aligns samples with equiv from HTS script:
     pad = np.array([0.0, 0.0]).reshape(-1, 1)
     f0hzvalues = np.concatenate([pad, t.values, pad])
-    lf0 = array.array(b"f", map(friendly_log, f0hzvalues))
+    lf0 = friendly_log(f0hzvalues)
     with open(outfn, "wb") as outfh:
         lf0.tofile(outfh)
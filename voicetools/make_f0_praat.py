@@ -48,7 +48,9 @@
 ## $Id:: make_f0_praat.py 5077 2006-09-15 10:11:09Z aby                           $ ##
 
 import os,sys,commands,math;
-from tempfile import mkstemp
+
+from ttslab_esttrack import read_times
+from ttslab_f0fill import praat_pitch, select_f0, f0_at_times, write_f0_file
 
 class f0filler:       
     def __init__(self):
@@ -59,133 +61,23 @@ class f0filler:
         self.x1 = 0;
         
     def load_pitchmarks(self,pitchmarks_file):
-        f=open(pitchmarks_file,"r");
-        praat_output=f.readlines();
-        f.close();
-
-        praat_output_header = praat_output[0:5];
-        data = praat_output[8:len(praat_output)];
-
-        pitchmarks = [];
-        k = 0;
-    
-        for i in data:
-            pitchmark = i.split();
-            pitchmarks.append(pitchmark[0]);
-            pitchmarks[k] = (float)(pitchmarks[k])*(float)(1000000);
-            pitchmarks[k] = round(pitchmarks[k])
-            pitchmarks[k] = (float)(pitchmarks[k])/(float)(1000000)
-            k = k + 1;
-
-        self.pitchmarks = pitchmarks;
+        #pitchmark times rounded to microseconds
+        self.pitchmarks = read_times(pitchmarks_file, decimals=6).tolist();
 
     def get_praat_f0(self, f0script, wavefile):
-
-        fd, tmp = mkstemp()
-
-        command_string = "praat --run " + f0script + " " + wavefile + " " + tmp;
-        commands.getoutput(command_string);
-
-        f=open(tmp,"r");
-        praat_output=f.readlines();
-        f.close();
-        os.close(fd)
-        os.remove(tmp);
-
-        praat_output_header = praat_output[0:10];
-        self.interval = float(praat_output_header[6]);
-        self.x1 = float(praat_output_header[7]);
-        data = praat_output[10:len(praat_output)];
-
-        f0 = [];
-        k = 0;
-
-        while (k < len(data)):
-            intensity = float(data[k]);
-            k= k + 1;
-            nCandidates = int(data[k]);
-            k= k + 1;
-            
-            max_strength = 0;
-            max_f0 = 0;
-            
-            for i in range(0,nCandidates):
-                frequency = float(data[k]);
-                k= k + 1;
-                strength = float(data[k]);
-                k= k + 1;
-                if (strength > max_strength):
-                    max_strength = strength;
-                    max_f0 = frequency;
-                    
-
-            f0.append(max_f0);
-
-        self.f0_praat = f0;
-
-        k = 1;
-        for i in self.f0_praat:
-            time = ( k - 1 ) * self.interval + self.x1;
-            self.time_praat.append(time);
-            k = k + 1;
+        #strongest Praat candidate per frame
+        times, freqs, strengths = praat_pitch(wavefile, f0script);
+        self.time_praat = times;
+        self.f0_praat = select_f0(freqs, strengths);
+        if (len(times) > 1):
+            self.interval = times[1] - times[0];
+        if (len(times) > 0):
+            self.x1 = times[0];
 
     def make_festival_f0(self, f0file):
-        f = open(f0file,"w");
-        f.write("EST_File Track\n");
-        f.write("DataType ascii\n");
-        f.write("NumFrames " + str(len(self.pitchmarks)) + '\n');
-        f.write("NumChannels 1\n");
-        f.write("NumAuxChannels 0\n");
-        f.write("EqualSpace 0\n");
-        f.write("BreaksPresent true\n");
-        f.write("Channel_0 F0\n");
-        f.write("EST_Header_End\n");
-
-        index = 0;
-        prev_time = 0.0;
-        next_time = self.time_praat[index];
-
-        prev_f0 = 0.0;
-        next_f0 = self.f0_praat[index];
-
-
-        for i in self.pitchmarks:
-
-            this_f0 = 0.0;
-            breakp = 0;
-            in_interval = False;
-
-            if ((i > prev_time) and
-                (i < next_time)):
-                in_interval = True;
-
-            while (not(in_interval)):
-                if ((index + 1) == len(self.time_praat)):
-                    in_interval = True;
-                    prev_f0 = 0.0;
-                    next_f0 = 0.0;
-                    break;
-
-                prev_time = self.time_praat[index];
-                prev_f0 = self.f0_praat[index];
-                index = index + 1;
-                next_time = self.time_praat[index];
-                next_f0 = self.f0_praat[index];
-
-                if ((i > prev_time) and
-                    (i < next_time)):
-                    in_interval = True;
-
-            if ((prev_f0 == 0.0) or (next_f0 == 0.0)):
-                this_f0 = 0;
-                breakp = 0;
-            else:
-                this_f0 = ((next_f0 - prev_f0)/(next_time - prev_time))*(i - prev_time) + prev_f0;
-                breakp = 1;
-
-            f.write(str(i) + '\t' + str(breakp) + '\t' + str(this_f0) + '\n');
-
-        f.close();
+        #interpolated onto pitchmarks, unvoiced next to unvoiced frames
+        f0, voiced = f0_at_times(self.pitchmarks, self.time_praat, self.f0_praat);
+        write_f0_file(f0file, self.pitchmarks, f0, voiced);
     
 # Main
 def main():
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Compare the "native" and "praat" pitchmark backends of
+    wav2psmfcc.PMExtractor on a directory of wave files: time taken
+    and agreement of the (filled) pitchmarks...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import sys
+import time
+from glob import glob
+
+import numpy as np
+
+from wav2psmfcc import PMExtractor
+
+DEF_MINPITCH = 75.0
+DEF_MAXPITCH = 600.0
+DEF_DEFSTEP = 0.01
+
+
+def get_pmarks(backend, wavfilename, minpitch, maxpitch, defstep):
+    pme = PMExtractor(minpitch, maxpitch, defstep, backend=backend)
+    starttime = time.time()
+    pme.get_pmarks(wavfilename)
+    return np.array(pme.pitchmarks), time.time() - starttime
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('wavdir', metavar='WAVDIR', type=str, help="directory containing .wav files")
+    parser.add_argument('--min', metavar='MINPITCH', type=float, dest="minpitch", default=DEF_MINPITCH, help="minimum pitch (Hz)")
+    parser.add_argument('--max', metavar='MAXPITCH', type=float, dest="maxpitch", default=DEF_MAXPITCH, help="maximum pitch (Hz)")
+    parser.add_argument('--defstep', metavar='DEFSTEP', type=float, default=DEF_DEFSTEP, help="default stepsize (s) in unvoiced regions")
+    args = parser.parse_args()
+
+    wavfilenames = sorted(glob(os.path.join(args.wavdir, "*.wav")))
+    if not wavfilenames:
+        print("No wave files found in '%s'..." % args.wavdir)
+        sys.exit(1)
+
+    totals = {"native": 0.0, "praat": 0.0}
+    deviations = []
+    for wavfilename in wavfilenames:
+        native, nativetime = get_pmarks("native", wavfilename, args.minpitch, args.maxpitch, args.defstep)
+        praat, praattime = get_pmarks("praat", wavfilename, args.minpitch, args.maxpitch, args.defstep)
+        totals["native"] += nativetime
+        totals["praat"] += praattime
+        #distance from each praat mark to the closest native mark:
+        if len(native) and len(praat):
+            idx = np.clip(np.searchsorted(native, praat), 1, len(native) - 1)
+            dev = np.minimum(np.abs(praat - native[idx - 1]), np.abs(praat - native[idx]))
+            deviations.append(dev)
+            meandev = dev.mean() * 1000
+        else:
+            meandev = float("nan")
+        print("%s: native %d marks (%.3fs) praat %d marks (%.3fs) mean deviation %.2fms" %
+              (os.path.basename(wavfilename), len(native), nativetime, len(praat), praattime, meandev))
+
+    print("TOTAL (%d files): native %.2fs praat %.2fs (speedup %.1fx)" %
+          (len(wavfilenames), totals["native"], totals["praat"],
+           totals["praat"] / totals["native"] if totals["native"] > 0 else float("nan")))
+    if deviations:
+        deviations = np.concatenate(deviations) * 1000
+        print("DEVIATION (ms): mean %.2f median %.2f 95th percentile %.2f" %
+              (deviations.mean(), np.median(deviations), np.percentile(deviations, 95)))
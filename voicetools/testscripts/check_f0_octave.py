@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Check wav2psmfcc.estimate_f0 (the "native" pitch analysis) on
+    synthetic tones: every frame should be voiced and within 2% of the
+    tone's F0 (no octave or subharmonic errors), and noise and
+    silence should be unvoiced...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import sys
+
+import numpy as np
+
+from wav2psmfcc import estimate_f0, PITCH_MIN, PITCH_MAX
+
+SAMPLERATES = [8000, 16000, 22050, 44100]
+TONE_F0S = [80.0, 100.0, 150.0, 200.0, 220.0, 250.0, 300.0, 350.0, 400.0, 450.0, 500.0, 580.0]
+DURATION = 0.5
+MAX_DEVIATION = 0.02
+
+
+def tones(f0, samplerate):
+    """ A sine and a tone with all harmonics (amplitude 1/k) up to the
+        Nyquist frequency...
+    """
+    t = np.arange(int(DURATION * samplerate)) / samplerate
+    yield "sine", 0.5 * np.sin(2 * np.pi * f0 * t)
+    yield "harmonics", sum(0.5 / k * np.sin(2 * np.pi * k * f0 * t + 0.3 * k)
+                           for k in range(1, int(samplerate / 2 / f0) + 1)
+                           if k * f0 < samplerate / 2)
+
+
+if __name__ == "__main__":
+    failures = 0
+    for samplerate in SAMPLERATES:
+        for tonef0 in TONE_F0S:
+            for kind, samples in tones(tonef0, samplerate):
+                times, f0 = estimate_f0(samples, samplerate, PITCH_MIN, PITCH_MAX)
+                if not (len(f0) and np.all(np.abs(f0 / tonef0 - 1.0) < MAX_DEVIATION)):
+                    failures += 1
+                    voiced = f0[f0 > 0.0]
+                    print("FAIL: %s %.0f Hz at %s Hz: %d/%d frames voiced, median F0 %s" % (kind, tonef0, samplerate,
+                                                                                            len(voiced), len(f0),
+                                                                                            np.median(voiced) if len(voiced) else "-"))
+        np.random.seed(0)
+        for kind, samples in [("noise", 0.3 * np.random.randn(samplerate)),
+                              ("silence", np.zeros(samplerate))]:
+            times, f0 = estimate_f0(samples, samplerate, PITCH_MIN, PITCH_MAX)
+            if np.any(f0 > 0.0):
+                failures += 1
+                print("FAIL: %s at %s Hz: %d/%d frames voiced" % (kind, samplerate, np.sum(f0 > 0.0), len(f0)))
+    print("OK" if failures == 0 else "%d FAILURES" % (failures))
+    sys.exit(1 if failures else 0)
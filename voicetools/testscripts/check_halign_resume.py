@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Check that an HAlign model training interrupted by a failed
+    tieStates resumes with the triphone model list, and that a rerun
+    with more or fewer re-estimation steps than recorded means that
+    the alignment has to be done again: runs HALIGN_Models.HMMSet
+    wrapped by HALIGN_Manifest.CheckpointedModels using stand-in HTK
+    tools that log the model list they are given...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import sys
+import stat
+import codecs
+import shutil
+from tempfile import mkdtemp
+
+from HALIGN_Models import HMMSet
+from HALIGN_Manifest import StageManifest, CheckpointedModels, MANIFEST_FN
+
+MONOPHONES = ["a", "b"]
+SILPHONE = "pau"
+TRIPHONES = ["a+b", "pau-a+b", "a-b+pau", "pau"]
+
+PROTO = """~o <VECSIZE> 1 <USER>
+~h "proto"
+<BEGINHMM>
+<NUMSTATES> 3
+<ENDHMM>
+"""
+
+FEATSCONF = """[GLOBAL]
+TARGETKIND = USER
+
+[HCOMPV_HVITE]
+"""
+
+#stand-in HTK tools: log the model list (last argument) and make the
+#output models, HHEd fails on state tying if $FAILTIE exists
+HCOMPV = """#!/bin/sh
+while [ "$1" != "-M" ]; do shift; done
+cp "$3" "$2/"
+echo "~v varFloor1" > "$2/vFloors"
+"""
+
+HHED = """#!/bin/sh
+while [ "$1" != "-M" ]; do shift; done
+if grep -q "^TB" "$3" && [ -e "$FAILTIE" ]; then exit 1; fi
+echo "HHEd $(grep -o '^[A-Z][A-Z]' "$3" | sort -u | tr '\\n' ' ')" >> "$TOOLLOG"
+tr '\\n' ' ' < "$4" >> "$TOOLLOG"; echo >> "$TOOLLOG"
+touch "$2/macros" "$2/hmmdefs"
+"""
+
+HEREST = """#!/bin/sh
+while [ "$1" != "-M" ]; do shift; done
+echo "HERest" >> "$TOOLLOG"
+tr '\\n' ' ' < "$3" >> "$TOOLLOG"; echo >> "$TOOLLOG"
+touch "$2/macros" "$2/hmmdefs"
+echo "Reestimation complete - average log prob per frame = -70.0"
+"""
+
+
+def write(location, text, executable=False):
+    with codecs.open(location, "w", encoding="utf-8") as outfh:
+        outfh.write(text)
+    if executable:
+        os.chmod(location, os.stat(location).st_mode | stat.S_IXUSR)
+
+
+def train(workdir, numreests=1):
+    """ The triphone part of HAlign model training, with 'numreests'
+        re-estimations after tying...
+    """
+    models = HMMSet(os.path.join(workdir, "models"),
+                    MONOPHONES,
+                    SILPHONE,
+                    os.path.join(workdir, "proto"),
+                    os.path.join(workdir, "feats.conf"),
+                    os.path.join(workdir, "feats"))
+    manifest = StageManifest(os.path.join(workdir, MANIFEST_FN))
+    manifest.begin("trainModels")
+    models = CheckpointedModels(models, manifest)
+    models.doFlatStart()
+    models.doEmbeddedRest("train.mlf")
+    models.cloneTriphones(os.path.join(workdir, "triphones"))
+    models.doEmbeddedRest("train.mlf", os.path.join(workdir, "stats"))
+    models.tieStates(os.path.join(workdir, "stats"), os.path.join(workdir, "triphones"))
+    for i in range(numreests):
+        models.doEmbeddedRest("train.mlf")
+    manifest.finish("trainModels")
+    return models, manifest
+
+
+def align(manifest):
+    """ Stand-in for the alignment stage...
+    """
+    manifest.begin("doAlignment")
+    manifest.finish("doAlignment")
+
+
+def toollog(workdir):
+    location = os.path.join(workdir, "tools.log")
+    if not os.path.isfile(location):
+        return []
+    with codecs.open(location, encoding="utf-8") as infh:
+        lines = [line.split() for line in infh]
+    os.remove(location)
+    return zip(lines[::2], lines[1::2])
+
+
+if __name__ == "__main__":
+    workdir = mkdtemp(prefix="check_halign_resume_")
+    try:
+        bindir = os.path.join(workdir, "bin")
+        for dirname in [bindir, os.path.join(workdir, "models"), os.path.join(workdir, "feats")]:
+            os.makedirs(dirname)
+        write(os.path.join(bindir, "HCompV"), HCOMPV, executable=True)
+        write(os.path.join(bindir, "HHEd"), HHED, executable=True)
+        write(os.path.join(bindir, "HERest"), HEREST, executable=True)
+        write(os.path.join(workdir, "proto"), PROTO)
+        write(os.path.join(workdir, "feats.conf"), FEATSCONF)
+        write(os.path.join(workdir, "feats", "utt1.mfc"), "")
+        write(os.path.join(workdir, "triphones"), "\n".join(TRIPHONES) + "\n")
+        os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+        os.environ["TOOLLOG"] = os.path.join(workdir, "tools.log")
+        os.environ["FAILTIE"] = os.path.join(workdir, "failtie")
+
+        #first run: tieStates fails...
+        write(os.environ["FAILTIE"], "")
+        try:
+            train(workdir)
+            print("FAIL: tieStates did not fail")
+            sys.exit(1)
+        except Exception:
+            pass
+        os.remove(os.environ["FAILTIE"])
+        toollog(workdir)
+
+        failures = 0
+        #resume: only tieStates and the last doEmbeddedRest run...
+        models, manifest = train(workdir)
+        calls = toollog(workdir)
+        for tool, phonelist in calls:
+            print("%s: %s" % (" ".join(tool), " ".join(phonelist)))
+        if not (len(calls) == 2 and
+                calls[0][0][0] == "HHEd" and "TB" in calls[0][0] and
+                calls[1][0] == ["HERest"] and
+                all(phonelist == sorted(TRIPHONES) for tool, phonelist in calls) and
+                models.phonelist == sorted(TRIPHONES) and
+                models.iteration == 5):
+            failures += 1
+            print("FAIL: expected HHEd (TB) then HERest with %s" % (" ".join(sorted(TRIPHONES))))
+        align(manifest)
+
+        #rerun with one more step: only that step runs and the
+        #alignment is no longer done...
+        models, manifest = train(workdir, numreests=2)
+        calls = toollog(workdir)
+        if not ([tool for tool, phonelist in calls] == [["HERest"]] and
+                models.iteration == 6 and
+                not manifest.isDone("doAlignment")):
+            failures += 1
+            print("FAIL: one more step: expected one HERest and the alignment to be redone")
+        align(manifest)
+
+        #rerun with one step less: nothing runs, the extra recorded
+        #step is forgotten and the alignment is no longer done...
+        numsteps = len(manifest.steps)
+        models, manifest = train(workdir, numreests=1)
+        calls = toollog(workdir)
+        if not (calls == [] and
+                models.iteration == 5 and
+                len(manifest.steps) == numsteps - 1 and
+                not manifest.isDone("doAlignment") and
+                not StageManifest(os.path.join(workdir, MANIFEST_FN)).isDone("doAlignment")):
+            failures += 1
+            print("FAIL: one step less: expected no tool runs and the alignment to be redone")
+        print("OK" if failures == 0 else "%d FAILURES" % (failures))
+        sys.exit(1 if failures else 0)
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Check that the streamed corpus statistics used to normalise
+    joincoefs (mcep_stats and f0_stats in ttslab_make_halfphones.py
+    and ttslab_make_wordunits.py) are identical, bit for bit, to those
+    of the previous implementation (all tracks concatenated in memory)
+    on random tracks...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import sys
+
+import numpy as np
+
+import ttslab_make_halfphones
+import ttslab_make_wordunits
+
+NUMFILES = 50
+MAXFRAMES = 3000
+NUMCOEFS = [2, 13, 26]
+
+
+def make_tracks(module, numcoefs):
+    """ Random mcep and f0 (about 60% voiced) tracks by location,
+        with basenames that sort differently with and without
+        extension...
+    """
+    basenames = ["utt%03d" % i for i in range(NUMFILES)] + ["utt-000", "utt_000"]
+    tracks = {}
+    for basename in basenames:
+        numframes = np.random.randint(0, MAXFRAMES)
+        mceps = np.random.randn(numframes, numcoefs) * np.random.rand(numcoefs) * 10.0 + np.random.rand(numcoefs) * 100.0
+        f0s = np.random.rand(numframes, 1) * 200.0 + 80.0
+        f0s[np.random.rand(numframes) < 0.4] = 0.0
+        tracks[os.path.join(os.getcwd(), module.MCEP_DIR, ".".join([basename, module.MCEP_EXT]))] = mceps
+        tracks[os.path.join(os.getcwd(), module.F0_DIR, ".".join([basename, module.F0_EXT]))] = f0s
+    return basenames, tracks
+
+
+def previous_stats(module, tracks):
+    """ As previously done in make_joincoefs()...
+    """
+    mceptracks = dict((os.path.basename(fn), v) for fn, v in tracks.iteritems()
+                      if os.path.dirname(fn).endswith(module.MCEP_DIR))
+    f0tracks = dict((os.path.basename(fn), v) for fn, v in tracks.iteritems()
+                    if os.path.dirname(fn).endswith(module.F0_DIR))
+    allmcepvecs = np.concatenate([mceptracks[tn] for tn in sorted(mceptracks)])
+    allf0vecs = np.concatenate([f0tracks[tn][f0tracks[tn].nonzero()] for tn in sorted(f0tracks)])
+    return allmcepvecs.mean(0), allmcepvecs.std(0), allf0vecs.mean(0), allf0vecs.std(0)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    failures = 0
+    for module in [ttslab_make_halfphones, ttslab_make_wordunits]:
+        for numcoefs in NUMCOEFS:
+            basenames, tracks = make_tracks(module, numcoefs)
+            module.load_values = tracks.__getitem__
+            new = module.mcep_stats(basenames) + module.f0_stats(basenames)
+            old = previous_stats(module, tracks)
+            for name, a, b in zip(["mcep mean", "mcep std", "f0 mean", "f0 std"], new, old):
+                if not np.array_equal(a, b):
+                    failures += 1
+                    print("FAIL: %s %s (%s coefs): max difference %g" % (module.__name__, name, numcoefs, np.max(np.abs(a - b))))
+    print("OK" if failures == 0 else "%d FAILURES" % (failures))
+    sys.exit(1 if failures else 0)
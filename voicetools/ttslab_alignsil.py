@@ -34,6 +34,7 @@ HALIGNCONF_FILE = "halign.conf"
 WAV_DIR = "wavs_16k"
 UTTWAV_DIR = "wavs"
 HALIGNWORK_DIR = "halign"
+HALIGNFEATSCACHE_DIR = "halign_featscache"
 HALIGNINPUT_SUBDIR = "input"
 HALIGNINPUTTRANSCR_DIR = "trancr"
 TEXTGRID_DIR = "textgrids"
@@ -283,6 +284,7 @@ def to_textgrid(voice):
     halign_config_location   = os.path.join(CWD, ETC_DIR, HALIGNCONF_FILE)
 
     halign_working_dir       = os.path.join(CWD, HALIGNWORK_DIR)
+    halign_featscache_dir    = os.path.join(CWD, HALIGNFEATSCACHE_DIR)
     halign_input_transcr_dir = os.path.join(halign_working_dir, HALIGNINPUT_SUBDIR, HALIGNINPUTTRANSCR_DIR)
     textgrid_dir             = os.path.join(CWD, TEXTGRID_DIR)
 
@@ -312,6 +314,7 @@ def to_textgrid(voice):
                                 "SOURCE:PRONUNCIATION_DICTIONARY" : pronundict_location,
                                 "SOURCE:AUDIO" : wav_dir,
                                 "PARMS:WORKING_DIR" : halign_working_dir,
+                                "PARMS:FEATS_CACHE" : halign_featscache_dir,
                                 "PARMS:SILENCE_PHONE" : silence_phone})
     
     os.chdir(textgrid_dir)
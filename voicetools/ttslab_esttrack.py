@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+""" Reading and writing of Edinburgh Speech Tools (EST) Track files
+    directly to and from NumPy arrays (ascii and binary).
+
+    Data is parsed/formatted in single NumPy/string operations instead
+    of per-line Python work, so that tracks with many thousands of
+    frames (pitchmarks, F0, sig2fv output) load in milliseconds...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import numpy as np
+
+HEADER_END = b"EST_Header_End\n"
+#EST byte order designations:
+BYTEORDERS = {"10": ">",   #MSB first
+              "01": "<"}   #LSB first
+NATIVE_BYTEORDER = "01" if np.little_endian else "10"
+TIME_FORMAT = "%.6f"
+VALUE_FORMAT = "%.10g"
+
+
+def _parse_header(headerbytes):
+    """ Header lines are "Name Value" pairs (values may contain
+        spaces, e.g. channel names)...
+    """
+    header = {}
+    for line in headerbytes.decode("ascii").splitlines():
+        linelist = line.strip().split(None, 1)
+        if not linelist:
+            continue
+        header[linelist[0]] = linelist[1] if len(linelist) > 1 else ""
+    return header
+
+
+def read_track(filename):
+    """ Load an EST Track file, returns (times, breaks, values, header)
+        where 'values' has shape (NumFrames, NumChannels) and 'breaks'
+        is None if the file contains no breaks...
+    """
+    with open(filename, "rb") as infh:
+        data = infh.read()
+    headerend = data.find(HEADER_END)
+    if headerend == -1:
+        raise Exception("'%s' is not an EST file (no header end)..." % filename)
+    header = _parse_header(data[:headerend])
+    data = data[headerend + len(HEADER_END):]
+
+    #sanity checks
+    if header.get("EST_File") != "Track":
+        raise Exception("'%s' is not an EST Track file..." % filename)
+    if int(header.get("NumAuxChannels", 0)) != 0:
+        raise Exception("'%s': auxiliary channels are not supported..." % filename)
+    numframes = int(header["NumFrames"])
+    numchannels = int(header["NumChannels"])
+    breakspresent = header.get("BreaksPresent") == "true"
+    numcols = 1 + int(breakspresent) + numchannels
+
+    datatype = header.get("DataType", "ascii")
+    if datatype == "ascii":
+        frames = np.fromstring(data, dtype=np.float64, sep=" ")
+    elif datatype == "binary":
+        try:
+            byteorder = BYTEORDERS[header.get("ByteOrder", NATIVE_BYTEORDER)]
+        except KeyError:
+            raise Exception("'%s': unknown byte order '%s'..." % (filename, header["ByteOrder"]))
+        frames = np.frombuffer(data, dtype=byteorder + "f4", count=numframes * numcols)
+        frames = frames.astype(np.float64)
+    else:
+        raise Exception("'%s': unsupported data type '%s'..." % (filename, datatype))
+
+    if len(frames) != numframes * numcols:
+        raise Exception("'%s': 'NumFrames' does not match number of frames read..." % filename)
+    frames = frames.reshape((numframes, numcols))
+    times = frames[:, 0]
+    if breakspresent:
+        breaks = frames[:, 1]
+        values = frames[:, 2:]
+    else:
+        breaks = None
+        values = frames[:, 1:]
+    return times, breaks, values, header
+
+
+def read_times(filename, decimals=None):
+    """ Only the frame times (e.g. pitchmarks), optionally rounded...
+    """
+    times = read_track(filename)[0]
+    if decimals is not None:
+        times = np.round(times, decimals)
+    return times
+
+
+def write_track(filename, times, values=None, breaks=None, channelnames=None, binary=False,
+                timeformat=TIME_FORMAT, valueformat=VALUE_FORMAT):
+    """ Write an EST Track file. 'values' may be None (no channels,
+        e.g. pitchmarks), 1-D (one channel) or 2-D (NumFrames,
+        NumChannels). Breaks default to 1 for every frame. 'filename'
+        may also be an open file, in which case the caller closes it...
+    """
+    times = np.asarray(times, dtype=np.float64).reshape(-1)
+    numframes = len(times)
+    if values is None:
+        values = np.zeros((numframes, 0))
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values.reshape((-1, 1))
+    if len(values) != numframes:
+        raise Exception("Number of value frames (%s) does not match number of times (%s)..." % (len(values), numframes))
+    numchannels = values.shape[1]
+    if breaks is None:
+        breaks = np.ones(numframes)
+    breaks = np.asarray(breaks, dtype=np.float64).reshape((-1, 1))
+    if channelnames is None:
+        channelnames = []
+    if len(channelnames) not in (0, numchannels):
+        raise Exception("Number of channel names does not match number of channels...")
+
+    headerlines = ["EST_File Track",
+                   "DataType %s" % ("binary" if binary else "ascii")]
+    if binary:
+        headerlines.append("ByteOrder %s" % NATIVE_BYTEORDER)
+    headerlines.extend(["NumFrames %s" % numframes,
+                        "NumChannels %s" % numchannels,
+                        "NumAuxChannels 0",
+                        "EqualSpace 0",
+                        "BreaksPresent true"])
+    headerlines.extend(["Channel_%s %s" % (i, name) for i, name in enumerate(channelnames)])
+    headerlines.append(HEADER_END.decode("ascii"))
+
+    frames = np.hstack([times.reshape((-1, 1)), breaks, values])
+    if binary:
+        data = frames.astype(np.float32).tostring()
+    else:
+        #single format operation for all frames:
+        rowformat = "\t".join([timeformat, "%d"] + [valueformat] * numchannels) + "\n"
+        data = ((rowformat * numframes) % tuple(frames.ravel())).encode("ascii")
+
+    if isinstance(filename, basestring):
+        with open(filename, "wb") as outfh:
+            outfh.write("\n".join(headerlines).encode("ascii"))
+            outfh.write(data)
+    else:
+        filename.write("\n".join(headerlines).encode("ascii"))
+        filename.write(data)
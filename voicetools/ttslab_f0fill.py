@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Determine F0 at pitchmark positions and save as Festival/EST F0
+    tracks.
+
+    Pitch analysis from any backend is represented as a candidate
+    matrix: frame times plus (numframes, numcandidates) arrays of
+    candidate frequencies and strengths. The strongest candidate in
+    each frame is selected and linearly interpolated onto the
+    pitchmark times (regions next to unvoiced frames are unvoiced).
+    Backends:
+
+      praat  - "To Pitch (ac)..." via a Praat script (see
+               make_f0_praat_script.py), parsed from the short text
+               Pitch file
+      native - wav2psmfcc.estimate_f0() (a single candidate per frame)
+
+    Can be run over a whole corpus in a single process...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import sys
+import subprocess
+from glob import glob
+from tempfile import mkstemp
+
+import numpy as np
+
+from ttslab_esttrack import read_times, write_track
+from wav2psmfcc import read_wave, estimate_f0
+
+F0_BACKENDS = ["praat", "native"]
+DEF_F0_BACKEND = "praat"
+PRAAT_BIN = "praat"
+PRAAT_PITCH_HEADER_LINES = 10
+PM_EXT = "pm"
+F0_EXT = "f0"
+WAV_EXT = "wav"
+DEF_TIMESTEP = 0.01
+
+
+def read_praat_pitch(pitchfilename):
+    """ Parse a Praat Pitch object saved as a short text file, returns
+        (times, freqs, strengths) with candidate arrays padded with
+        zeros to the maximum number of candidates...
+    """
+    with open(pitchfilename) as infh:
+        lines = infh.read().splitlines()
+    header = lines[:PRAAT_PITCH_HEADER_LINES]
+    numframes = int(header[5])
+    interval = float(header[6])
+    x1 = float(header[7])
+    maxcands = int(header[9])
+    data = np.array(lines[PRAAT_PITCH_HEADER_LINES:], dtype=np.float64)
+
+    #locate frames (only the candidate counts need to be visited):
+    starts = np.zeros(numframes, dtype=np.int64)
+    numcands = np.zeros(numframes, dtype=np.int64)
+    k = 0
+    for i in range(numframes):
+        starts[i] = k + 2        #skip intensity and nCandidates
+        numcands[i] = int(data[k + 1])
+        k += 2 + 2 * numcands[i]
+    if k != len(data):
+        raise Exception("'%s': unexpected number of values in Pitch file..." % pitchfilename)
+
+    maxcands = max(maxcands, numcands.max() if numframes else 0)
+    candnums = np.arange(maxcands)
+    present = candnums < numcands[:, np.newaxis]
+    positions = starts[:, np.newaxis] + 2 * candnums
+    freqs = np.where(present, data[np.where(present, positions, 0)], 0.0)
+    strengths = np.where(present, data[np.where(present, positions + 1, 0)], 0.0)
+
+    times = np.arange(numframes) * interval + x1
+    return times, freqs, strengths
+
+
+def praat_pitch(wavfilename, praatscript):
+    """ Pitch candidates using the Praat script (as created by
+        make_f0_praat_script.script_writer)...
+    """
+    fd, pitchfilename = mkstemp()
+    os.close(fd)
+    try:
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call([PRAAT_BIN, "--run", praatscript, wavfilename, pitchfilename],
+                                  stdout=devnull, stderr=devnull)
+        return read_praat_pitch(pitchfilename)
+    finally:
+        os.remove(pitchfilename)
+
+
+def native_pitch(wavfilename, min_pitch, max_pitch, timestep=DEF_TIMESTEP):
+    """ Pitch "candidates" from the native estimator: a single
+        candidate per frame with strength 1.0 if voiced...
+    """
+    samples, samplerate = read_wave(wavfilename)
+    times, f0 = estimate_f0(samples, samplerate, min_pitch, max_pitch, timestep)
+    freqs = f0.reshape((-1, 1))
+    strengths = (freqs > 0.0).astype(np.float64)
+    return times, freqs, strengths
+
+
+def select_f0(freqs, strengths):
+    """ Frequency of the strongest candidate per frame, 0.0 if no
+        candidate has positive strength...
+    """
+    if freqs.shape[1] == 0:
+        return np.zeros(len(freqs))
+    best = np.argmax(strengths, 1)
+    rows = np.arange(len(freqs))
+    return np.where(strengths[rows, best] > 0.0, freqs[rows, best], 0.0)
+
+
+def f0_at_times(pmtimes, times, f0):
+    """ Linear interpolation of 'f0' (at frame 'times') onto
+        'pmtimes'. Pitchmarks outside the analysed range or adjacent to
+        an unvoiced frame are unvoiced (0.0). Returns (f0, voiced)...
+    """
+    pmtimes = np.asarray(pmtimes, dtype=np.float64)
+    if len(times) < 2:
+        return np.zeros(len(pmtimes)), np.zeros(len(pmtimes), dtype=bool)
+    left = np.searchsorted(times, pmtimes, side="right") - 1
+    inside = (left >= 0) & (left < len(times) - 1)
+    left = np.clip(left, 0, len(times) - 2)
+    voiced = inside & (f0[left] > 0.0) & (f0[left + 1] > 0.0)
+    return np.where(voiced, np.interp(pmtimes, times, f0), 0.0), voiced
+
+
+def write_f0_file(f0filename, pmtimes, f0, voiced):
+    """ Festival F0 track: one frame per pitchmark with break flag set
+        in voiced frames...
+    """
+    write_track(f0filename, pmtimes, f0, breaks=voiced, channelnames=["F0"])
+
+
+def make_f0_file(wavfilename, pmfilename, f0filename, backend=DEF_F0_BACKEND,
+                 praatscript=None, min_pitch=None, max_pitch=None):
+    """ F0 track at the pitchmarks in 'pmfilename' for a single
+        wavefile...
+    """
+    if backend == "praat":
+        if praatscript is None:
+            raise Exception("A Praat F0 script is required for the 'praat' backend...")
+        times, freqs, strengths = praat_pitch(wavfilename, praatscript)
+    elif backend == "native":
+        if min_pitch is None or max_pitch is None:
+            raise Exception("Pitch range is required for the 'native' backend...")
+        times, freqs, strengths = native_pitch(wavfilename, min_pitch, max_pitch)
+    else:
+        raise Exception("Unknown F0 backend '%s'..." % backend)
+    pmtimes = read_times(pmfilename, decimals=6)
+    f0, voiced = f0_at_times(pmtimes, times, select_f0(freqs, strengths))
+    write_f0_file(f0filename, pmtimes, f0, voiced)
+
+
+def make_f0_files(wavdir, pmdir, f0dir, backend=DEF_F0_BACKEND,
+                  praatscript=None, min_pitch=None, max_pitch=None):
+    """ Process all wavefiles in 'wavdir' (that have pitchmarks in
+        'pmdir') in this process. Returns the basenames of files that
+        failed...
+    """
+    failed = []
+    for wavfilename in sorted(glob(os.path.join(wavdir, ".".join(["*", WAV_EXT])))):
+        basename = os.path.splitext(os.path.basename(wavfilename))[0]
+        pmfilename = os.path.join(pmdir, ".".join([basename, PM_EXT]))
+        if not os.path.isfile(pmfilename):
+            print("%s: no pitchmarks, skipping..." % basename, file=sys.stderr)
+            failed.append(basename)
+            continue
+        print(basename)
+        try:
+            make_f0_file(wavfilename, pmfilename, os.path.join(f0dir, ".".join([basename, F0_EXT])),
+                         backend, praatscript, min_pitch, max_pitch)
+        except Exception as e:
+            print("%s: FAILED (%s)" % (basename, e), file=sys.stderr)
+            failed.append(basename)
+    return failed
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('wavdir', metavar='WAVDIR', type=str, help="directory containing .wav files")
+    parser.add_argument('pmdir', metavar='PMDIR', type=str, help="directory containing .pm files")
+    parser.add_argument('f0dir', metavar='F0DIR', type=str, help="output directory for .f0 files")
+    parser.add_argument('--backend', type=str, choices=F0_BACKENDS, default=DEF_F0_BACKEND, help="pitch analysis backend")
+    parser.add_argument('--script', metavar='PRAATSCRIPT', type=str, dest="praatscript", help="Praat F0 script (for the 'praat' backend)")
+    parser.add_argument('--min', metavar='MINPITCH', type=float, dest="minpitch", help="minimum pitch (Hz) (for the 'native' backend)")
+    parser.add_argument('--max', metavar='MAXPITCH', type=float, dest="maxpitch", help="maximum pitch (Hz) (for the 'native' backend)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.f0dir):
+        os.makedirs(args.f0dir)
+    failed = make_f0_files(args.wavdir, args.pmdir, args.f0dir, args.backend,
+                           args.praatscript, args.minpitch, args.maxpitch)
+    if failed:
+        print("%s file(s) failed: %s" % (len(failed), " ".join(failed)), file=sys.stderr)
+        sys.exit(1)
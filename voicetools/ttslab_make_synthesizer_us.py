@@ -4,16 +4,29 @@
 
     It looks for specific files and location and should thus be run
     from the appropriate location.
+
+    USAGE: ttslab_make_synthesizer_us.py [CATALOGUE SYNTHESIZERFILE]
+
+    CATALOGUE is a pickled catalogue (by default
+    data/unitcatalogue.pickle) or a memory-mapped catalogue directory
+    (see ttslab_unitcatalogue.py).
+    A synthesizer (and voice) made with a catalogue directory does not
+    contain the units, so the directory must be copied along with the
+    voice: it is found at its absolute location or at the location
+    given here, relative to the working directory when the voice is
+    loaded.
 """
 from __future__ import unicode_literals, division, print_function #Py2
 
 __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
+import os
 import sys
 import codecs
 
 import ttslab
+from ttslab_unitcatalogue import catalogue_handle
 
 CATALOGUE_FILE = "data/unitcatalogue.pickle"
 SYNTH_IMPLEMENTATION = "ttslab.synthesizers.unitselection"
@@ -27,6 +40,9 @@ if __name__ == "__main__":
         print("WARNING: CLI parameters not sufficient, using defaults...")
         catfile = CATALOGUE_FILE
         synthfile = SYNTHESIZER_FILE
+    if os.path.isdir(catfile):
+        print("NOTE: Using memory-mapped catalogue '%s', this directory must be distributed with the voice..." % catfile)
+        catfile = catalogue_handle(catfile)
         
     #later we can get overrides from the CLI arguments
     exec("from %s import Synthesizer" % SYNTH_IMPLEMENTATION)
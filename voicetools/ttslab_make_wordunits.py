@@ -12,6 +12,7 @@ __email__ = "dvn.demitasse@gmail.com"
 
 import os
 import sys
+import subprocess
 from collections import defaultdict
 from glob import glob
 import copy
@@ -20,18 +21,28 @@ from ConfigParser import ConfigParser
 
 import numpy as np
 
-from wav2psmfcc import PMExtractor
+from wav2psmfcc import PMExtractor, DEF_PM_BACKEND
 from make_f0_praat_script import script_writer as F0_PSCWriter
 from make_f0_praat import f0filler as F0Filler
+from ttslab_pool import WorkerPool
+from ttslab_manifest import BuildManifest, file_hash, make_key, config_key, entry_is_current
+from ttslab_unitcatalogue import CatalogueWriter
 import ttslab
 import ttslab.hrg as hrg
 ttslab.extend(hrg.Utterance, "ufuncs_analysis")
 from ttslab.trackfile import Track
 
 SAVE_COMPLETE_UTTS = True
+SAVE_PICKLED_CATALOGUE = True
+#compact catalogue that can be opened with ttslab_unitcatalogue.MappedUnitCatalogue
+#(can be given to ttslab_make_synthesizer_wordus.py, see its usage):
+SAVE_MAPPED_CATALOGUE = True
 #sometimes the limit needs to be increased to pickle large utts...
 BIGGER_RECURSION_LIMIT = 20000   #default is generally 1000
 
+#voice used by catalogue worker processes (see init_catalogue_worker)
+WORKER_VOICE = None
+
 WAV_DIR = "wavs"
 PM_DIR = "pm"
 LPC_DIR = "lpc"
@@ -40,10 +51,15 @@ MCEP_DIR = "mcep"
 JOIN_DIR = "joincoef"
 UTT_DIR = "utts"
 COMPLETE_UTT_DIR = "complete_utts"
+SHARD_DIR = "unit_shards"
+
+MANIFEST_FILE = "feats_manifest.json"
+STATS_VERSION = "concat-1"    #change when the corpus statistics change
 
 WAV_EXT = "wav"
 RES_EXT = "wav"
 UTT_EXT = "utt.pickle"
+SHARD_EXT = "units.pickle"
 LPC_EXT = "lpc"
 MCEP_EXT = "mcep"
 RES_EXT = "res"
@@ -52,6 +68,7 @@ PM_EXT = "pm"
 F0_EXT = "f0"
 
 NAME = "ttslab_make_wordunits.py"
+CATALOGUE_NAME = "word_catalogue"
 SIG2FV_BIN = "sig2fv"
 SIGFILTER_BIN = "sigfilter"
 
@@ -60,18 +77,34 @@ WINDOWFACTOR = 1
 ########################################
 ## FUNCTIONS
 
-def make_units(voice, utt_dir):
-    """Run synthesizer "feats" process on Utterances to create Unit level
+def make_dir(dirname):
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+def list_wavs(wav_dir):
+    return sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))
+
+def run_command(cmdstring):
+    """ Run external tool, raising an exception on failure so that it
+        is reported for the file being processed...
+    """
+    print(cmdstring)
+    subprocess.check_call(cmdstring, shell=True)
+
+def init_catalogue_worker(voice):
+    """ Called once in each catalogue worker process...
+    """
+    global WORKER_VOICE
+    WORKER_VOICE = voice
+    sys.setrecursionlimit(BIGGER_RECURSION_LIMIT)
+
+def make_units(voice, uttfilename):
+    """Run synthesizer "feats" process on Utterance to create Unit level
        to generate structure for adding acoustic features...
     """
-    print("MAKING UNITS..")
-    utts = []
-    for uttfilename in sorted(glob(os.path.join(utt_dir, ".".join(["*", UTT_EXT])))):
-        print(uttfilename)
-        utt = ttslab.fromfile(uttfilename)
-        utt = voice.synthesizer(utt, ("feats", None))
-        utts.append(utt)
-    return utts
+    utt = ttslab.fromfile(uttfilename)
+    utt = voice.synthesizer(utt, ("feats", None))
+    return utt
 
 
 ########## ADD_FEATS
@@ -136,52 +169,66 @@ def add_feats_to_utt(args):
     return u
 
 
-def add_feats_to_units(utts):
-    """ Load acoustic information and populate units...
+def add_feats_to_units(args):
+    """ Load Utterance, make units and populate them with acoustic
+        information. The units are saved per utterance (a shard) to be
+        merged into the catalogue later, so that only one Utterance
+        per worker is in memory at a time...
     """
-    print("ADDING FEATS...")
+    uttfilename, lpc_dir, joincoef_dir, f0_dir, shard_dir, complete_utt_dir = args
 
-    lpc_dir = os.path.join(os.getcwd(), LPC_DIR)
-    joincoef_dir = os.path.join(os.getcwd(), JOIN_DIR)
-    f0_dir = os.path.join(os.getcwd(), F0_DIR)
+    utt = make_units(WORKER_VOICE, uttfilename)
+    utt = add_feats_to_utt((utt, lpc_dir, joincoef_dir, f0_dir))
 
-    map(add_feats_to_utt,
-        [(utt, lpc_dir, joincoef_dir, f0_dir) for utt in utts])
+    shardfilename = os.path.join(shard_dir, ".".join([utt["file_id"], SHARD_EXT]))
+    ttslab.tofile(utt_units(utt), shardfilename)
 
-    return utts
+    if complete_utt_dir is not None:
+        try:
+            ttslab.tofile(utt, os.path.join(complete_utt_dir, ".".join([utt["file_id"], UTT_EXT])))
+        except RuntimeError:
+            #check what kind of monster utt caused the recursion limit to be exceeded...
+            #UTTERANCE CHUNKING IS IMPORTANT...
+            print("WARNING: could not save complete utt:", utt["file_id"])
+    return shardfilename
 ########## ADD_FEATS
 
 
 ########## PITCHMARKS
-def extract_pitchmarks(args):
-    wavfilename, minpitch, maxpitch, defstep, pm_dir= args
-
-    basename = os.path.splitext(os.path.basename(wavfilename))[0]
-    print(basename)
-        
-    pme = PMExtractor(minpitch, maxpitch, defstep)
-    pme.get_pmarks(wavfilename)
-    pme.write_est_file(os.path.join(pm_dir, ".".join([basename, PM_EXT])))
-
-def make_pitchmarks(featconfig, wav_dir):
-    """ Make 'filled' pitchmarks for future pitch-synchronous feature
-        extraction...
-    """
+def pitchmark_backend(featconfig):
+    if featconfig.has_option("PITCH", "PM_BACKEND"):
+        return featconfig.get("PITCH", "PM_BACKEND")
+    return DEF_PM_BACKEND
 
+def pitchmark_parms(featconfig):
     minpitch = int(featconfig.get("PITCH", "MIN"))
     maxpitch = int(featconfig.get("PITCH", "MAX"))
     defstep =  1 / float(featconfig.get("PITCH", "DEFAULT"))
-    
+    backend = pitchmark_backend(featconfig)
     pm_dir = os.path.join(os.getcwd(), PM_DIR)
-    os.mkdir(pm_dir)
+    return (minpitch, maxpitch, defstep, backend, pm_dir)
+
+def extract_pitchmarks(args):
+    wavfilename, minpitch, maxpitch, defstep, backend, pm_dir= args
+
+    basename = os.path.splitext(os.path.basename(wavfilename))[0]
+    print(basename)
 
-    print("MAKING PITCHMARKS...")
-    map(extract_pitchmarks,
-        [(wavfilename, minpitch, maxpitch, defstep, pm_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
+    pme = PMExtractor(minpitch, maxpitch, defstep, backend=backend)
+    pme.get_pmarks(wavfilename)
+    pme.write_est_file(os.path.join(pm_dir, ".".join([basename, PM_EXT])))
 ########## PITCHMARKS
 
 ########## LPCs
+def lpc_parms(featconfig):
+    lpc_order = featconfig.get("SIG2FV_LPC", "LPC_ORDER")
+    preemph_coef = featconfig.get("SIG2FV_LPC", "PREEMPH_COEF")
+    window_factor = featconfig.get("SIG2FV_LPC", "WINDOW_FACTOR")
+    window_type = featconfig.get("SIG2FV_LPC", "WINDOW_TYPE")
+    lpc_dir = os.path.join(os.getcwd(), LPC_DIR)
+    pm_dir = os.path.join(os.getcwd(), PM_DIR)
+    return (lpc_order, preemph_coef, window_factor, window_type, lpc_dir, pm_dir)
+
 def extract_lpcs(args):
     wavfilename, lpc_order, preemph_coef, window_factor, window_type, lpc_dir, pm_dir = args
 
@@ -203,8 +250,7 @@ def extract_lpcs(args):
                           window_factor,
                           "-window_type",
                           window_type])
-    print(cmdstring)
-    os.system(cmdstring)
+    run_command(cmdstring)
 
     # Extract the residual
     cmdstring = " ".join([SIGFILTER_BIN,
@@ -215,31 +261,28 @@ def extract_lpcs(args):
                           "-lpcfilter",
                           os.path.join(lpc_dir, ".".join([basename, LPC_EXT])),
                           "-inv_filter"])
-    print(cmdstring)
-    os.system(cmdstring)
-
-
-def make_lpcs(featconfig, wav_dir):
-    """ Make lpcs and residuals for synthesis units..
-    """
-    
-    lpc_order = featconfig.get("SIG2FV_LPC", "LPC_ORDER")
-    preemph_coef = featconfig.get("SIG2FV_LPC", "PREEMPH_COEF")
-    window_factor = featconfig.get("SIG2FV_LPC", "WINDOW_FACTOR")
-    window_type = featconfig.get("SIG2FV_LPC", "WINDOW_TYPE")
+    run_command(cmdstring)
+########## LPCs
 
-    lpc_dir = os.path.join(os.getcwd(), LPC_DIR)
+########## F0s
+def f0_parms(praatscript):
     pm_dir = os.path.join(os.getcwd(), PM_DIR)
-    os.mkdir(lpc_dir)
+    f0_dir = os.path.join(os.getcwd(), F0_DIR)
+    return (praatscript, pm_dir, f0_dir)
 
-    print("MAKING LPCS...")
-    map(extract_lpcs,
-        [(wavfilename, lpc_order, preemph_coef, window_factor, window_type, lpc_dir, pm_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
+def make_f0_praatscript(featconfig):
+    """ Returns (fd, filename) of a temporary Praat script, to be
+        removed by the caller once done...
+    """
+    psc_writer = F0_PSCWriter()
+    psc_writer.min_pitch = int(featconfig.get("PITCH", "MIN"))
+    psc_writer.max_pitch = int(featconfig.get("PITCH", "MAX"))
+    psc_writer.default_pitch = int(featconfig.get("PITCH", "DEFAULT"))
 
-########## LPCs
+    fd, praatscript = mkstemp()
+    psc_writer.create_praat_script(praatscript)
+    return fd, praatscript
 
-########## F0s
 def extract_f0s(args):
     wavfilename, praatscript, pm_dir, f0_dir = args
 
@@ -253,34 +296,20 @@ def extract_f0s(args):
     f0file_writer.load_pitchmarks(pmfile)
     f0file_writer.get_praat_f0(praatscript, wavfilename)
     f0file_writer.make_festival_f0(f0file)
-
-def make_f0s(featconfig, wav_dir):
-    """ Make f0s for incorporation in join costs..
-    """
-
-    f0_dir = os.path.join(os.getcwd(), F0_DIR)
-    os.mkdir(f0_dir)
-    pm_dir = os.path.join(os.getcwd(), PM_DIR)
-
-    psc_writer = F0_PSCWriter()
-    psc_writer.min_pitch = int(featconfig.get("PITCH", "MIN"))
-    psc_writer.max_pitch = int(featconfig.get("PITCH", "MAX"))
-    psc_writer.default_pitch = int(featconfig.get("PITCH", "DEFAULT"))
-
-    #make the Praat script...
-    fd, praatscript = mkstemp()
-    psc_writer.create_praat_script(praatscript)
-
-    print("MAKING F0s...")
-    map(extract_f0s,
-        [(wavfilename, praatscript, pm_dir, f0_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
-
-    os.close(fd)
-    os.remove(praatscript)
 ########## F0s
 
 ########## MCEPs
+def mcep_parms(featconfig):
+    fbank_order = featconfig.get("SIG2FV_MCEP", "FBANK_ORDER")
+    melcep_order = featconfig.get("SIG2FV_MCEP", "MELCEP_ORDER")
+    melcep_coefs = featconfig.get("SIG2FV_MCEP", "MELCEP_COEFS")
+    preemph_coef = featconfig.get("SIG2FV_MCEP", "PREEMPH_COEF")
+    window_factor = featconfig.get("SIG2FV_MCEP", "WINDOW_FACTOR")
+    window_type = featconfig.get("SIG2FV_MCEP", "WINDOW_TYPE")
+    mcep_dir = os.path.join(os.getcwd(), MCEP_DIR)
+    pm_dir = os.path.join(os.getcwd(), PM_DIR)
+    return (fbank_order, window_factor, preemph_coef, melcep_order, window_type, melcep_coefs, mcep_dir, pm_dir)
+
 def extract_mceps(args):
     wavfilename, fbank_order, window_factor, preemph_coef, melcep_order, window_type, melcep_coefs, mcep_dir, pm_dir = args
 
@@ -305,172 +334,293 @@ def extract_mceps(args):
                           os.path.join(mcep_dir, ".".join([basename, MCEP_EXT])),
                           "-pm",
                           os.path.join(pm_dir, ".".join([basename, PM_EXT]))])
-    print(cmdstring)
-    os.system(cmdstring)
-
+    run_command(cmdstring)
+########## MCEPs
 
-def make_joincoefs(featconfig, wav_dir):
-    """ Make joincoefs...
+########## JOINCOEFS
+def load_values(filename):
+    track = Track()
+    track.load_track(filename)
+    return track.values
+
+def add_rows(total, values):
+    """ Add the rows of 'values' to 'total' (None to start) one at a
+        time. This is the order in which numpy sums (more than one)
+        columns over axis 0, so streaming the corpus file by file
+        gives the same result (bit for bit) as summing the
+        concatenated corpus...
     """
-    
-    mcep_dir = os.path.join(os.getcwd(), MCEP_DIR)
-    os.mkdir(mcep_dir)
-    join_dir = os.path.join(os.getcwd(), JOIN_DIR)
-    os.mkdir(join_dir)
-    pm_dir = os.path.join(os.getcwd(), PM_DIR)
-    f0_dir = os.path.join(os.getcwd(), F0_DIR)
-
-    fbank_order = featconfig.get("SIG2FV_MCEP", "FBANK_ORDER")
-    melcep_order = featconfig.get("SIG2FV_MCEP", "MELCEP_ORDER")
-    melcep_coefs = featconfig.get("SIG2FV_MCEP", "MELCEP_COEFS")
-    preemph_coef = featconfig.get("SIG2FV_MCEP", "PREEMPH_COEF")
-    window_factor = featconfig.get("SIG2FV_MCEP", "WINDOW_FACTOR")
-    window_type = featconfig.get("SIG2FV_MCEP", "WINDOW_TYPE")
-    
-    print("MAKING JOINCOEFS...")
-    map(extract_mceps,
-        [(wavfilename, fbank_order, window_factor, preemph_coef, melcep_order, window_type, melcep_coefs, mcep_dir, pm_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
-
-    print("NORMALISING AND JOINING F0 AND MCEPS...")
-    #Normalising mceps and f0s:
+    if total is None:
+        return np.add.reduce(values, 0) if len(values) else None
+    return np.add.reduce(np.vstack((total[np.newaxis], values)), 0)
+
+def mcep_stats(basenames):
+    """ Corpus mean and standard deviation of mceps as
+        np.concatenate(...).mean(0)/.std(0) over the files sorted by
+        name, computed in two passes without loading the corpus into
+        memory...
+    """
+    filenames = sorted(".".join([basename, MCEP_EXT]) for basename in basenames)
+    locations = [os.path.join(os.getcwd(), MCEP_DIR, filename) for filename in filenames]
+    n = 0
+    total = None
+    for location in locations:
+        values = load_values(location)
+        n += len(values)
+        total = add_rows(total, values)
+    mean = total / n
+    sqdevs = None
+    for location in locations:
+        deviations = load_values(location) - mean
+        sqdevs = add_rows(sqdevs, deviations * deviations)
+    return mean, np.sqrt(sqdevs / n)
+
+def f0_stats(basenames):
+    """ Corpus mean and standard deviation of f0 in voiced frames,
+        computed as before (there is one value per frame, so keeping
+        these in memory is cheap)...
+    """
+    filenames = sorted(".".join([basename, F0_EXT]) for basename in basenames)
+    allf0vecs = []
+    for filename in filenames:
+        values = load_values(os.path.join(os.getcwd(), F0_DIR, filename))
+        allf0vecs.append(values[values.nonzero()])
+    allf0vecs = np.concatenate(allf0vecs)
+    return allf0vecs.mean(0), allf0vecs.std(0)
+
+def normalise_joinfile(args):
+    basename, mcepmean, mcepstd, f0mean, f0std = args
     upper = +1.0
     lower = -1.0
 
-    mceptracks = {}
-    for fn in glob(os.path.join(mcep_dir, ".".join(["*", MCEP_EXT]))):
-        t = Track()
-        t.load_track(fn)
-        mceptracks[os.path.basename(fn)] = t
-
-    allmcepvecs = np.concatenate([mceptracks[tn].values for tn in sorted(mceptracks)])
-    mcepmean = allmcepvecs.mean(0)
-    mcepstd = allmcepvecs.std(0)
-    for k in mceptracks:
-        mceptracks[k].values = (mceptracks[k].values - mcepmean) / (4 * mcepstd) * (upper - lower)
-
-    f0tracks = {}
-    for fn in glob(os.path.join(f0_dir, ".".join(["*", F0_EXT]))):
-        t = Track()
-        t.load_track(fn)
-        f0tracks[os.path.basename(fn)] = t
-
-    #allf0vecs = np.concatenate([f0tracks[tn].values for tn in sorted(f0tracks)])
-    allf0vecs = np.concatenate([f0tracks[tn].values[f0tracks[tn].values.nonzero()] for tn in sorted(f0tracks)])
-    f0mean = allf0vecs.mean(0)
-    f0std = allf0vecs.std(0)
-    for k in f0tracks:
-        f0tracks[k].values = (f0tracks[k].values - f0mean) / (4 * f0std) * (upper - lower)
+    mceptrack = Track()
+    mceptrack.load_track(os.path.join(os.getcwd(), MCEP_DIR, ".".join([basename, MCEP_EXT])))
+    f0track = Track()
+    f0track.load_track(os.path.join(os.getcwd(), F0_DIR, ".".join([basename, F0_EXT])))
 
+    mcepvalues = (mceptrack.values - mcepmean) / (4 * mcepstd) * (upper - lower)
+    f0values = (f0track.values - f0mean) / (4 * f0std) * (upper - lower)
     #Add f0 to mcep track:
-    for k1, k2 in zip(sorted(mceptracks), sorted(f0tracks)):
-        mceptracks[k1].values = np.concatenate((mceptracks[k1].values, f0tracks[k2].values), 1)
-
-    for fn in mceptracks:
-        basename = os.path.splitext(os.path.basename(fn))[0]
-        ttslab.tofile(mceptracks[fn], os.path.join(join_dir, basename + "." + JOIN_EXT))
-########## MCEPs
-
-
-def save_complete_utts(utts):
-    """ Save Utterances to file...
+    mceptrack.values = np.concatenate((mcepvalues, f0values), 1)
+    ttslab.tofile(mceptrack, os.path.join(os.getcwd(), JOIN_DIR, ".".join([basename, JOIN_EXT])))
+    return basename
+
+def normalise_joincoefs(manifest, pool):
+    """ Normalise mceps and f0s over the whole corpus and join them to
+        form joincoefs. The corpus statistics depend on all mcep and
+        f0 files, so joincoefs are only rewritten (all of them) if any
+        of these changed. Statistics are computed streaming the files
+        and memory use is bounded by the largest single utterance
+        (and the corpus f0 values)...
+    """
+    print("NORMALISING AND JOINING F0 AND MCEPS...")
+    basenames = sorted(manifest.entries)
+    corpuskey = make_key(STATS_VERSION, *[make_key(bn, manifest.entries[bn]["keys"]["mcep"], manifest.entries[bn]["keys"]["f0"])
+                                          for bn in basenames])
+
+    todo = []
+    for basename in basenames:
+        entry = manifest.entries[basename]
+        joinkey = make_key(entry["keys"]["mcep"], entry["keys"]["f0"], corpuskey)
+        joinfile = os.path.join(os.getcwd(), JOIN_DIR, ".".join([basename, JOIN_EXT]))
+        if not entry_is_current(entry, "join", joinkey, [joinfile]):
+            todo.append((basename, joinkey))
+    print("%s of %s joincoef files out of date..." % (len(todo), len(basenames)))
+    if not todo:
+        return
+
+    mcepmean, mcepstd = mcep_stats(basenames)
+    f0mean, f0std = f0_stats(basenames)
+    results = pool.map(normalise_joinfile,
+                       [(basename, mcepmean, mcepstd, f0mean, f0std) for basename, joinkey in todo],
+                       names=[basename for basename, joinkey in todo], desc="JOINCOEFS")
+    for (basename, joinkey), result in zip(todo, results):
+        if result is not None:
+            manifest.entries[basename]["keys"]["join"] = joinkey
+    manifest.save()
+########## JOINCOEFS
+
+########## ALL FEATURES
+def feature_filenames(basename):
+    """ Per-file artefacts of each stage...
     """
-    complete_utt_dir = os.path.join(os.getcwd(), COMPLETE_UTT_DIR)
+    return {"pm": [os.path.join(os.getcwd(), PM_DIR, ".".join([basename, PM_EXT]))],
+            "lpc": [os.path.join(os.getcwd(), LPC_DIR, ".".join([basename, LPC_EXT])),
+                    os.path.join(os.getcwd(), LPC_DIR, ".".join([basename, RES_EXT]))],
+            "f0": [os.path.join(os.getcwd(), F0_DIR, ".".join([basename, F0_EXT]))],
+            "mcep": [os.path.join(os.getcwd(), MCEP_DIR, ".".join([basename, MCEP_EXT]))]}
+
+def extract_features(args):
+    """ Runs the per-file stages (pitchmarks -> LPCs -> F0 -> MCEPs) for
+        a single wavefile, so that different files can be processed
+        in parallel. Stages are skipped if the artefacts in the
+        previous manifest entry are still current, returns the new
+        manifest entry...
+    """
+    wavfilename, confkeys, pmparms, lpcparms, f0parms, mcepparms, oldentry = args
 
-    try:
-        print("SAVING COMPLETE UTTS...")
-        try:
-            os.makedirs(complete_utt_dir)
-        except OSError:
-            pass
-        for utt in utts:
-            print(utt["file_id"])
-            ttslab.tofile(utt, os.path.join(complete_utt_dir, ".".join([utt["file_id"], UTT_EXT])))
-    except RuntimeError:
-        #check what kind of monster utt caused the recursion limit to be exceeded...
-        #UTTERANCE CHUNKING IS IMPORTANT...
-        print(utt)
+    basename = os.path.splitext(os.path.basename(wavfilename))[0]
+    filenames = feature_filenames(basename)
+
+    wavhash = file_hash(wavfilename)
+    pmkey = make_key(wavhash, confkeys["pm"])
+    stages = [("pm", extract_pitchmarks, pmparms, pmkey),
+              ("lpc", extract_lpcs, lpcparms, make_key(pmkey, confkeys["lpc"])),
+              ("f0", extract_f0s, f0parms, make_key(pmkey, confkeys["f0"])),
+              ("mcep", extract_mceps, mcepparms, make_key(pmkey, confkeys["mcep"]))]
+
+    entry = {"wavhash": wavhash, "keys": {}}
+    for stage, func, parms, key in stages:
+        if entry_is_current(oldentry, stage, key, filenames[stage]):
+            print("%s: %s up to date" % (basename, stage))
+        else:
+            func((wavfilename,) + parms)
+        entry["keys"][stage] = key
 
+    #validity is checked against a new key during normalisation:
+    if oldentry is not None and "join" in oldentry.get("keys", {}):
+        entry["keys"]["join"] = oldentry["keys"]["join"]
+    return entry
+########## ALL FEATURES
 
-def make_unit_catalogue(utts):
-    
+
+def utt_units(utt):
+    """ Returns (name, features) of all units in the Utterance...
+    """
+    units = []
+    unit_item = utt.get_relation("Unit").head_item
+    while unit_item is not None:
+        if "lpc-coefs" in unit_item.content.features:     #only save unit if lpc-coefs successfully extracted...
+            units.append((unit_item["name"], unit_item.content.features))
+        unit_item = unit_item.next_item
+    return units
+
+
+def make_unit_catalogue(shardfilenames):
+    """ Merge the per-utterance unit shards into the catalogue, one
+        shard at a time...
+    """
     print("MAKING UNITCATALOGUE...")
 
     unitcatalogue = defaultdict(list)
+    if SAVE_MAPPED_CATALOGUE:
+        writer = CatalogueWriter(CATALOGUE_NAME)
 
-    for utt in utts:
-        print(utt["file_id"])
-        unit_item = utt.get_relation("Unit").head_item
-        while unit_item is not None:
-            if "lpc-coefs" in unit_item.content.features:     #only save unit if lpc-coefs successfully extracted...
-                unitcatalogue[unit_item["name"]].append(unit_item.content.features)
+    for shardfilename in shardfilenames:
+        print(shardfilename)
+        for name, features in ttslab.fromfile(shardfilename):
+            if SAVE_PICKLED_CATALOGUE:
+                unitcatalogue[name].append(features)
+            if SAVE_MAPPED_CATALOGUE:
+                writer.add(name, features)
 
-            unit_item = unit_item.next_item
-        
-    return dict(unitcatalogue)
+    if SAVE_MAPPED_CATALOGUE:
+        print("SAVING MEMORY-MAPPED UNITCATALOGUE...")
+        writer.close()
+    if SAVE_PICKLED_CATALOGUE:
+        print("SAVING UNITCATALOGUE...")
+        ttslab.tofile(dict(unitcatalogue), ".".join([CATALOGUE_NAME, "pickle"]))
 
 
 
 ########################################
 ## MAIN PROCEDURES
 
-def make_features(featconfig):
+def make_features(featconfig, numworkers=None):
     """pitchmark extraction, f0 extraction, lpc and residual
        calculation as well as mcep extraction and adding of f0 to mcep
        tracks to form joincoefs.
-    """
-    try:
-        import multiprocessing
-        POOL = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        def map(f, i):
-            return POOL.map(f, i, chunksize=1)
-    except ImportError:
-        pass
-
-    wav_dir = os.path.join(os.getcwd(), WAV_DIR)
 
-    make_pitchmarks(featconfig, wav_dir)
-    
-    make_lpcs(featconfig, wav_dir)
-
-    make_f0s(featconfig, wav_dir)
-
-    make_joincoefs(featconfig, wav_dir)
-
-
-def make_catalogue(voice):
+       The per-file stages are run as a pipeline for each wavefile
+       with files processed in parallel by 'numworkers' processes
+       (defaults to the number of CPUs), the joincoefs are then
+       normalised over the whole corpus.
 
+       Builds are incremental: a manifest records the wavefile content
+       hash and configuration used for every artefact so that only
+       stale artefacts are regenerated on subsequent runs.
+    """
+    wav_dir = os.path.join(os.getcwd(), WAV_DIR)
+    wavfilenames = list_wavs(wav_dir)
+    basenames = [os.path.splitext(os.path.basename(wavfilename))[0] for wavfilename in wavfilenames]
+
+    for dirname in [PM_DIR, LPC_DIR, F0_DIR, MCEP_DIR, JOIN_DIR]:
+        make_dir(os.path.join(os.getcwd(), dirname))
+
+    manifest = BuildManifest(os.path.join(os.getcwd(), MANIFEST_FILE))
+    confkeys = {"pm": make_key(config_key(featconfig, "PITCH"), pitchmark_backend(featconfig)),
+                "lpc": config_key(featconfig, "SIG2FV_LPC"),
+                "f0": config_key(featconfig, "PITCH"),
+                "mcep": config_key(featconfig, "SIG2FV_MCEP")}
+
+    fd, praatscript = make_f0_praatscript(featconfig)
+    pmparms = pitchmark_parms(featconfig)
+    lpcparms = lpc_parms(featconfig)
+    f0parms = f0_parms(praatscript)
+    mcepparms = mcep_parms(featconfig)
+
+    print("MAKING FEATURES (PITCHMARKS, LPCS, F0s, MCEPS)...")
+    with WorkerPool(numworkers) as pool:
+        try:
+            entries = pool.map(extract_features,
+                               [(wavfilename, confkeys, pmparms, lpcparms, f0parms, mcepparms,
+                                 manifest.entries.get(basename))
+                                for wavfilename, basename in zip(wavfilenames, basenames)],
+                               names=basenames, desc="FEATURES")
+        finally:
+            os.close(fd)
+            os.remove(praatscript)
+        #failed and removed files are dropped from the manifest:
+        manifest.entries = dict((basename, entry) for basename, entry in zip(basenames, entries)
+                                if entry is not None)
+        manifest.save()
+        if len(manifest.entries) != len(basenames):
+            print("WARNING: %s files failed and will be excluded from the catalogue..." % (len(basenames) - len(manifest.entries)))
+
+        normalise_joincoefs(manifest, pool)
+
+
+def make_catalogue(voice, numworkers=None):
+    """ Make units and add features to them in parallel (one
+        Utterance per task) and merge the results into the
+        catalogue...
+    """
     utt_dir = os.path.join(os.getcwd(), UTT_DIR)
+    uttfilenames = sorted(glob(os.path.join(utt_dir, ".".join(["*", UTT_EXT]))))
 
-    utts = make_units(voice, utt_dir)
-
-    ##
-    defaultrecursionlimit = sys.getrecursionlimit()
-    sys.setrecursionlimit(BIGGER_RECURSION_LIMIT)
-    
-    utts = add_feats_to_units(utts)
-
+    lpc_dir = os.path.join(os.getcwd(), LPC_DIR)
+    joincoef_dir = os.path.join(os.getcwd(), JOIN_DIR)
+    f0_dir = os.path.join(os.getcwd(), F0_DIR)
+    shard_dir = os.path.join(os.getcwd(), SHARD_DIR)
+    make_dir(shard_dir)
     if SAVE_COMPLETE_UTTS:
-        save_complete_utts(utts)
+        complete_utt_dir = os.path.join(os.getcwd(), COMPLETE_UTT_DIR)
+        make_dir(complete_utt_dir)
+    else:
+        complete_utt_dir = None
 
-    sys.setrecursionlimit(defaultrecursionlimit)
-    ##
-  
-    unitcatalogue = make_unit_catalogue(utts)
+    print("MAKING UNITS AND ADDING FEATS...")
+    with WorkerPool(numworkers, initializer=init_catalogue_worker, initargs=(voice,)) as pool:
+        shardfilenames = pool.map(add_feats_to_units,
+                                  [(uttfilename, lpc_dir, joincoef_dir, f0_dir, shard_dir, complete_utt_dir)
+                                   for uttfilename in uttfilenames],
+                                  names=[os.path.basename(uttfilename) for uttfilename in uttfilenames],
+                                  desc="UNITS")
+    if pool.failures:
+        print("WARNING: %s utterances failed and will be excluded from the catalogue..." % len(pool.failures))
 
-    print("SAVING UNITCATALOGUE...")
-    ttslab.tofile(unitcatalogue, "word_catalogue.pickle")
+    make_unit_catalogue([shardfilename for shardfilename in shardfilenames if shardfilename is not None])
 
 
-def auto(featconfig, voice):
+def auto(featconfig, voice, numworkers=None):
     """ Automatic construction with no interaction...
     """
 
     #make features...
-    make_features(featconfig)
+    make_features(featconfig, numworkers)
     
     #create catalogue...
-    make_catalogue(voice)
+    make_catalogue(voice, numworkers)
 
 class CLIException(Exception):
     pass
@@ -482,8 +632,12 @@ def main():
         featconfpath = sys.argv[2]
         switch = sys.argv[3]
      except IndexError:
-         print("USAGE: ttslab_make_wordunits.py VOICEFILE FEATSCONF [auto | make_features | make_catalogue]")
+         print("USAGE: ttslab_make_wordunits.py VOICEFILE FEATSCONF [auto | make_features | make_catalogue] [NUMWORKERS]")
          sys.exit()
+     try:
+         numworkers = int(sys.argv[4])
+     except IndexError:
+         numworkers = None
 
      voice = ttslab.fromfile(voicefile)
      with open(featconfpath) as conffh:
@@ -491,15 +645,15 @@ def main():
          featconfig.readfp(conffh)
      try:
          if switch == "auto":
-             auto(featconfig, voice)
+             auto(featconfig, voice, numworkers)
          elif switch == "make_features":
-             make_features(featconfig)
+             make_features(featconfig, numworkers)
          elif switch == "make_catalogue":
-             make_catalogue(voice)
+             make_catalogue(voice, numworkers)
          else:
              raise CLIException
      except CLIException:
-         print("USAGE: ttslab_make_wordunits.py VOICEFILE FEATSCONF [auto | make_features | make_catalogue]")
+         print("USAGE: ttslab_make_wordunits.py VOICEFILE FEATSCONF [auto | make_features | make_catalogue] [NUMWORKERS]")
     
 
 if __name__ == "__main__":
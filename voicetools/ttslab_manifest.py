@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+""" A simple build manifest to support incremental rebuilds of
+    per-file artefacts. Each artefact is recorded under a key derived
+    from the content hash of its inputs and the configuration values
+    used to create it, so that only stale artefacts need to be
+    regenerated...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import json
+import hashlib
+
+HASH_BLOCKSIZE = 2**20
+MANIFEST_VERSION = 1
+
+
+def file_hash(filename):
+    """ SHA1 hex digest of file contents...
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as infh:
+        while True:
+            block = infh.read(HASH_BLOCKSIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def make_key(*parts):
+    """ Combine strings (hashes, values) into a single key...
+    """
+    h = hashlib.sha1()
+    h.update("\n".join(parts).encode("utf-8"))
+    return h.hexdigest()
+
+
+def config_key(config, *sections):
+    """ Key from all option values in the given ConfigParser
+        sections...
+    """
+    parts = []
+    for section in sections:
+        for option, value in sorted(config.items(section)):
+            parts.append("%s.%s=%s" % (section, option, value))
+    return make_key(*parts)
+
+
+def entry_is_current(entry, stage, key, filenames):
+    """ Whether the artefacts for 'stage' in the manifest 'entry' (may
+        be None) were made with 'key' and the files still exist...
+    """
+    if entry is None:
+        return False
+    if entry.get("keys", {}).get(stage) != key:
+        return False
+    return all(os.path.isfile(fn) for fn in filenames)
+
+
+class BuildManifest(object):
+    """ Per-file entries (name -> dict), stored as JSON...
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        if os.path.isfile(filename):
+            with open(filename) as infh:
+                d = json.load(infh)
+            if d.get("version") == MANIFEST_VERSION:
+                self.entries = d["entries"]
+
+    def save(self):
+        """ Write to temporary file first so that an interrupted build
+            does not leave a corrupt manifest...
+        """
+        tempfilename = self.filename + ".tmp"
+        with open(tempfilename, "w") as outfh:
+            json.dump({"version": MANIFEST_VERSION,
+                       "entries": self.entries}, outfh, indent=1, sort_keys=True)
+        os.rename(tempfilename, self.filename)
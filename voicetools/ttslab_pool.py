@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+""" A small worker pool layer for running per-file processing steps
+    over a corpus in parallel, with per-file failure reporting and a
+    progress/throughput summary...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import sys
+import time
+import traceback
+import multiprocessing
+
+DEF_NUMWORKERS = multiprocessing.cpu_count()
+
+
+def _run_task(args):
+    """ Runs in the worker: catches any failure so that a single bad
+        file does not bring down the whole pool...
+    """
+    index, func, task = args
+    starttime = time.time()
+    try:
+        result = func(task)
+        error = None
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    return index, result, error, time.time() - starttime
+
+
+class TaskFailure(object):
+    """ Records a failed task: its name and the formatted traceback
+        from the worker...
+    """
+    def __init__(self, name, error):
+        self.name = name
+        self.error = error
+
+    def __str__(self):
+        return "%s:\n%s" % (self.name, self.error)
+
+
+class WorkerPool(object):
+    """ Maps functions over lists of tasks using a process pool (or
+        serially if only one worker is requested)...
+    """
+
+    def __init__(self, numworkers=None, chunksize=1, verbose=True, initializer=None, initargs=()):
+        """ If given, 'initializer(*initargs)' is called once in each
+            worker before any tasks are run (e.g. to load a voice)...
+        """
+        if numworkers is None:
+            numworkers = DEF_NUMWORKERS
+        self.numworkers = max(1, int(numworkers))
+        self.chunksize = chunksize
+        self.verbose = verbose
+        self.failures = []
+        if self.numworkers > 1:
+            self._pool = multiprocessing.Pool(processes=self.numworkers,
+                                              initializer=initializer,
+                                              initargs=initargs)
+        else:
+            self._pool = None
+            if initializer is not None:
+                initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def map(self, func, tasks, names=None, desc="TASKS"):
+        """ Applies 'func' (which needs to be picklable, i.e. defined at
+            module level) to every task. Returns results in task order
+            with None in the place of failed tasks, failures are
+            reported and appended to self.failures...
+        """
+        tasks = list(tasks)
+        if names is None:
+            names = [str(i) for i in range(len(tasks))]
+        jobs = [(i, func, task) for i, task in enumerate(tasks)]
+        if self._pool is not None:
+            jobresults = self._pool.imap_unordered(_run_task, jobs, chunksize=self.chunksize)
+        else:
+            jobresults = (_run_task(job) for job in jobs)
+
+        results = [None] * len(tasks)
+        failures = []
+        worktime = 0.0
+        starttime = time.time()
+        for done, (index, result, error, elapsed) in enumerate(jobresults, 1):
+            worktime += elapsed
+            if error is None:
+                results[index] = result
+                status = "OK"
+            else:
+                failures.append(TaskFailure(names[index], error))
+                status = "FAILED"
+            if self.verbose:
+                print("%s: [%d/%d] %s %s (%.2fs)" % (desc, done, len(tasks), names[index], status, elapsed))
+        walltime = time.time() - starttime
+
+        if self.verbose:
+            self.report(desc, len(tasks), failures, walltime, worktime)
+        self.failures.extend(failures)
+        return results
+
+    def report(self, desc, numtasks, failures, walltime, worktime):
+        """ Print the throughput summary and details of any failures...
+        """
+        print("%s: %d done, %d failed in %.2fs using %d worker(s) (%.2f files/s, %.2fs per file, speedup %.1fx)" %
+              (desc,
+               numtasks - len(failures),
+               len(failures),
+               walltime,
+               self.numworkers,
+               numtasks / walltime if walltime > 0 else 0.0,
+               worktime / numtasks if numtasks else 0.0,
+               worktime / walltime if walltime > 0 else 0.0))
+        for failure in failures:
+            print("%s: FAILED %s" % (desc, failure), file=sys.stderr)
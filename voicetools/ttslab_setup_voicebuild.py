@@ -151,6 +151,10 @@ HMM_PROTOTYPE: %s
 WORKING_DIR:
 SILENCE_PHONE:
 SILENCE_WORD:
+# Number of concurrent HTK processes (0 -> one per CPU)...
+NUM_WORKERS: 0
+# Reuse features from this dir (made if necessary, empty -> no cache)...
+FEATS_CACHE:
 
 
 [SWITCHES]
@@ -191,6 +195,9 @@ def write_acoustic_feat_conf(etc_dir):
 MIN: 75
 MAX: 600
 DEFAULT: 100
+#Pitchmark extraction: 'praat' or 'native' (in-process, check against
+#'praat' with testscripts/bench_pitchmarks.py before use)..
+PM_BACKEND: praat
 
 [SIG2FV_MCEP]
 FBANK_ORDER: 24
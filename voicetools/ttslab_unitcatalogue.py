@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+""" Compact, memory-mapped unit catalogue format.
+
+    Instead of pickling a dict of unit name -> list of feature dicts
+    (holding Track objects and arrays per unit), the LPC frames,
+    residual samples and join coefficients of all units are packed
+    into contiguous raw arrays with an offset index. The arrays are
+    opened with np.memmap, so loading is near-instant and processes
+    using the same catalogue share pages through the OS page cache.
+
+    Layout of a catalogue directory:
+
+      index.pickle    - array dtypes/shapes, unit names -> unit numbers,
+                        LPC track start times and the remaining
+                        (small) features per unit
+      offsets.bin     - per unit: LPC frame range and residual sample range
+      lpc_times.bin   - LPC frame times (all units)
+      lpc_values.bin  - LPC frames (all units)
+      residuals.bin   - residual samples (all units)
+      joincoefs.bin   - per unit: left and right join coefficients
+      catalogue.pickle - (optional) pickled MappedUnitCatalogue, see
+                        catalogue_handle()
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import cPickle as pickle
+
+import numpy as np
+
+from ttslab.trackfile import Track
+
+CATALOGUE_VERSION = 2
+SUPPORTED_VERSIONS = [1, 2]   #version 1 has no LPC track start times
+INDEX_FILE = "index.pickle"
+HANDLE_FILE = "catalogue.pickle"
+ARRAY_EXT = "bin"
+OFFSETS = "offsets"
+LPC_TIMES = "lpc_times"
+LPC_VALUES = "lpc_values"
+RESIDUALS = "residuals"
+JOINCOEFS = "joincoefs"
+ARRAY_NAMES = [OFFSETS, LPC_TIMES, LPC_VALUES, RESIDUALS, JOINCOEFS]
+
+#features packed into arrays (everything else is kept in the index):
+PACKED_FEATS = ["lpc-coefs", "residuals", "left-joincoef", "right-joincoef"]
+
+
+class CatalogueWriter(object):
+    """ Appends units one at a time to the raw array files, so the
+        complete catalogue never needs to be in memory...
+    """
+
+    def __init__(self, dirname):
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.dirname = dirname
+        self.arrayspecs = {}
+        self.lengths = dict((arrayname, 0) for arrayname in ARRAY_NAMES)
+        self.fhs = dict((arrayname, open(os.path.join(dirname, ".".join([arrayname, ARRAY_EXT])), "wb"))
+                        for arrayname in ARRAY_NAMES)
+        self.unitnames = {}
+        self.unitfeats = []
+        self.lpcstarttimes = []
+
+    def _append(self, arrayname, values):
+        """ Array dtype and trailing dimensions are fixed by the first
+            unit added...
+        """
+        values = np.ascontiguousarray(values)
+        spec = (values.dtype.str, values.shape[1:])
+        if arrayname not in self.arrayspecs:
+            self.arrayspecs[arrayname] = spec
+        elif self.arrayspecs[arrayname] != spec:
+            raise Exception("Inconsistent '%s' array: %s (expected %s)" % (arrayname, spec, self.arrayspecs[arrayname]))
+        start = self.lengths[arrayname]
+        self.fhs[arrayname].write(values.tostring())
+        self.lengths[arrayname] += len(values)
+        return start, self.lengths[arrayname]
+
+    def add(self, name, features):
+        """ Add unit 'name' with 'features' as populated by
+            add_feats_to_utt()...
+        """
+        lpcstart, lpcend = self._append(LPC_VALUES, features["lpc-coefs"].values)
+        self._append(LPC_TIMES, features["lpc-coefs"].times)
+        resstart, resend = self._append(RESIDUALS, features["residuals"])
+        self._append(JOINCOEFS, np.array([features["left-joincoef"], features["right-joincoef"]])[np.newaxis])
+        unitnum, unitnum_end = self._append(OFFSETS, np.array([[lpcstart, lpcend, resstart, resend]], dtype=np.int64))
+        self.unitnames.setdefault(name, []).append(unitnum)
+        self.lpcstarttimes.append(getattr(features["lpc-coefs"], "starttime", None))
+        self.unitfeats.append(dict((k, v) for k, v in features.iteritems() if k not in PACKED_FEATS))
+
+    def close(self):
+        for fh in self.fhs.itervalues():
+            fh.close()
+        index = {"version": CATALOGUE_VERSION,
+                 "arrays": dict((arrayname, (self.arrayspecs[arrayname][0],
+                                             (self.lengths[arrayname],) + self.arrayspecs[arrayname][1]))
+                                for arrayname in self.arrayspecs),
+                 "unitnames": self.unitnames,
+                 "unitfeats": self.unitfeats,
+                 "lpcstarttimes": self.lpcstarttimes}
+        with open(os.path.join(self.dirname, INDEX_FILE), "wb") as outfh:
+            pickle.dump(index, outfh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def write_catalogue(unitcatalogue, dirname):
+    """ Write a dict catalogue (as returned by make_unit_catalogue())
+        in the memory-mapped format...
+    """
+    with CatalogueWriter(dirname) as writer:
+        for name in sorted(unitcatalogue):
+            for features in unitcatalogue[name]:
+                writer.add(name, features)
+
+
+def catalogue_handle(dirname):
+    """ Write a pickled MappedUnitCatalogue of 'dirname' to a file in
+        the directory and return its location. The file can be used
+        wherever a pickled dict catalogue is loaded (e.g.
+        Synthesizer(unitcataloguefile=...)), only the location of the
+        catalogue is stored: anything pickled with it (e.g. a voice)
+        is only usable where the catalogue directory can be found (see
+        MappedUnitCatalogue.__setstate__)...
+    """
+    location = os.path.join(dirname, HANDLE_FILE)
+    with open(location, "wb") as outfh:
+        pickle.dump(MappedUnitCatalogue(dirname), outfh, protocol=pickle.HIGHEST_PROTOCOL)
+    return location
+
+
+class MappedUnitCatalogue(object):
+    """ Read-only, dict-like view (unit name -> list of feature dicts)
+        of a catalogue directory. Returned Tracks and arrays are views
+        of the memory-mapped arrays (no copies are made)...
+    """
+
+    def __init__(self, dirname):
+        self.dirname = os.path.abspath(dirname)
+        self.relname = dirname
+        self._open()
+
+    def _open(self):
+        with open(os.path.join(self.dirname, INDEX_FILE), "rb") as infh:
+            index = pickle.load(infh)
+        if index["version"] not in SUPPORTED_VERSIONS:
+            raise Exception("Unsupported catalogue version: %s" % index["version"])
+        self.unitnames = index["unitnames"]
+        self.unitfeats = index["unitfeats"]
+        self.lpcstarttimes = index.get("lpcstarttimes")
+        self.arrays = {}
+        for arrayname, (dtype, shape) in index["arrays"].iteritems():
+            if shape[0] == 0:
+                self.arrays[arrayname] = np.zeros(shape, dtype=dtype)
+            else:
+                self.arrays[arrayname] = np.memmap(os.path.join(self.dirname, ".".join([arrayname, ARRAY_EXT])),
+                                                   dtype=dtype, mode="r", shape=shape)
+
+    def __getstate__(self):
+        """ Only the location is pickled (absolute, so that e.g. a voice
+            containing the catalogue can be loaded from any working
+            directory), the arrays are mapped again when unpickled...
+        """
+        return {"dirname": self.dirname, "relname": self.relname}
+
+    def __setstate__(self, state):
+        """ If the catalogue has moved since it was pickled, it is
+            looked for at the location as originally given (relative to
+            the working directory)...
+        """
+        self.dirname = state["dirname"]
+        self.relname = state.get("relname", state["dirname"])
+        if not os.path.isfile(os.path.join(self.dirname, INDEX_FILE)):
+            self.dirname = os.path.abspath(self.relname)
+        self._open()
+
+    def unit(self, unitnum):
+        """ Feature dict for unit number 'unitnum'...
+        """
+        lpcstart, lpcend, resstart, resend = self.arrays[OFFSETS][unitnum]
+        features = dict(self.unitfeats[unitnum])
+        lpctrack = Track()
+        lpctrack.times = self.arrays[LPC_TIMES][lpcstart:lpcend]
+        lpctrack.values = self.arrays[LPC_VALUES][lpcstart:lpcend]
+        if self.lpcstarttimes is not None and self.lpcstarttimes[unitnum] is not None:
+            lpctrack.starttime = self.lpcstarttimes[unitnum]
+        features["lpc-coefs"] = lpctrack
+        features["residuals"] = self.arrays[RESIDUALS][resstart:resend]
+        features["left-joincoef"] = self.arrays[JOINCOEFS][unitnum][0]
+        features["right-joincoef"] = self.arrays[JOINCOEFS][unitnum][1]
+        return features
+
+    def __getitem__(self, name):
+        return [self.unit(unitnum) for unitnum in self.unitnames[name]]
+
+    def __contains__(self, name):
+        return name in self.unitnames
+
+    def __iter__(self):
+        return iter(self.unitnames)
+
+    def __len__(self):
+        return len(self.unitnames)
+
+    def keys(self):
+        return self.unitnames.keys()
+
+    def get(self, name, default=None):
+        if name in self.unitnames:
+            return self[name]
+        return default
+
+    def iteritems(self):
+        for name in self.unitnames:
+            yield name, self[name]
+
+    def items(self):
+        return list(self.iteritems())
@@ -18,6 +18,7 @@ import ttslab
 from ttslab.trackfile import Track
 ttslab.extend(Track, "tfuncs_analysis")
 import speechlabels as sl
+from wav2psmfcc import melcep
 
 NONE_WORD = "NONE"
 WAV_EXT = "wav"
@@ -26,6 +27,20 @@ TEXTGRID_EXT = "TextGrid"
 
 SIG2FV = "sig2fv -coefs melcep -delta melcep -melcep_order 12 -fbank_order 24 -shift %(shift)s -factor 5.0 -preemph 0.97 -otype est %(inputfile)s -o %(outputfile)s"
 
+#mel cepstrum analysis: "sig2fv" (default, thresholds such as those
+#in ttslab_qc_corpus.py are based on it) or "native" (in memory,
+#similar but not numerically identical):
+MCEP_BACKENDS = ["sig2fv", "native"]
+DEF_MCEP_BACKEND = "sig2fv"
+
+#as in "sig2fv -coefs melcep -delta melcep -melcep_order 12
+#-fbank_order 24 -factor 5.0 -preemph 0.97" (computed in memory):
+MELCEP_PARMS = {"melcep_order": 12,
+                "fbank_order": 24,
+                "factor": 5.0,
+                "preemph": 0.97,
+                "deltas": True}
+
 
 def fill_startendtimes(utt):
     """ Use 'end' time feature in segments to fill info for other
@@ -74,65 +89,48 @@ def apply_items_relationwide(utt, func, featname, relation="Segment"):
         item[featname] = func(item)
 
 
-def utt_distance(utt, utt2, method="dtw", metric="euclidean", sig2fv=SIG2FV, shift=0.005, VI=None):
+def waveform_mceps(waveform, shift=0.005, backend=DEF_MCEP_BACKEND, sig2fv=SIG2FV, melcep_parms=MELCEP_PARMS):
+    """ Mel cepstrum Track of the waveform, computed by 'sig2fv' (via
+        temporary files) or natively from the samples in memory using
+        'melcep_parms'...
+    """
+    if backend not in MCEP_BACKENDS:
+        raise Exception("Unknown mel cepstrum backend '%s'..." % backend)
+    t = Track()
+    if backend == "native":
+        t.times, t.values = melcep(waveform.samples, waveform.samplerate, shift=shift, **melcep_parms)
+        return t
+    temppath = mkdtemp()
+    try:
+        wfn = os.path.join(temppath, "1." + WAV_EXT)
+        ffn = os.path.join(temppath, "1." + FEAT_EXT)
+        waveform.write(wfn)
+        cmds = sig2fv % {"inputfile": wfn,
+                         "outputfile": ffn,
+                         "shift": shift}
+        #print(cmds)
+        os.system(cmds)
+        t.load_track(ffn)
+    finally:
+        shutil.rmtree(temppath)
+    return t
+
+
+def utt_distance(utt, utt2, method="dtw", metric="euclidean", sig2fv=SIG2FV, shift=0.005, VI=None,
+                 backend=DEF_MCEP_BACKEND, melcep_parms=MELCEP_PARMS):
     """ Uses Trackfile class' distance measurements to compare utts...
         See docstring in tfuncs_analysis.py for more details...
     """
-
-    temppath = mkdtemp()
-
-    #wavs
-    wfn1 = os.path.join(temppath, "1." + WAV_EXT)
-    wfn2 = os.path.join(temppath, "2." + WAV_EXT)
-    utt["waveform"].write(wfn1)
-    utt2["waveform"].write(wfn2)
-    #feats
-    ffn1 = os.path.join(temppath, "1." + FEAT_EXT)
-    ffn2 = os.path.join(temppath, "2." + FEAT_EXT)
-    cmds = SIG2FV % {"inputfile": wfn1,
-                     "outputfile": ffn1,
-                     "shift": shift}
-    #print(cmds)
-    os.system(cmds)
-    cmds = SIG2FV % {"inputfile": wfn2,
-                     "outputfile": ffn2,
-                     "shift": shift}
-    #print(cmds)
-    os.system(cmds)
-
-    #tracks
-    t1 = Track()
-    t1.load_track(ffn1)
-    t2 = Track()
-    t2.load_track(ffn2)
+    t1 = waveform_mceps(utt["waveform"], shift, backend, sig2fv, melcep_parms)
+    t2 = waveform_mceps(utt2["waveform"], shift, backend, sig2fv, melcep_parms)
 
     #compare and save
     t3 = t1.distances(t2, method=method, metric=metric, VI=VI)
 
-    shutil.rmtree(temppath)
-
     return t3
 
-def utt_mceps(utt, shift=0.005, remove_pau=False, resettimes=False):
-    temppath = mkdtemp()
-
-    #wavs
-    wfn1 = os.path.join(temppath, "1." + WAV_EXT)
-    utt["waveform"].write(wfn1)
-    #feats
-    ffn1 = os.path.join(temppath, "1." + FEAT_EXT)
-    cmds = SIG2FV % {"inputfile": wfn1,
-                     "outputfile": ffn1,
-                     "shift": shift}
-    #print(cmds)
-    os.system(cmds)
-
-    #tracks
-    t1 = Track()
-    t1.load_track(ffn1)
-
-    #cleanup
-    shutil.rmtree(temppath)
+def utt_mceps(utt, shift=0.005, remove_pau=False, resettimes=False, backend=DEF_MCEP_BACKEND):
+    t1 = waveform_mceps(utt["waveform"], shift, backend)
 
     keep_intervals = []
     if remove_pau:
@@ -8,16 +8,15 @@ __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
 import os
-import shutil
 import sys
 import networkx as nx
 import pylab as pl
 import numpy as np
-from tempfile import mkdtemp
 
 import ttslab
 from ttslab import hrg
 from ttslab.trackfile import Track
+from wav2psmfcc import pitch_contour
 ttslab.extend(hrg.Utterance, "ufuncs_analysis")
 ttslab.extend(Track, "ttslab.trackfile.funcs.tfuncs_praat")
 
@@ -76,12 +75,9 @@ def draw_sylstruct_graph_pitch_waveform(u):
     uttendtime = u.get_relation("Segment").tail_item["end"]
     bounds = np.array([word["end"] for word in u.get_relation("Word")])
     
-    #get the pitch:
-    d = mkdtemp()
-    u["waveform"].write(os.path.join(d, "utt.wav"))
+    #get the pitch (from the samples in memory):
     f0t = Track()
-    f0t.get_f0(os.path.join(d, "utt.wav"))
-    shutil.rmtree(d)
+    f0t.times, f0t.values = pitch_contour(u["waveform"].samples, u["waveform"].samplerate)
 
     fig = pl.figure()#edgecolor=(0.921568627451, 0.921568627451, 0.921568627451))
     ax = fig.add_subplot(311)
@@ -8,7 +8,6 @@ __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
 import os
-import shutil
 import sys
 import unicodedata
 
@@ -17,7 +16,6 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt, mpld3
 import numpy as np
-from tempfile import mkdtemp
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -27,6 +25,7 @@ import scipy.signal as ss
 import ttslab
 from ttslab import hrg
 from ttslab.trackfile import Track
+from wav2psmfcc import pitch_contour
 ttslab.extend(hrg.Utterance, "ufuncs_analysis")
 ttslab.extend(Track, "ttslab.trackfile.funcs.tfuncs_praat")
 
@@ -91,12 +90,9 @@ def draw_sylstruct_graph_pitch_waveform(u):
     uttendtime = u.get_relation("Segment").tail_item["end"]
     bounds = np.array([word["end"] for word in u.get_relation("Word")])
     
-    #get the pitch:
-    d = mkdtemp()
-    u["waveform"].write(os.path.join(d, "utt.wav"))
+    #get the pitch (from the samples in memory):
     f0t = Track()
-    f0t.get_f0(os.path.join(d, "utt.wav"), semitones=True)
-    shutil.rmtree(d)
+    f0t.times, f0t.values = pitch_contour(u["waveform"].samples, u["waveform"].samplerate, semitones=True)
 
     fig1 = plt.figure()#edgecolor=(0.921568627451, 0.921568627451, 0.921568627451))
     ax = fig1.add_subplot(111)
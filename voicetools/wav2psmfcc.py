@@ -1,12 +1,13 @@
 #!/bin/env python
 # -*- coding: utf-8 -*-
 """
-    Uses "praat" and "sig2fv" to  extract features pitch synchronously
-    saving the results in HTK format file...
+    Uses "praat" (or a native NumPy implementation) and "sig2fv" to
+    extract features pitch synchronously saving the results in HTK
+    format file...
 
-    Note: You need to have the command-line-only version of Praat
-    installed... i.e. to run scripts the binary is called:
-    `praat --run <SCRIPT>`
+    Note: To use the "praat" pitchmark backend you need to have the
+    command-line-only version of Praat installed... i.e. to run
+    scripts the binary is called: `praat --run <SCRIPT>`
 """
 from __future__ import unicode_literals, division, print_function #Py2
 
@@ -17,11 +18,26 @@ import os
 import sys
 import math
 
+import io
 import subprocess
 import struct
 from tempfile import NamedTemporaryFile
 
+import numpy as np
+from scipy.io import wavfile
+
+from ttslab_esttrack import read_track, write_track
+
+PM_BACKENDS = ["native", "praat"]
+PITCH_MIN = 75.0    #Praat's "To Pitch..." defaults
+PITCH_MAX = 600.0
+F0_LAG_OVERSAMPLING = 4     #autocorrelation lags per sample in estimate_f0
+F0_CHUNKSIZE = 256          #frames per FFT in estimate_f0 (bounds memory)
+DEF_PM_BACKEND = "praat"
 PRAAT_BIN = "praat"
+HTK_HEADER_FORMAT = ">IIHH"
+HTK_HEADER_SIZE = struct.calcsize(HTK_HEADER_FORMAT)
+HTK_DTYPE = ">f4"
 SIG2FV_BIN = "/home/demitasse/LOCAL/bin/sig2fv"
 PRAAT_GET_PM = \
 """#
@@ -43,6 +59,197 @@ endfor
 """
 
 
+def read_wave(wavfilelocation):
+    """ Returns (samples, samplerate) with samples as a float array
+        (first channel only)...
+    """
+    samplerate, samples = wavfile.read(wavfilelocation)
+    if samples.ndim > 1:
+        samples = samples[:, 0]
+    return samples.astype(np.float64), samplerate
+
+
+def estimate_f0(samples, samplerate, min_pitch, max_pitch, timestep=0.01,
+                voicing_threshold=0.45, silence_threshold=0.03, octave_cost=0.01):
+    """ Short-time normalised autocorrelation F0 estimation (after
+        Boersma, 1993). The autocorrelation is interpolated to
+        F0_LAG_OVERSAMPLING lags per sample, candidates are its local
+        maxima and the chosen one maximises height - 'octave_cost' *
+        log2(min_pitch * lag) so that longer lags (subharmonics, which
+        correlate as well for a periodic signal) lose. Returns (times,
+        f0) with f0 == 0.0 in unvoiced frames...
+    """
+    winlen = int(round(3.0 / min_pitch * samplerate))
+    hop = max(1, int(round(timestep * samplerate)))
+    minlag = max(1, int(samplerate / max_pitch))
+    maxlag = min(int(math.ceil(samplerate / min_pitch)), winlen - 1)
+    if len(samples) < winlen:
+        return np.zeros(0), np.zeros(0)
+
+    numframes = 1 + (len(samples) - winlen) // hop
+    frames = np.lib.stride_tricks.as_strided(samples,
+                                             shape=(numframes, winlen),
+                                             strides=(samples.strides[0] * hop, samples.strides[0]))
+    peaks = np.abs(frames).max(1)
+    window = np.hanning(winlen)
+
+    #band-limited interpolation of the autocorrelation by zero padding
+    #the power spectrum (lags in units of 1/F0_LAG_OVERSAMPLING samples):
+    nfft = 2 ** int(math.ceil(math.log(2 * winlen, 2)))
+    upnfft = nfft * F0_LAG_OVERSAMPLING
+    numlags = (maxlag + 2) * F0_LAG_OVERSAMPLING
+    wac = np.fft.irfft(np.abs(np.fft.rfft(window, nfft)) ** 2, upnfft)[:numlags]
+    r = np.empty((numframes, numlags))
+    for i in xrange(0, numframes, F0_CHUNKSIZE):
+        chunk = frames[i:i + F0_CHUNKSIZE]
+        chunk = chunk - chunk.mean(1)[:, np.newaxis]
+        ac = np.fft.irfft(np.abs(np.fft.rfft(chunk * window, nfft)) ** 2, upnfft)[:, :numlags]
+        energy = ac[:, 0].copy()
+        energy[energy == 0.0] = 1.0
+        r[i:i + F0_CHUNKSIZE] = (ac / energy[:, np.newaxis]) / (wac / wac[0])
+
+    #candidates with parabolic interpolation of the peaks:
+    minlag *= F0_LAG_OVERSAMPLING
+    maxlag *= F0_LAG_OVERSAMPLING
+    centre = r[:, minlag:maxlag + 1]
+    left, right = r[:, minlag - 1:maxlag], r[:, minlag + 1:maxlag + 2]
+    denom = left - 2 * centre + right
+    candidates = (centre >= left) & (centre >= right) & (denom < 0.0)
+    shift = np.where(candidates, 0.5 * (left - right) / np.where(candidates, denom, -1.0), 0.0)
+    height = centre - 0.25 * (left - right) * shift
+    cost = octave_cost * np.log2(min_pitch * np.arange(minlag, maxlag + 1) / (F0_LAG_OVERSAMPLING * samplerate))
+    best = np.argmax(np.where(candidates, height - cost, -np.inf), 1)
+    rows = np.arange(numframes)
+    lags = best + minlag
+    strength = np.where(candidates[rows, best], height[rows, best], 0.0)
+    shift = shift[rows, best]
+    voiced = (strength > voicing_threshold) & (peaks > silence_threshold * np.abs(samples).max())
+
+    times = (np.arange(numframes) * hop + winlen / 2) / samplerate
+    f0 = np.where(voiced, F0_LAG_OVERSAMPLING * samplerate / (lags + shift), 0.0)
+    return times, f0
+
+
+def wave_bytes(samples, samplerate):
+    """ Contents of a WAV file containing 'samples' (sample type is
+        kept), encoded in memory...
+    """
+    buf = io.BytesIO()
+    wavfile.write(buf, samplerate, samples)
+    return buf.getvalue()
+
+
+def pitch_contour(samples, samplerate, min_pitch=PITCH_MIN, max_pitch=PITCH_MAX,
+                  timestep=0.01, semitones=False):
+    """ F0 contour for display: returns (times, f0) in Hz or semitones
+        relative to 1 Hz, with NaN in unvoiced frames (so that plotted
+        lines are broken there)...
+    """
+    times, f0 = estimate_f0(np.asarray(samples, dtype=np.float64), samplerate,
+                            min_pitch, max_pitch, timestep)
+    voiced = f0 > 0.0
+    f0 = np.where(voiced, f0, np.nan)
+    if semitones:
+        f0[voiced] = 12.0 * np.log2(f0[voiced])
+    return times, f0
+
+
+def mel_filterbank(numfilters, nfft, samplerate):
+    """ Triangular filters equally spaced on the mel scale between 0
+        Hz and the Nyquist frequency, shape (numfilters, nfft // 2 + 1)...
+    """
+    mel = lambda hz: 1127.0 * np.log(1.0 + hz / 700.0)
+    hz = lambda m: 700.0 * (np.exp(m / 1127.0) - 1.0)
+    edges = hz(np.linspace(0.0, mel(samplerate / 2.0), numfilters + 2))
+    freqs = np.arange(nfft // 2 + 1) * samplerate / nfft
+    lower, centre, upper = edges[:-2, np.newaxis], edges[1:-1, np.newaxis], edges[2:, np.newaxis]
+    rising = (freqs - lower) / (centre - lower)
+    falling = (upper - freqs) / (upper - centre)
+    return np.maximum(0.0, np.minimum(rising, falling))
+
+
+def melcep(samples, samplerate, shift=0.005, factor=5.0, preemph=0.97,
+           fbank_order=24, melcep_order=12, deltas=True):
+    """ Fixed frame rate mel cepstra from samples in memory, following
+        sig2fv's "-coefs melcep [-delta melcep]" analysis: frames of
+        'factor' * 'shift' seconds (Hamming windowed, pre-emphasised)
+        centred at multiples of 'shift', log mel filterbank energies
+        and a DCT (c1..c'melcep_order'). Returns (times, values) with
+        delta coefficients appended if 'deltas'...
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    samples = np.append(samples[:1], samples[1:] - preemph * samples[:-1])
+    hop = shift * samplerate
+    winlen = int(round(factor * shift * samplerate))
+    numframes = int(len(samples) / hop)
+    centres = np.round((np.arange(numframes) + 1) * hop).astype(np.int64)
+    #pad so that every frame is complete:
+    padded = np.concatenate([np.zeros(winlen), samples, np.zeros(winlen)])
+    starts = centres - winlen // 2 + winlen
+    frames = padded[starts[:, np.newaxis] + np.arange(winlen)] * np.hamming(winlen)
+
+    nfft = 2 ** int(math.ceil(math.log(winlen, 2)))
+    power = np.abs(np.fft.rfft(frames, nfft)) ** 2
+    fbank = np.log(np.maximum(np.dot(power, mel_filterbank(fbank_order, nfft, samplerate).T), 1e-10))
+    n = np.arange(fbank_order)
+    dct = np.cos(np.pi * np.arange(1, melcep_order + 1)[:, np.newaxis] * (n + 0.5) / fbank_order)
+    values = np.sqrt(2.0 / fbank_order) * np.dot(fbank, dct.T)
+    if deltas:
+        #regression over +-2 frames (edges repeated):
+        ext = np.concatenate([values[:1], values[:1], values, values[-1:], values[-1:]])
+        delta = (ext[3:-1] - ext[1:-3] + 2.0 * (ext[4:] - ext[:-4])) / 10.0
+        values = np.hstack([values, delta])
+    return centres / samplerate, values
+
+
+def place_pitchmarks(samples, samplerate, times, f0, search_range=0.2, min_correlation=0.5):
+    """ Pitchmarks in voiced regions (similar to Praat's "To
+        PointProcess (periodic, cc)"): starting at the absolute peak of
+        each voiced region, marks are placed forwards and backwards by
+        cross-correlating the current period with the waveform around
+        the position predicted by the local F0...
+    """
+    pitchmarks = []
+    if len(times) == 0:
+        return pitchmarks
+    timestep = times[1] - times[0] if len(times) > 1 else 0.01
+    voiced = np.concatenate(([False], f0 > 0.0, [False]))
+    starts = np.flatnonzero(voiced[1:] & ~voiced[:-1])
+    ends = np.flatnonzero(~voiced[1:] & voiced[:-1])
+    for start, end in zip(starts, ends):
+        segtimes = times[start:end]
+        segf0 = f0[start:end]
+        segstart = int(max(0.0, segtimes[0] - timestep / 2) * samplerate)
+        segend = int(min(len(samples) / samplerate, segtimes[-1] + timestep / 2) * samplerate)
+        if segend - segstart < 2 * samplerate / segf0.min():
+            continue
+        peak = segstart + int(np.argmax(np.abs(samples[segstart:segend])))
+        segmarks = [peak]
+        for direction in [+1, -1]:
+            current = peak
+            while True:
+                period = int(round(samplerate / np.interp(current / samplerate, segtimes, segf0)))
+                halfperiod = period // 2
+                deviation = max(1, int(search_range * period))
+                lo = current + direction * period - deviation
+                hi = current + direction * period + deviation
+                if lo - halfperiod < segstart or hi + halfperiod >= segend:
+                    break
+                reference = samples[current - halfperiod:current + halfperiod]
+                candidates = samples[lo - halfperiod:hi + halfperiod]
+                cc = np.correlate(candidates, reference, "valid")
+                best = int(np.argmax(cc))
+                #stop when the waveform is no longer periodic:
+                energy = np.sum(candidates[best:best + len(reference)] ** 2) * np.sum(reference ** 2)
+                if energy <= 0.0 or cc[best] / math.sqrt(energy) < min_correlation:
+                    break
+                current = lo + best
+                segmarks.append(current)
+        if len(segmarks) > 1:
+            pitchmarks.extend(sorted(segmarks))
+    return [mark / samplerate for mark in pitchmarks]
+
+
 class PMExtractor():
     """ Facilitates pitchmark extraction using "praat" and filling of
         non-periodic parts with default stepsize marks...
@@ -51,96 +258,92 @@ class PMExtractor():
     PRAAT_BIN = PRAAT_BIN
     PRAAT_GET_PM = PRAAT_GET_PM
 
-    def __init__(self, min_pitch=50.0, max_pitch=200.0, def_stepsize=0.005):
+    def __init__(self, min_pitch=50.0, max_pitch=200.0, def_stepsize=0.005, backend=DEF_PM_BACKEND):
         """Initialise...
         """
+        if backend not in PM_BACKENDS:
+            raise Exception("Unknown pitchmark backend '%s'..." % backend)
         self.pitchmarks = []
         self.min_pitch = min_pitch
         self.max_pitch = max_pitch
         self.def_stepsize = def_stepsize
+        self.backend = backend
 
 
     def pm_fill(self, new_end):
         """ This function is basically a port of the same named function in speechtools/sigpr/pitchmark.cc
-            by Gerrit Botha.
+            by Gerrit Botha. Vectorised version giving identical output
+            to the original loop: marks closer than 1/max_pitch to the
+            previous (original) mark are dropped and gaps longer than
+            1/min_pitch are filled with equally spaced marks at
+            approximately the default stepsize.
         """
-
-        new_pm = []
         min = float(1.0/self.max_pitch)
         max = float(1.0/self.min_pitch)
-        default = self.def_stepsize
-
-        npm = 0
-        last = 0.0
-        dropped=0
-        added=0
-
-        for j in range(0,len(self.pitchmarks)):
-            current = float(self.pitchmarks[j])
-
-            if (current > new_end):
-                break
-
-            if ((current - last) < min):
-                # drop current pitchmark
-                dropped = dropped + 1
-            elif ((current-last) > max):
-                # interpolate
-                num = int(math.floor((current - last)/float(default)))
-                size = float(current-last)/float(num)
-                for i in range(1,num + 1):
-                    new_pm.append(float(last + i * float(size)))
-                    npm = npm + 1
-                    added = added + 1
-            else:
-                new_pm.append(self.pitchmarks[j])
-                npm = npm + 1
-
-            last=current
-
-
+        default = float(self.def_stepsize)
+
+        pm = np.asarray(self.pitchmarks, dtype=np.float64)
+        beyond = np.flatnonzero(pm > new_end)
+        if len(beyond):
+            pm = pm[:beyond[0]]
+
+        #each mark is compared to the previous original mark (dropped or not)
+        last = np.concatenate(([0.0], pm[:-1]))
+        diff = pm - last
+        drop = diff < min
+        interp = ~drop & (diff > max)
+        num = np.ones(len(pm), dtype=np.int64)
+        num[interp] = np.floor(diff[interp] / default)
+        num[drop] = 0
+
+        owner = np.repeat(np.arange(len(pm)), num)
+        i = np.arange(len(owner)) - np.repeat(np.cumsum(num) - num, num) + 1
+        size = diff / np.where(interp, num, 1)
+        new_pm = np.where(interp[owner], last[owner] + i * size[owner], pm[owner])
+
+        last = pm[-1] if len(pm) else 0.0
         if ((new_end - last) > max):
             # interpolate
-            num = int(math.floor((new_end - last)/float(default)))
+            num = int(math.floor((new_end - last)/default))
             size = float(float(new_end -last)/float(num))
-            for i in range(1,num + 1):
-                new_pm.append(float(last + i * float(size)))
-                npm = npm + 1
-                added = added + 1
+            new_pm = np.concatenate((new_pm, last + np.arange(1, num + 1) * size))
 
-        self.pitchmarks = new_pm
+        self.pitchmarks = new_pm.tolist()
 
 
     def write_est_file(self, pitchmark_file):
         """Writes the self.pitchmarks sequence to an ASCII EST file...
            Author: Gerrit Botha
+           ('pitchmark_file' may be an open file, in which case we
+           assume the caller will close the file...)
         """
-        number_of_frames  = len(self.pitchmarks); 
-
-        if not isinstance(pitchmark_file, file):
-            outfile = open(pitchmark_file, "wb")
-        else: #open file passed in...
-            outfile = pitchmark_file
-        outfile.write("EST_File Track\n")
-        outfile.write("DataType ascii\n")
-        outfile.write("NumFrames " + str(number_of_frames) + "\n")
-        outfile.write("NumChannels 0\n")
-        outfile.write("NumAuxChannels 0\n")
-        outfile.write("EqualSpace 0\n")
-        outfile.write("BreaksPresent true\n")
-        outfile.write("EST_Header_End\n")
-        for i in range(0,len(self.pitchmarks)):
-            outfile.write(str(self.pitchmarks[i]))
-            for i in range(len((str(self.pitchmarks[i])))-1,7):
-                outfile.write('0')
-            outfile.write("\t1\n")
-        if not isinstance(pitchmark_file, file):
-            outfile.close()
-        #otherwise we assume the caller will close the file...
+        write_track(pitchmark_file, self.pitchmarks)
 
 
     def get_pmarks(self, wavfilelocation):
-        """Use "praat" to extract pmarks for periodic parts...
+        """Extract pmarks for periodic parts (using the configured
+           backend) and fill the rest...
+        """
+        if self.backend == "praat":
+            endtime = self._get_pmarks_praat(wavfilelocation)
+        else:
+            endtime = self._get_pmarks_native(wavfilelocation)
+
+        self.pm_fill(endtime)
+        self.pm_fill(endtime)   # [sic]
+
+
+    def _get_pmarks_native(self, wavfilelocation):
+        """In-process pitchmark extraction, returns the end time...
+        """
+        samples, samplerate = read_wave(wavfilelocation)
+        times, f0 = estimate_f0(samples, samplerate, self.min_pitch, self.max_pitch)
+        self.pitchmarks = place_pitchmarks(samples, samplerate, times, f0)
+        return len(samples) / samplerate
+
+
+    def _get_pmarks_praat(self, wavfilelocation):
+        """Use "praat" to extract pmarks, returns the end time...
         """
         
         #write temp file - Praat script
@@ -164,10 +367,7 @@ class PMExtractor():
         
         self.pitchmarks = map(float, values[1:])
         
-        endtime = float(values[0])
-
-        self.pm_fill(endtime)
-        self.pm_fill(endtime)   # [sic]
+        return float(values[0])
 
 
 
@@ -207,44 +407,24 @@ class FeatExtractor():
         self.coefs_type = coefs_type
         self.delta_type = delta_type
         self.acc_type = acc_type
-        self.featvectors = []
+        self.times = np.zeros(0)
+        self.featvectors = np.zeros((0, 0), dtype=np.float32)
         self.numchannels = 0
 
         
     def _read_ascii_est_featfile(self, estfilename):
-        """ Very specialised reading of EST file...
+        """ Very specialised reading of EST file, returns (times,
+            featvectors) sorted by time...
         """
-        
-        header = {}
-        featvectors = {}
-
-        in_header = True
-        with open(estfilename) as infh:
-            for line in infh:
-                if line.strip() == "EST_Header_End":
-                    #sanity checks
-                    if (header["EST_File"] != "Track" or
-                        header["DataType"] != "ascii" or
-                        header["BreaksPresent"] != "true"):
-                        raise Exception("Incompatible feature file...")
-                    in_header = False
-                    continue
-                if in_header:
-                    linelist = line.split()
-                    header[linelist[0]] = linelist[1]
-                else:
-                    linelist = map(float, line.split())
-                    featvectors[linelist[0]] = linelist[2:]     #ignoring "Breaks" field...
-
-        #more sanity checks...
-        if len(featvectors) != int(header["NumFrames"]):
-            raise Exception("'NumFrames' does not match number of frames read...")
+        times, breaks, values, header = read_track(estfilename)
+        #sanity checks
+        if (header["DataType"] != "ascii" or
+            breaks is None):
+            raise Exception("Incompatible feature file...")
         self.numchannels = int(header["NumChannels"])
-        for t in featvectors:
-            if len(featvectors[t]) != self.numchannels:
-                raise Exception("Channels/Feature-components missing at '%s'" % t)
 
-        return featvectors
+        order = np.argsort(times, kind="mergesort")     #ignoring "Breaks" field...
+        return times[order], values[order].astype(np.float32)
     
             
     def write_htk_featfile(self, featfilelocation):
@@ -255,21 +435,12 @@ class FeatExtractor():
             raise Exception("No features loaded... Cowardly refusing to write empty file...")
 
         with open(featfilelocation, "wb") as outfh:
-        
-            # write header
-            header = struct.pack(">IIHH",
-                                 len(self.featvectors),
-                                 int(self.def_stepsize * 10000000),
-                                 self.numchannels * FeatExtractor.HTK_BYTES_PER_VAL,
-                                 FeatExtractor.HTK_USER_KIND)
-            outfh.write(header)
-
-            #write frames
-            for frame_time in sorted(self.featvectors):
-                framestring = ""
-                for value in self.featvectors[frame_time]:
-                    framestring += struct.pack(">f", value)
-                outfh.write(framestring)
+            outfh.write(struct.pack(HTK_HEADER_FORMAT,
+                                    len(self.featvectors),
+                                    int(self.def_stepsize * 10000000),
+                                    self.numchannels * FeatExtractor.HTK_BYTES_PER_VAL,
+                                    FeatExtractor.HTK_USER_KIND))
+            outfh.write(np.ascontiguousarray(self.featvectors, dtype=HTK_DTYPE).tobytes())
 
     
     def write_times(self, timesfilelocation):
@@ -277,7 +448,7 @@ class FeatExtractor():
         """
 
         with open(timesfilelocation, "w") as outfh:
-            outfh.write("\n".join(map(str, sorted(self.featvectors))))
+            outfh.write("\n".join(map(str, self.times.tolist())))
         
 
 
@@ -323,10 +494,28 @@ class FeatExtractor():
         p.communicate()
         temp_pm_fh.close()
 
-        self.featvectors = self._read_ascii_est_featfile(temp_feat_fh.name)
+        self.times, self.featvectors = self._read_ascii_est_featfile(temp_feat_fh.name)
         temp_feat_fh.close()        
 
 
+def read_htk_featfile(featfilelocation):
+    """ Maps an HTK feature file (as written by
+        FeatExtractor.write_htk_featfile()) without copying, returns
+        (featvectors, sampperiod, parmkind) where 'featvectors' is a
+        read-only (numframes, numchannels) big-endian float32 array...
+    """
+    with open(featfilelocation, "rb") as infh:
+        numframes, sampperiod, sampsize, parmkind = struct.unpack(HTK_HEADER_FORMAT, infh.read(HTK_HEADER_SIZE))
+    if sampsize % FeatExtractor.HTK_BYTES_PER_VAL != 0:
+        raise Exception("'%s': sample size %s is not a multiple of %s bytes..." % (featfilelocation, sampsize, FeatExtractor.HTK_BYTES_PER_VAL))
+    if numframes == 0:
+        featvectors = np.zeros((0, sampsize // FeatExtractor.HTK_BYTES_PER_VAL), dtype=HTK_DTYPE)
+    else:
+        featvectors = np.memmap(featfilelocation, dtype=HTK_DTYPE, mode="r", offset=HTK_HEADER_SIZE,
+                                shape=(numframes, sampsize // FeatExtractor.HTK_BYTES_PER_VAL))
+    return featvectors, sampperiod * 1e-7, parmkind
+
+
 def test_pme():
     #PITCHMARKS EXTRACTION
     pme = PMExtractor()